@@ -22,9 +22,15 @@ and
 
 A b C d E F and A. b. C. d. E. F.
 
+The :class:`SegmentDisplay` widget is a row of segments showing a number.
+
+Ex::
+
+disp = SegmentDisplay(digits=3, fmt="{:04.1f}", number=12.3)
+
 '''
 
-__all__ = ('Segment',)
+__all__ = ('Segment', 'SegmentDisplay')
 
 __title__ = 'garden.segment'
 __version__ = '0.21'
@@ -39,6 +45,7 @@ from kivy.properties import ListProperty
 from kivy.properties import BoundedNumericProperty
 from kivy.properties import NumericProperty
 from kivy.uix.relativelayout import RelativeLayout
+from kivy.uix.boxlayout import BoxLayout
 from kivy.graphics import Color, Ellipse, Mesh, Scale, Rectangle
 from kivy.utils import get_color_from_hex
 from kivy.uix.label import Label
@@ -143,6 +150,8 @@ class Segment(RelativeLayout):
                 35, 0, 0, 0,
                 ]
 
+        self.segments = [seg_1, seg_2, seg_3, seg_4, seg_5, seg_6, seg_7]
+
         # Drawing association
         type_0 = [seg_1, seg_2, seg_3, seg_5, seg_6, seg_7]
         type_1 = [seg_3, seg_6]
@@ -161,151 +170,191 @@ class Segment(RelativeLayout):
         type_E = [seg_1, seg_2, seg_4, seg_5, seg_7]
         type_F = [seg_1, seg_2, seg_4, seg_5]
 
-        # Drawing association for shadows.
-        type_0s = [ seg_4 ]
-        type_1s = [ seg_1, seg_2, seg_4, seg_5, seg_7 ]
-        type_2s = [ seg_2, seg_6 ]
-        type_3s = [ seg_2, seg_5 ]
-        type_4s = [ seg_1, seg_5, seg_7 ]
-        type_5s = [ seg_3, seg_5 ]
-        type_6s = [ seg_3 ]
-        type_7s = [ seg_2, seg_4, seg_5, seg_7 ]
-        type_8s = [ ]
-        type_9s = [ seg_5 ]
-        type_As = [ seg_7 ]
-        type_bs = [ seg_1, seg_3 ]
-        type_Cs = [ seg_3, seg_4, seg_6 ]
-        type_ds = [ seg_1, seg_2, ]
-        type_Es = [ seg_3, seg_6 ]
-        type_Fs = [ seg_3, seg_6, seg_7 ]
-
         # Routing association
         self.type_dic = {
                 "0" : type_0,
-                "0.": type_0,
                 "1" : type_1,
-                "1.": type_1,
                 "2" : type_2,
-                "2.": type_2,
                 "3" : type_3,
-                "3.": type_3,
                 "4" : type_4,
-                "4.": type_4,
                 "5" : type_5,
-                "5.": type_5,
                 "6" : type_6,
-                "6.": type_6,
                 "7" : type_7,
-                "7.": type_7,
                 "8" : type_8,
-                "8.": type_8,
                 "9" : type_9,
-                "9.": type_9,
                 "A" : type_A,
-                "A.": type_A,
                 "b" : type_b,
-                "b.": type_b,
                 "C" : type_C,
-                "C.": type_C,
                 "d" : type_d,
-                "d.": type_d,
                 "E" : type_E,
-                "E.": type_E,
                 "F" : type_F,
-                "F.": type_F,
                 }
 
-        # Routing association for shadows.
-        self.type_dic_s = {
-                "0" : type_0s,
-                "0.": type_0s,
-                "1" : type_1s,
-                "1.": type_1s,
-                "2" : type_2s,
-                "2.": type_2s,
-                "3" : type_3s,
-                "3.": type_3s,
-                "4" : type_4s,
-                "4.": type_4s,
-                "5" : type_5s,
-                "5.": type_5s,
-                "6" : type_6s,
-                "6.": type_6s,
-                "7" : type_7s,
-                "7.": type_7s,
-                "8" : type_8s,
-                "8.": type_8s,
-                "9" : type_9s,
-                "9.": type_9s,
-                "A" : type_As,
-                "A.": type_As,
-                "b" : type_bs,
-                "b.": type_bs,
-                "C" : type_Cs,
-                "C.": type_Cs,
-                "d" : type_ds,
-                "d.": type_ds,
-                "E" : type_Es,
-                "E.": type_Es,
-                "F" : type_Fs,
-                "F.": type_Fs,
-                }
+        # Glyph table : value -> (lit flag for each segment, lit decimal
+        # point).  Segments that are not lit are drawn in the shadow color.
+        self.glyphs = {}
+        for key, val in self.type_dic.items():
+            lit = tuple(
+                any(seg is segment for seg in val)
+                for segment in self.segments)
+            self.glyphs[key] = (lit, False)
+            self.glyphs[key + "."] = (lit, True)
 
-        # Binding refresh drawing method
+        # Build the canvas once.  A value change only updates colors.
+        self._build_canvas()
+
+        # Binding refresh drawing method
         self.bind(
-            pos=self._update_canvas, 
-            size=self._update_canvas,
-            value=self._update_canvas
+            value=self._update_canvas,
+            color=self._update_canvas,
+            shadow=self._update_canvas,
+            scale=self._update_scale
             )
 
+    def _build_canvas(self):
+        ''' Create one Color and Mesh per segment, plus the decimal point.
+        '''
+        self._seg_colors = []
+        with self.canvas:
+            self._scale = Scale(self.scale)
+            for segment in self.segments:
+                self._seg_colors.append(Color(0, 0, 0, 0))
+                Mesh(
+                    vertices=segment,
+                    indices=self.indice,
+                    mode=self.xmode
+                    )
+            self._dp_color = Color(0, 0, 0, 0)
+            Ellipse(
+                pos=(135, 0),
+                size=(25,25),
+                segments=360
+                )
+        self._update_canvas()
+
+    def _update_scale(self, *args):
+        self._scale.xyz = (self.scale, self.scale, self.scale)
+
     def _update_canvas(self, *args):
 
-        with self.canvas:
+        self.shadowColor = [ 
+            self.color[0]*self.shadow, 
+            self.color[1]*self.shadow, 
+            self.color[2]*self.shadow 
+        ]
+        lit_rgba = (self.color[0], self.color[1], self.color[2], 1.)
+        shadow_rgba = (
+            self.shadowColor[0], self.shadowColor[1], self.shadowColor[2], 1.)
+
+        # Unknown values draw nothing.
+        glyph = self.glyphs.get(self.value)
+        if glyph is None:
+            for col in self._seg_colors:
+                col.a = 0.
+            self._dp_color.a = 0.
+            return
+
+        lit, dot = glyph
+        for col, on in zip(self._seg_colors, lit):
+            col.rgba = lit_rgba if on else shadow_rgba
+        self._dp_color.rgba = lit_rgba if dot else shadow_rgba
+
+
+def split_glyphs(text):
+    ''' Split a formatted number into segment values, with each decimal
+    point joined to the digit before it. "12.3" gives ["1", "2.", "3"].
+    '''
+    glyphs = []
+    for char in text:
+        if char == '.' and glyphs and not glyphs[-1].endswith('.'):
+            glyphs[-1] += char
+        else:
+            glyphs.append(char)
+    return glyphs
 
-            # Refresh
-            self.canvas.clear()
-
-            # Scale
-            Scale(self.scale)
-
-            self.shadowColor = [ 
-                self.color[0]*self.shadow, 
-                self.color[1]*self.shadow, 
-                self.color[2]*self.shadow 
-            ]
-
-            # Draw meshes
-            def make_mesh(self, ttype, *args):
-                ''' Drawing meshes
-                '''
-                for segment in ttype:
-                    Mesh(
-                        vertices=segment, 
-                        indices=self.indice, 
-                        mode=self.xmode
-                        )
-                if len(self.value) > 1:
-                    Color( self.color[0], self.color[1], self.color[2] )
-                Ellipse(
-                    pos=(135, 0), 
-                    size=(25,25), 
-                    segments=360
-                    )
 
+class SegmentDisplay(BoxLayout):
+    '''
+    SegmentDisplay class
 
-            # Avoid if session
-            Color( self.color[0], self.color[1], self.color[2] )
-            for key, val in self.type_dic.items():
-                if self.value == key:
-                    make_mesh(self, ttype=val)
+    The class`SegmentDisplay` widget is a row of :class:`Segment` widgets
+    showing one number.
 
-            # Draw other segments in shadow.
-            Color( self.shadowColor[0], self.shadowColor[1], self.shadowColor[2] ) 
-            for key, val in self.type_dic_s.items():
-                if self.value == key:
-                    make_mesh(self, ttype=val)
+    The number property is formatted with the fmt property, a str.format
+    spec, and split across digits segments.  Only the segments whose glyph
+    changed are updated.  A number too wide for the display shows E on
+    every digit.
 
-      
+    The scales property is an optional list of per digit scales.  Each
+    digit gets a width in proportion to its scale.
+
+    Ex::
+
+    disp = SegmentDisplay(digits=3, fmt="{:04.1f}", scales=[0.5, 0.5, 0.25])
+
+    '''
+
+    number = NumericProperty(0)
+    fmt = StringProperty('{:04.1f}')
+    digits = BoundedNumericProperty(3, min=1, max=16)
+    scale = BoundedNumericProperty(0.5, min=0.1, max=1, errorvalue=0.5)
+    scales = ListProperty([])
+    shadow = BoundedNumericProperty(0.4, min=0.0, max=0.91, errorvalue=0.4)
+    color = ListProperty( list((1., 0, 0)) )
+
+    def __init__(self, **kwargs):
+        self.segs = []
+        self._shown = []
+        super(SegmentDisplay, self).__init__(**kwargs)
+        self._build_digits()
+        self.bind(
+            digits=self._build_digits,
+            scales=self._build_digits,
+            scale=self._build_digits,
+            color=self._update_style,
+            shadow=self._update_style,
+            number=self._update_digits,
+            fmt=self._update_digits
+            )
+
+    def _build_digits(self, *args):
+        ''' Create one Segment per digit.
+        '''
+        self.clear_widgets()
+        count = int(self.digits)
+        scales = list(self.scales[:count])
+        scales += [self.scale] * (count - len(scales))
+        total = float(sum(scales))
+        self.segs = []
+        for digit_scale in scales:
+            seg = Segment()
+            seg.scale = digit_scale
+            seg.size_hint_x = digit_scale / total
+            self.segs.append(seg)
+            self.add_widget(seg)
+        self._shown = [None] * count
+        self._update_style()
+        self._update_digits()
+
+    def _update_style(self, *args):
+        for seg in self.segs:
+            seg.color = self.color
+            seg.shadow = self.shadow
+
+    def _update_digits(self, *args):
+        ''' Push the new glyphs to the segments that changed.
+        '''
+        count = len(self.segs)
+        glyphs = split_glyphs(self.fmt.format(self.number))
+        if len(glyphs) > count:
+            glyphs = ['E'] * count
+        else:
+            glyphs = [' '] * (count - len(glyphs)) + glyphs
+        shown = self._shown
+        for i in range(count):
+            if glyphs[i] != shown[i]:
+                shown[i] = glyphs[i]
+                self.segs[i].value = glyphs[i]
 
 
 class SegmentTestApp(App):
@@ -320,6 +369,7 @@ class SegmentTestApp(App):
             seg.value = s[0]
             seg1.value = s[1:3]
             seg2.value = s[3]
+            disp.number = counts
             counts += 0.1
 
         box = StackLayout( orientation='lr-tb' )
@@ -335,6 +385,10 @@ class SegmentTestApp(App):
         box.add_widget(seg1)
         box.add_widget(seg2)
 
+        disp = SegmentDisplay(scales=[0.4, 0.4, 0.25], width=3*w, height=h,
+            size_hint=(None,None) )
+        box.add_widget(disp)
+
         Clock.schedule_interval( refresh_task, 0.1 )
 
         return box
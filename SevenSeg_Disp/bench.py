@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4 nu
+
+'''
+Segment benchmark
+=================
+
+Times a value change on the :class:`Segment` widget, against the old way
+of clearing the canvas and rebuilding every mesh on each change.
+
+Ex::
+
+python -m SevenSeg_Disp.bench 2000
+
+'''
+
+import sys
+import timeit
+
+from kivy.graphics import Color, Ellipse, Mesh, Scale
+
+from SevenSeg_Disp import Segment
+
+
+class RebuildSegment(Segment):
+    '''
+    Segment that redraws the way version 0.21 did : clear the canvas and
+    build every mesh and the 360 segment ellipse on each change.
+    '''
+
+    def _build_canvas(self):
+        pass
+
+    def _update_scale(self, *args):
+        pass
+
+    def _update_canvas(self, *args):
+        glyph = self.glyphs.get(self.value)
+        self.canvas.clear()
+        if glyph is None:
+            return
+        lit, dot = glyph
+        shadow = [c * self.shadow for c in self.color]
+        with self.canvas:
+            Scale(self.scale)
+            for rgb, on in ((self.color, True), (shadow, False)):
+                Color(rgb[0], rgb[1], rgb[2])
+                for segment, seg_on in zip(self.segments, lit):
+                    if seg_on == on:
+                        Mesh(
+                            vertices=segment,
+                            indices=self.indice,
+                            mode=self.xmode
+                            )
+                if dot:
+                    Color(self.color[0], self.color[1], self.color[2])
+                Ellipse(
+                    pos=(135, 0),
+                    size=(25,25),
+                    segments=360
+                    )
+
+
+def per_update(cls, count):
+    ''' Seconds per value change, cycling through all the digits.
+    '''
+    seg = cls(scale=0.5, value="0")
+    values = ["0", "1.", "2", "3.", "4", "5.", "6", "7.", "8", "9."]
+    state = {'i': 0}
+
+    def change():
+        state['i'] += 1
+        seg.value = values[state['i'] % len(values)]
+
+    return timeit.timeit(change, number=count) / count
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    before = per_update(RebuildSegment, count)
+    after = per_update(Segment, count)
+    print("Rebuild per update : {0:.1f} us".format(before * 1e6))
+    print("Cached per update  : {0:.1f} us".format(after * 1e6))
+    print("Speed up           : {0:.1f}x".format(before / after))
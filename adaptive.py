@@ -0,0 +1,67 @@
+# =============================================================================
+#
+#	Adaptive Mold Open - Learns how long parts take to drop.
+#
+#	MoldOpenDelay is a fixed hold open time, set long enough for the worst
+#	part.  When parts reliably drop sooner than that, the rest of the delay
+#	is dead time every cycle.  OpenDelayTuner keeps the last few measured
+#	mold open to part detect times and shortens the open delay, and the
+#	eject window after it, to the slowest recent drop plus a safety margin.
+#	It never goes past the configured values.  A cycle whose part is still
+#	not down when the configured open delay and eject window would have
+#	ended throws away what it learned (the engine's Detect timeout), and
+#	the next cycles run the configured values again.
+#
+# =============================================================================
+from collections import deque
+
+
+# =============================================================================
+class OpenDelayTuner( object ):
+
+	# 'window' drops are remembered, and nothing changes until 'warmup' of
+	# them have been seen.
+	# -------------------------------------------------------------------------
+	def __init__( self, margin=0.2, window=20, warmup=5, minDelay=0.1 ):
+		self.margin = margin
+		self.warmup = warmup
+		self.minDelay = minDelay
+		self.drops = deque( maxlen=window )		# Mold open to part detect (s).
+
+	# -------------------------------------------------------------------------
+	def reset( self ):
+		self.drops.clear()
+
+	# Add the measured open to part detect time of a cycle, None if the part
+	# detect did not come in the configured time.
+	# -------------------------------------------------------------------------
+	def add( self, latency ):
+		if latency is None:
+			self.reset()		# Missed a part, back to the safe settings.
+		else:
+			self.drops.append( latency )
+
+	# Time after opening that all recent parts were down by, plus the margin.
+	# None while still learning.
+	# -------------------------------------------------------------------------
+	def target( self ):
+		if len( self.drops ) < self.warmup:
+			return None
+		return max( self.drops ) + self.margin
+
+	# Open delay to use, 'delay' is the configured one.
+	# -------------------------------------------------------------------------
+	def openDelay( self, delay ):
+		target = self.target()
+		if target is None:
+			return delay
+		return min( delay, max( self.minDelay, target ) )
+
+	# Eject end to use (s after the open delay).  'end' is the configured end,
+	# 'lastStep' the time of the last eject step, which always gets to run.
+	# -------------------------------------------------------------------------
+	def ejectEnd( self, end, lastStep, openDelay ):
+		target = self.target()
+		if target is None:
+			return end
+		return min( end, max( lastStep, target - openDelay ) )
@@ -0,0 +1,69 @@
+# =============================================================================
+#
+#	Temperature Trend Chart - Barrel temperature, setpoint and heater duty.
+#
+#	Raw samples never get plotted, the chart draws the per pixel column
+#	buckets of a TrendHistory (see trend.py).  The temperature is drawn as a
+#	min / max envelope per column, so short spikes still show after
+#	decimation.
+#
+# =============================================================================
+from kivy.clock import Clock
+from kivy.graphics import Color, Line, Rectangle
+from kivy.properties import NumericProperty
+from kivy.uix.widget import Widget
+
+from trend import SPANS
+
+
+# The chart widget.  Redraws once per second while it is on screen.
+# =============================================================================
+class TempChart( Widget ):
+
+	tempLo = NumericProperty( 0 )		# Bottom of the temperature scale.
+	tempHi = NumericProperty( 300 )		# Top of the temperature scale.
+	span = NumericProperty( SPANS[1] )
+
+	# -------------------------------------------------------------------------
+	def __init__( self, history, **kwargs ):
+		super( TempChart, self ).__init__( **kwargs )
+		self.history = history
+		with self.canvas:
+			Color( 0.1, 0.1, 0.1 )
+			self.bg = Rectangle( pos=self.pos, size=self.size )
+			Color( 1, 1, 0, 0.6 )
+			self.dutyLine = Line( points=[] )
+			Color( 0, 1, 0 )
+			self.spLine = Line( points=[] )
+			Color( 1, 0, 0 )
+			self.tempLine = Line( points=[] )
+		self.bind( pos=self.redraw, size=self.redraw, span=self.redraw )
+		Clock.schedule_interval( self.redraw, 1. )
+
+	# Stop redrawing, call when the chart is closed.
+	# -------------------------------------------------------------------------
+	def stop( self ):
+		Clock.unschedule( self.redraw )
+
+	# -------------------------------------------------------------------------
+	def redraw( self, *args ):
+		self.bg.pos = self.pos
+		self.bg.size = self.size
+		buf = self.history.buffers.get( self.span )
+		if buf is None:
+			return
+
+		colW = self.width / float( buf.columns )
+		scale = self.height / float( max( 1, self.tempHi - self.tempLo ) )
+		y0 = self.y - self.tempLo * scale
+		temp = []
+		sp = []
+		duty = []
+		for col, lo, hi, setPt, dutyMean in buf.buckets():
+			x = self.x + col * colW
+			temp += [ x, y0 + lo * scale, x, y0 + hi * scale ]
+			sp += [ x, y0 + setPt * scale ]
+			duty += [ x, self.y + dutyMean / 100. * self.height ]
+		self.tempLine.points = temp
+		self.spLine.points = sp
+		self.dutyLine.points = duty
@@ -0,0 +1,846 @@
+# =============================================================================
+#
+#	Arburg Control Engine - Runs the machine state machine on its own thread.
+#
+#	The engine owns the close, inj, blowOff and heater outputs and runs the
+#	Idle -> Close -> Cool -> Open -> Eject -> Detect cycle in a fixed rate
+#	loop, away from the Kivy main loop.  The GUI talks to it through two
+#	deques.  Commands go in with post() and state snapshots come out with
+#	latest().  A deque's append() and popleft() are atomic, so neither side
+#	takes a lock and a slow GUI can never hold up the cycle timing.
+#
+#	The part detect, e-stop and UPS inputs are edge driven.  The gpiozero
+#	callbacks stamp each edge and queue it for the engine, so a short part
+#	drop pulse can not slip between two polls.  The e-stop callback also
+#	turns the outputs off right away and measures how long that took.
+#
+#	The heater relay is driven by a HeaterController fed from a temperature
+#	source, normally TempSampler.reading(), which never blocks.
+#
+#	Modes and states are integers inside the engine.  Each mode has an entry
+#	action and a per pass handler looked up by index.  The auto cycle is a
+#	table of CycleState rows, one per state, giving its entry and exit
+#	actions and when to leave: a time guard (cycle time deadline) or an input
+#	guard.  A pass only looks at the row for the current state.  The mode and
+#	state properties give the names, which is all the GUI ever sees.
+#
+# =============================================================================
+import threading
+import traceback
+import time
+from collections import deque
+
+from adaptive import OpenDelayTuner
+from instrument import profiler
+from scheduler import LoopScheduler, PhaseClock, monotonic
+
+
+# Mode and state numbers, index into ControlEngine.modes and .states.
+INIT, ABORT, AUTO, AUTO2, AUTO_STOP, MANUAL = range( 6 )
+IDLE, CLOSE, INJECT, COOL, OPEN, EJECT, INJECT2, COOL2, DETECT = range( 9 )
+
+
+# Auto2 shot profile used when the settings do not give one.  Two shot
+# packing, 20s in the mold like the Auto defaults.
+DEFAULT_PROFILE = [ [ "inject", 6. ], [ "cool", 2. ], [ "inject", 4. ], [ "cool", 8. ] ]
+
+
+# Checks a shot profile, a list of [ kind, seconds ] stages where kind is
+# "inject" (inject solenoid on) or "cool" (off).  The mold stays closed for
+# the whole profile, and the first stage must be an inject.  Returns the
+# stages as a list of ( kind, seconds ) or raises ValueError.
+# -------------------------------------------------------------------------
+def shotStages( profile ):
+	stages = []
+	for stage in profile:
+		kind, tm = stage
+		kind = str( kind ).lower()
+		if kind not in [ "inject", "cool" ]:
+			raise ValueError( "Unknown Shot Stage -> {}".format( kind ) )
+		if tm < 0.:
+			raise ValueError( "Negative Shot Stage Time -> {}".format( tm ) )
+		stages.append( ( kind, float( tm ) ) )
+	if not stages or stages[0][0] != "inject":
+		raise ValueError( "Shot Profile must start with an inject stage" )
+	return stages
+
+
+# Eject sequences, [ seconds after the mold open delay, action ] steps.  The
+# double pump sequence used to be hard coded.  Its time values were 1.2,
+# 2.2, 3.2 or 0.7, 1.5, 2.0.
+EJECT_ACTIONS = [ "blowOn", "blowOff", "closeOn", "closeOff", "end" ]
+EJECT_SEQ = [ [ 0., "blowOn" ], [ 0.2, "blowOff" ], [ 0.4, "end" ] ]
+DOUBLE_EJECT_SEQ = [ [ 0., "blowOn" ], [ 0.7, "blowOff" ], [ 0.7, "closeOn" ],
+	[ 1.5, "closeOff" ], [ 2.0, "end" ] ]
+
+
+# Checks an eject sequence, a list of [ seconds, action ] steps with actions
+# from EJECT_ACTIONS.  "end" is when Eject is over, the last step time if it
+# is left out.  Returns ( steps, end ), the steps sorted by time as
+# ( seconds, action ), or raises ValueError.
+# -------------------------------------------------------------------------
+def ejectSequence( seq ):
+	steps = []
+	end = None
+	for step in seq:
+		tm, action = step
+		tm = float( tm )
+		if action not in EJECT_ACTIONS:
+			raise ValueError( "Unknown Eject Action -> {}".format( action ) )
+		if tm < 0.:
+			raise ValueError( "Negative Eject Step Time -> {}".format( tm ) )
+		if action == "end":
+			end = tm
+		else:
+			steps.append( ( tm, action ) )
+	steps.sort( key=lambda step: step[0] )		# Stable, same time keeps order.
+	if end is None:
+		end = steps[-1][0] if steps else 0.
+	if steps and steps[-1][0] > end:
+		raise ValueError( "Eject Step after the end -> {}".format( steps[-1][0] ) )
+	return steps, end
+
+
+# One row of the auto cycle table.
+#	enter / exit	Called with 'now' on entering / leaving the state.
+#	during			Called with 'now' each pass while in the state.
+#	deadline		Returns the cycle time the state ends at.
+#	guard			Returns True when the state should end now.
+#	next			State to go to, or a function returning it.
+#	wake			Returns the cycle time the state next needs a pass, if
+#					sooner than its deadline.
+#	mark			Stamp the phase clock on entry.
+# =============================================================================
+class CycleState( object ):
+
+	# -------------------------------------------------------------------------
+	def __init__( self, name, next=None, enter=None, exit=None, during=None,
+			deadline=None, guard=None, wake=None, mark=True ):
+		self.name = name
+		self.next = next
+		self.enter = enter
+		self.exit = exit
+		self.during = during
+		self.deadline = deadline
+		self.guard = guard
+		self.wake = wake
+		self.mark = mark
+
+
+# Builds the control engine.  Pass in the output and input objects (gpiozero
+# LED and Button, or anything with the same on/off/is_pressed interface).
+# Call attachInputs() to hook up the edge callbacks, then start() to run the
+# loop thread, or call step() directly to drive it.
+# =============================================================================
+class ControlEngine( threading.Thread ):
+
+	modes = [ "Init", "Abort", "Auto", "Auto2", "Auto_Stop", "Manual" ]
+	states = [ "Idle", "Close", "Inject", "Cool", "Open", "Eject", "Inject2", "Cool2", "Detect" ]
+
+	# -------------------------------------------------------------------------
+	def __init__( self, close, inj, blowOff, heater, estop, partDet,
+			period=0.01, clock=monotonic, partCount=0, totalCount=0,
+			heaterCtl=None, tempSource=None ):
+		super( ControlEngine, self ).__init__()
+		self.daemon = True
+
+		# Outputs owned by the engine.
+		self.close = close
+		self.inj = inj
+		self.blowOff = blowOff
+		self.heater = heater
+		# Inputs read by the engine.
+		self.estop = estop
+		self.partDet = partDet
+
+		self.heaterCtl = heaterCtl		# HeaterController, or None for no heat.
+		self.tempSource = tempSource	# Returns ( time stamp, deg C ) or None.
+
+		self.clock = clock
+		self.sched = LoopScheduler( period, clock )
+		self.phases = PhaseClock()
+		self.stopEvent = threading.Event()
+
+		self.commands = deque()				# GUI -> engine, see post().
+		self.snapshots = deque( maxlen=8 )	# Engine -> GUI, see latest().
+		self.lastSnapshot = None			# Newest snapshot, for other readers.
+		self.events = deque()				# Input edges -> engine, see edge().
+
+		# Called with a record dict for each finished cycle, see endCycle().
+		# These run on the engine thread, so they must not block.
+		self.cycleListeners = []
+		self.lastCycle = None
+
+		# Called with an entry tuple for each mode, state and output change,
+		# see note().  Also engine thread, must not block.
+		self.journalListeners = []
+		self.noted = None			# ( mode, state, outputs ) of the last note.
+
+		# Cycle settings.  Update from the GUI with post( "params", {...} ).
+		self.injTm = 10.			# Injection time (s).
+		self.cycTm = 20.			# Mold close time (s).
+		self.openDelay = 1.			# Min mold hold open delay (s).
+		self.adaptiveOpen = False	# Learn a shorter open delay, see adaptive.py.
+		self.openTuner = OpenDelayTuner()
+		self.cycleOpenDelay = 1.	# Open delay used this cycle.
+		self.doubleEject = False	# Double pump the blow off on eject.
+		self.doubleInject = False	# Start runs Auto2 with the shot profile.
+		self.shotProfile = shotStages( DEFAULT_PROFILE )
+		self.ejectSeq = ejectSequence( EJECT_SEQ )
+		self.doubleEjectSeq = ejectSequence( DOUBLE_EJECT_SEQ )
+		self.heaterEn = False		# Heater band temperature control on.
+		self.setPt = 200.			# Heater setpoint (deg C).
+		self.tempC = None			# Last temperature used by the heater loop.
+		self.tempTm = None			# Time stamp of that temperature.
+
+		self.modeId = INIT			# Default Mode
+		self.stateId = IDLE			# Default State
+		self.modeOld = None			# Detects changes in Mode.
+		self.timer = 0.				# Current cycle time (s).
+		self.partCount = partCount	# Parts made this session.
+		self.totalCount = totalCount	# Parts made over the life of the mold.
+		self.partDetLatch = False	# Set when the part detect switch trips.
+		self.partDetTm = None		# Time stamp of the last part detect edge.
+		self.partDetPressed = partDet.is_pressed	# Switch level, from the edges.
+		self.estopActive = estop.is_pressed
+		self.powerOK = True			# Cleared when the UPS reports power loss.
+		self.manualClose = False	# Close solenoid switch in Manual mode.
+		self.manualInj = False		# Inject solenoid switch in Manual mode.
+
+		# E-stop edge to outputs off time (s).
+		self.estopLatency = { 'count': 0, 'last': 0., 'max': 0. }
+
+		# Mold closed stages of the current cycle, see startCycle().
+		self.stages = []
+		self.stageEnds = []			# Cycle time each stage ends at.
+		self.stageStates = []		# State each stage runs in.
+		self.stage = 0
+		self.moldTm = 0.			# Cycle time the mold opens at.
+
+		# Eject steps, see enterEject().
+		self.ejectActions = {
+			"blowOn": self.blowOff.on,
+			"blowOff": self.blowOff.off,
+			"closeOn": self.close.on,
+			"closeOff": self.close.off,
+		}
+		self.ejectSteps = []
+		self.ejectStep = 0
+		self.ejectEnd = 0.
+		self.detectTimeout = None	# Cycle time the tuned timing is given up at.
+
+		# Called once on switching to each mode, and every pass in it.
+		self.modeEnter = [ self.modeInit, self.modeAbort, self.modeAuto,
+			self.modeAuto2, self.modeAutoStop, self.modeManual ]
+		self.modeTick = [ None, None, self.auto, self.auto, self.auto,
+			lambda now: self.manual() ]
+		self.cycle = self.cycleTable()
+
+
+	# Mode and state names.  Setting an unknown mode name aborts.
+	# -------------------------------------------------------------------------
+	@property
+	def mode( self ):
+		return self.modes[self.modeId]
+
+	@mode.setter
+	def mode( self, name ):
+		if name in self.modes:
+			self.modeId = self.modes.index( name )
+		else:
+			print( "Error: Unknown Mode -> {}".format( name ) )
+			self.modeId = ABORT
+
+	@property
+	def state( self ):
+		return self.states[self.stateId]
+
+	@state.setter
+	def state( self, name ):
+		self.stateId = self.states.index( name )
+
+
+	# Queue a command for the engine.  Safe to call from any thread.
+	#	"start"		- Cycle start button pressed, run Auto (Auto2 for double
+	#				  inject).
+	#	"stop"		- Cycle start released, finish this cycle then Manual.
+	#	"abort"		- Abort button down, everything off.
+	#	"release"	- Abort button up, go to Manual.
+	#	"manual"	- ( close, inj ) solenoid switches for Manual mode.
+	#	"totalCount"	- Part count of the mold, after a recipe switch.
+	#	"params"	- Dict of settings (InjTm, CycTm, MoldOpenDelay, DoubleEject,
+	#				  DoubleInject, ShotProfile, EjectSeq, DoubleEjectSeq,
+	#				  AdaptiveOpen, OpenMargin, HeaterEn, SetPt).
+	# -------------------------------------------------------------------------
+	def post( self, cmd, *args ):
+		self.commands.append( ( cmd, args ) )
+
+	# Hook the gpiozero edge callbacks up to the engine.  Part detect is
+	# active low, so the part drop is the release edge.  The UPS input reads
+	# pressed while the power is good.
+	# -------------------------------------------------------------------------
+	def attachInputs( self, ups=None ):
+		self.estop.when_pressed = self.estopEdge
+		self.estop.when_released = lambda: self.edge( "estopReleased" )
+		self.partDet.when_released = lambda: self.edge( "partDet" )
+		self.partDet.when_pressed = lambda: self.edge( "partClear" )
+		if ups is not None:
+			self.powerOK = ups.is_pressed
+			ups.when_released = lambda: self.edge( "powerLost" )
+			ups.when_pressed = lambda: self.edge( "powerOK" )
+
+	# Stamp an input edge and queue it for the engine.  Safe to call from the
+	# gpiozero callback thread.
+	# -------------------------------------------------------------------------
+	def edge( self, name, tm=None ):
+		if tm is None:
+			tm = self.clock()
+		self.events.append( ( name, tm ) )
+
+	# E-stop pressed edge.  Turn the outputs off right here on the callback
+	# thread instead of waiting for the next engine pass, then time it.  The
+	# time is from the callback starting, so it does not include the pin
+	# driver's own delay in calling us.
+	# -------------------------------------------------------------------------
+	def estopEdge( self ):
+		tm = self.clock()
+		self.estopActive = True		# Engine will not turn anything on now.
+		self.allOff()
+		latency = self.clock() - tm
+		self.estopLatency['count'] += 1
+		self.estopLatency['last'] = latency
+		if latency > self.estopLatency['max']:
+			self.estopLatency['max'] = latency
+		self.edge( "estop", tm )
+
+	# Returns the newest state snapshot, dropping any older ones.  Returns None
+	# if nothing new was published since the last call.
+	# -------------------------------------------------------------------------
+	def latest( self ):
+		snap = None
+		while True:
+			try:
+				snap = self.snapshots.popleft()
+			except IndexError:
+				return snap
+
+	# -------------------------------------------------------------------------
+	def stop( self ):
+		self.stopEvent.set()
+		if self.is_alive():
+			self.join( 1.0 )
+
+	# The engine loop.  Sleeps until the next tick or the next phase deadline,
+	# whichever comes first.
+	# -------------------------------------------------------------------------
+	def run( self ):
+		try:
+			while not self.stopEvent.is_set():
+				now = self.sched.tick()
+				self.step( now )
+				time.sleep( self.sched.timeToNext( self.deadlineAt() ) )
+		except Exception:
+			traceback.print_exc()
+		finally:
+			self.allOff()
+
+	# Run one pass of the engine at monotonic time stamp 'now'.
+	# -------------------------------------------------------------------------
+	@profiler.timed( "step" )
+	def step( self, now ):
+		self.doEvents()
+		self.doCommands( now )
+		self.updateEStop()
+
+		# Each modeXXX() function is called once on switching to that new mode.
+		if self.modeId != self.modeOld:
+			self.modeOld = self.modeId
+			self.modeEnter[self.modeId]()
+
+		tick = self.modeTick[self.modeId]
+		if tick is not None:
+			tick( now )
+
+		self.updateHeater( now )
+
+		# An e-stop edge can land part way through this pass.  Make sure
+		# nothing the pass turned on stays on.
+		if self.estopActive:
+			self.allOff()
+
+		self.noteChanges( now )
+		self.publish( now )
+
+	# Handle the input edges queued by the gpiozero callbacks.
+	# -------------------------------------------------------------------------
+	def doEvents( self ):
+		while True:
+			try:
+				name, tm = self.events.popleft()
+			except IndexError:
+				return
+
+			if name == "partDet":
+				# Latch the part detect until the mold opens on the next cycle.
+				self.partDetLatch = True
+				self.partDetTm = tm
+				self.partDetPressed = False
+			elif name == "partClear":
+				self.partDetPressed = True
+			elif name == "estop":
+				self.estopActive = True
+				self.note( "EStop", tm )
+			elif name == "estopReleased":
+				self.estopActive = False
+			elif name == "powerLost":
+				self.powerOK = False
+				self.note( "PowerLost", tm )
+			elif name == "powerOK":
+				self.powerOK = True
+				self.note( "PowerOK", tm )
+
+	# -------------------------------------------------------------------------
+	def doCommands( self, now ):
+		while True:
+			try:
+				cmd, args = self.commands.popleft()
+			except IndexError:
+				return
+
+			if cmd == "start":
+				if self.modeId != ABORT and not self.estopActive:
+					self.modeId = AUTO2 if self.doubleInject else AUTO
+			elif cmd == "stop":
+				if self.modeId in ( AUTO, AUTO2 ):
+					self.modeId = AUTO_STOP
+			elif cmd == "abort":
+				self.allOff()
+				self.timer = 0.
+				self.modeId = ABORT
+				self.stateId = IDLE
+			elif cmd == "release":
+				if not self.estopActive:
+					self.modeId = MANUAL
+					self.stateId = IDLE
+			elif cmd == "manual":
+				self.manualClose, self.manualInj = args
+			elif cmd == "totalCount":
+				self.totalCount = args[0]
+				self.note( "Count", now )
+			elif cmd == "params":
+				self.setParams( args[0] )
+			else:
+				print( "Error: Unknown Command -> {}".format( cmd ) )
+
+	# -------------------------------------------------------------------------
+	def setParams( self, params ):
+		self.injTm = params.get( 'InjTm', self.injTm )
+		self.cycTm = params.get( 'CycTm', self.cycTm )
+		self.openDelay = params.get( 'MoldOpenDelay', self.openDelay )
+		adaptive = params.get( 'AdaptiveOpen', self.adaptiveOpen )
+		if adaptive != self.adaptiveOpen:
+			self.adaptiveOpen = adaptive
+			self.openTuner.reset()
+		self.openTuner.margin = params.get( 'OpenMargin', self.openTuner.margin )
+		self.doubleEject = params.get( 'DoubleEject', self.doubleEject )
+		self.doubleInject = params.get( 'DoubleInject', self.doubleInject )
+		if params.get( 'ShotProfile' ) is not None:
+			try:
+				self.shotProfile = shotStages( params['ShotProfile'] )
+			except ( ValueError, TypeError ) as e:
+				print( "Error: Bad Shot Profile -> {}".format( e ) )
+		for key, attr in [ ( 'EjectSeq', 'ejectSeq' ), ( 'DoubleEjectSeq', 'doubleEjectSeq' ) ]:
+			if params.get( key ) is not None:
+				try:
+					setattr( self, attr, ejectSequence( params[key] ) )
+				except ( ValueError, TypeError ) as e:
+					print( "Error: Bad {} -> {}".format( key, e ) )
+		self.heaterEn = params.get( 'HeaterEn', self.heaterEn )
+		self.setPt = params.get( 'SetPt', self.setPt )
+
+	# Push a copy of the machine state out to the GUI.  lastSnapshot keeps the
+	# newest one for readers that must not drain the GUI queue.
+	# -------------------------------------------------------------------------
+	def publish( self, now ):
+		snap = {
+			'time': now,
+			'mode': self.mode,
+			'state': self.state,
+			'timer': self.timer,
+			'partCount': self.partCount,
+			'totalCount': self.totalCount,
+			'close': self.close.is_lit,
+			'inj': self.inj.is_lit,
+			'blowOff': self.blowOff.is_lit,
+			'heater': self.heater.is_lit,
+			'heaterOut': self.heaterCtl.out if self.heaterCtl else 0.,
+			'tempC': self.tempC,
+			'partDet': self.partDetPressed,
+			'estop': self.estopActive,
+			'estopLatency': dict( self.estopLatency ),
+			'powerOK': self.powerOK,
+			'loop': self.sched.stats(),
+		}
+		self.snapshots.append( snap )
+		self.lastSnapshot = snap
+
+	# Output bits for the journal, close is bit 0.  See journal.py.
+	# -------------------------------------------------------------------------
+	def outputBits( self ):
+		return ( ( 1 if self.close.is_lit else 0 ) | ( 2 if self.inj.is_lit else 0 )
+			| ( 4 if self.blowOff.is_lit else 0 ) | ( 8 if self.heater.is_lit else 0 ) )
+
+	# Hand the journal listeners an entry of 'kind' (see journal.EVENTS) with
+	# the whole machine position:
+	#	( time, kind, mode, state, outputs, timer, partCount, totalCount )
+	# -------------------------------------------------------------------------
+	def note( self, kind, now ):
+		if not self.journalListeners:
+			return
+		outputs = self.outputBits()
+		self.noted = ( self.modeId, self.stateId, outputs )
+		entry = ( now, kind, self.modeId, self.stateId, outputs, self.timer,
+			self.partCount, self.totalCount )
+		for listener in self.journalListeners:
+			listener( entry )
+
+	# Note whatever changed since the last note.  Once per pass, after the
+	# outputs are set.  State changes in the cycle are noted by goto().
+	# -------------------------------------------------------------------------
+	def noteChanges( self, now ):
+		if not self.journalListeners:
+			return
+		if self.noted is None or self.modeId != self.noted[0]:
+			self.note( "Mode", now )
+		elif self.stateId != self.noted[1]:
+			self.note( "State", now )
+		elif self.outputBits() != self.noted[2]:
+			self.note( "Output", now )
+
+	# -------------------------------------------------------------------------
+	def allOff( self ):
+		self.close.off()
+		self.inj.off()
+		self.blowOff.off()
+		self.heater.off()
+
+	# Heater band temperature control.  The PID runs once per new temperature
+	# reading and the relay is time proportioned every pass.  No reading (the
+	# thermocouple is unplugged) turns the heater off.
+	# -------------------------------------------------------------------------
+	def updateHeater( self, now ):
+		if self.heaterCtl is None:
+			return
+		reading = None
+		if self.tempSource is not None:
+			reading = self.tempSource()
+		if not self.heaterEn or self.estopActive or reading is None:
+			self.heaterCtl.reset()
+			self.heater.off()
+			self.tempC = reading[1] if reading else None
+			return
+
+		self.tempTm, self.tempC = reading
+		if self.tempTm != self.heaterCtl.lastTm:
+			self.heaterCtl.update( self.setPt, self.tempC, self.tempTm )
+		if self.heaterCtl.relay( now ):
+			self.heater.on()
+		else:
+			self.heater.off()
+
+	# The e-stop button also cuts 110vac to the mold close and inject
+	# solenoids.  This holds the machine in Abort while it is pressed.  The
+	# estopActive flag is set by the edge callbacks.
+	# -------------------------------------------------------------------------
+	def updateEStop( self ):
+		if self.estopActive:
+			self.allOff()
+			self.timer = 0.
+			self.modeId = ABORT
+			self.stateId = IDLE
+
+
+	# The auto cycle table, indexed by state number.
+	# -------------------------------------------------------------------------
+	def cycleTable( self ):
+		table = [ CycleState( name ) for name in self.states ]
+		table[IDLE] = CycleState( "Idle", next=CLOSE, guard=lambda: True, mark=False )
+		table[CLOSE] = CycleState( "Close", next=self.nextStage, enter=self.startCycle,
+			deadline=self.stageEnd, mark=False )
+		for state in [ COOL, INJECT2, COOL2 ]:
+			table[state] = CycleState( self.states[state], next=self.nextStage,
+				enter=self.enterStage, deadline=self.stageEnd )
+		table[OPEN] = CycleState( "Open", next=EJECT, enter=self.enterOpen,
+			deadline=lambda: self.moldTm + self.cycleOpenDelay )
+		table[EJECT] = CycleState( "Eject", next=DETECT, enter=self.enterEject,
+			exit=self.exitEject, during=self.ejectTick, deadline=lambda: self.ejectEnd, wake=self.ejectWake )
+		table[DETECT] = CycleState( "Detect", next=self.afterDetect, during=self.detectTick,
+			exit=self.endCycle, guard=lambda: self.modeId == AUTO_STOP or self.partDetLatch,
+			wake=lambda: self.detectTimeout )
+		return table
+
+	# This function handles Auto, Auto2 and Auto_Stop mode.  'now' is the monotonic
+	# time stamp of the pass.  The cycle timer is always taken from the clock,
+	# so late passes do not stretch the cycle.  A late pass can run through
+	# several states, the same as the old if-chain did.
+	# -------------------------------------------------------------------------
+	@profiler.timed( "auto" )
+	def auto( self, now ):
+		if self.stateId != IDLE:
+			self.timer = self.phases.elapsed( now )
+
+		for i in range( len( self.cycle ) ):
+			if self.modeTick[self.modeId] != self.auto:
+				return		# Left auto, eg. Auto_Stop finished the cycle.
+			row = self.cycle[self.stateId]
+			if row.during is not None:
+				row.during( now )
+			if row.guard is not None and row.guard():
+				pass
+			elif row.deadline is not None and self.timer >= row.deadline():
+				pass
+			else:
+				return
+			self.goto( row.next, now )
+
+	# Leave the current state for state 'nextId', running the exit and entry
+	# actions.  'nextId' can be a function returning the state, it is called
+	# after the exit action.
+	# -------------------------------------------------------------------------
+	def goto( self, nextId, now ):
+		row = self.cycle[self.stateId]
+		if row.exit is not None:
+			row.exit( now )
+		if callable( nextId ):
+			nextId = nextId()
+		self.stateId = nextId
+		row = self.cycle[nextId]
+		if row.mark:
+			self.phases.mark( row.name, now )
+		if row.enter is not None:
+			row.enter( now )
+		self.note( "State", now )
+
+	# Close the mold and start injecting.  The mold closed part of the cycle
+	# is a list of inject and cool stages.  Auto is one inject for InjTm then
+	# cool to CycTm.  Auto2 runs the shot profile.  The first stage runs in
+	# Close, the first cool in Cool, and any later stages in Inject2 / Cool2.
+	# -------------------------------------------------------------------------
+	def startCycle( self, now ):
+		if self.modeId == AUTO2:
+			self.stages = list( self.shotProfile )
+		else:
+			self.stages = [ ( "inject", self.injTm ), ( "cool", self.cycTm - self.injTm ) ]
+		self.stageEnds = []
+		self.stageStates = []
+		end = 0.
+		for i, ( kind, tm ) in enumerate( self.stages ):
+			end += tm
+			self.stageEnds.append( end )
+			if i == 0:
+				self.stageStates.append( CLOSE )
+			elif kind == "inject":
+				self.stageStates.append( INJECT2 )
+			elif COOL in self.stageStates:
+				self.stageStates.append( COOL2 )
+			else:
+				self.stageStates.append( COOL )
+		self.moldTm = end
+		self.stage = 0
+
+		self.phases.start( now, "Close" )
+		self.timer = 0.
+		self.close.on()
+		self.inj.on()
+
+	# -------------------------------------------------------------------------
+	def enterStage( self, now ):
+		if self.stages[self.stage][0] == "inject":
+			self.inj.on()
+		else:
+			self.inj.off()
+
+	# -------------------------------------------------------------------------
+	def stageEnd( self ):
+		return self.stageEnds[self.stage]
+
+	# State for the next mold closed stage, or Open after the last one.
+	# -------------------------------------------------------------------------
+	def nextStage( self ):
+		self.stage += 1
+		if self.stage < len( self.stages ):
+			return self.stageStates[self.stage]
+		self.inj.off()
+		return OPEN
+
+	# -------------------------------------------------------------------------
+	def enterOpen( self, now ):
+		self.partDetLatch = False	# Clear the high speed part detect latch.
+		self.close.off()
+		if self.adaptiveOpen:
+			self.cycleOpenDelay = self.openTuner.openDelay( self.openDelay )
+		else:
+			self.cycleOpenDelay = self.openDelay
+
+	# Blow the part off with the eject sequence, or the double pump one.
+	# ejectSteps are ( cycle time, action ), ejectEnd is when Eject is over.
+	# -------------------------------------------------------------------------
+	def enterEject( self, now ):
+		self.partCount += 1
+		self.totalCount += 1
+
+		ejectTm = self.moldTm + self.cycleOpenDelay
+		if self.doubleEject == True:
+			steps, end = self.doubleEjectSeq
+		else:
+			steps, end = self.ejectSeq
+		self.detectTimeout = None
+		if self.adaptiveOpen:
+			self.detectTimeout = self.moldTm + self.openDelay + end
+			lastStep = steps[-1][0] if steps else 0.
+			end = self.openTuner.ejectEnd( end, lastStep, self.cycleOpenDelay )
+		self.ejectSteps = [ ( ejectTm + tm, self.ejectActions[action] ) for tm, action in steps ]
+		self.ejectStep = 0
+		self.ejectEnd = ejectTm + end
+
+	# Whatever the sequence did, the blow off and mold are off for Detect.
+	# -------------------------------------------------------------------------
+	def exitEject( self, now ):
+		self.blowOff.off()
+		self.close.off()
+
+	# Run the eject steps that are due.
+	# -------------------------------------------------------------------------
+	def ejectTick( self, now ):
+		while self.ejectStep < len( self.ejectSteps ):
+			tm, action = self.ejectSteps[self.ejectStep]
+			if self.timer < tm:
+				return
+			action()
+			self.ejectStep += 1
+
+	# -------------------------------------------------------------------------
+	def ejectWake( self ):
+		if self.ejectStep < len( self.ejectSteps ):
+			return self.ejectSteps[self.ejectStep][0]
+		return self.ejectEnd
+
+	# Still no part by the end of the configured (untuned) open delay and eject
+	# window.  The learned timing is no good, go back to the configured one.
+	# The press keeps waiting in Detect for the part, as it always has.
+	# -------------------------------------------------------------------------
+	def detectTick( self, now ):
+		if self.partDetLatch or self.detectTimeout is None:
+			return
+		if self.timer >= self.detectTimeout:
+			self.detectTimeout = None
+			self.openTuner.add( None )
+
+	# Part dropped, or stopping.  Auto_Stop finishes in Manual.
+	# -------------------------------------------------------------------------
+	def afterDetect( self ):
+		if self.modeId == AUTO_STOP:
+			self.modeId = MANUAL
+			return IDLE
+		return CLOSE
+
+	# Build the record for the cycle that just finished and hand it to the
+	# cycle listeners.
+	# -------------------------------------------------------------------------
+	def endCycle( self, now ):
+		self.phases.mark( "End", now )
+		durations = {}
+		for phase, tm in self.phases.durations():		# Repeat stages add up.
+			durations[phase] = durations.get( phase, 0. ) + tm
+		openTm = None
+		for phase, tm in self.phases.marks:
+			if phase == "Open":
+				openTm = tm
+		detectLatency = None
+		if openTm is not None and self.partDetTm is not None and self.partDetTm >= openTm:
+			detectLatency = self.partDetTm - openTm
+
+		rec = {
+			'start': self.phases.startTm,
+			'cycleTm': now - self.phases.startTm,
+			'phases': durations,
+			'injTm': sum( tm for kind, tm in self.stages if kind == "inject" ),
+			'coolTm': sum( tm for kind, tm in self.stages if kind == "cool" ),
+			'detectWait': durations.get( "Detect", 0. ),
+			'detectLatency': detectLatency,
+			'openDelay': self.cycleOpenDelay,
+			'tempC': self.tempC,
+			'mode': self.mode,
+			'doubleEject': self.doubleEject,
+		}
+		if self.modeId != AUTO_STOP:		# Stopping does not wait for the part.
+			self.openTuner.add( detectLatency )
+		self.lastCycle = rec
+		self.note( "Cycle", now )
+		for listener in self.cycleListeners:
+			listener( rec )
+
+	# Cycle time (seconds) at which the current auto state is next due to do
+	# something.  Returns None when the state is waiting on an input instead.
+	# -------------------------------------------------------------------------
+	def stateDeadline( self ):
+		row = self.cycle[self.stateId]
+		if row.wake is not None:
+			return row.wake()
+		if row.deadline is not None:
+			return row.deadline()
+		return None
+
+	# Monotonic time stamp of the next auto deadline, or None.
+	# -------------------------------------------------------------------------
+	def deadlineAt( self ):
+		if self.modeTick[self.modeId] != self.auto or self.phases.startTm is None:
+			return None
+		deadline = self.stateDeadline()
+		if deadline is None:
+			return None
+		return self.phases.startTm + deadline
+
+	# This function handles Manual mode.  Outputs follow the GUI switches.
+	# -------------------------------------------------------------------------
+	def manual( self ):
+		if self.manualClose:
+			self.close.on()
+		else:
+			self.close.off()
+
+		if self.manualInj:
+			self.inj.on()
+		else:
+			self.inj.off()
+
+
+	# -------------------------------------------------------------------------
+	def modeInit( self ):
+		self.modeId = MANUAL	# Go from Init to Manual mode.
+
+	# -------------------------------------------------------------------------
+	def modeAbort( self ):
+		self.close.off()
+		self.inj.off()
+		self.stateId = IDLE
+
+	# -------------------------------------------------------------------------
+	def modeAuto( self ):
+		self.stateId = IDLE		# Start auto mode in the idle state.
+
+	# -------------------------------------------------------------------------
+	def modeAuto2( self ):
+		self.stateId = IDLE		# Start auto mode in the idle state.
+
+	# -------------------------------------------------------------------------
+	def modeAutoStop( self ):
+		pass
+
+	# On manual mode, make sure everything starts in the off position.
+	# -------------------------------------------------------------------------
+	def modeManual( self ):
+		self.close.off()
+		self.inj.off()
+		self.manualClose = False
+		self.manualInj = False
@@ -0,0 +1,440 @@
+# =============================================================================
+#
+#	Fleet - One view of several presses.
+#
+#	Each press runs a FleetReporter that connects to the coordinator over TCP
+#	and sends one JSON message per line:
+#
+#		{"type": "hello", "press": "press1"}
+#		{"type": "status", "status": {...}}		Once a second, see statusserver.py
+#		{"type": "shot", "shot": {...}}			Each finished cycle.
+#
+#	A client that sends {"type": "query"} gets the fleet summary back as one
+#	line of JSON.
+#
+#	FleetCoordinator serves every press from one thread with a select() loop,
+#	so dozens of presses cost one socket each and no threads.  It works out
+#	per press and fleet wide throughput (parts/hr over the last window) and
+#	downtime (time not running auto, e-stopped, or not reporting).
+#
+#	Ex:	python fleet.py serve --port 9090
+#		python fleet.py sim --presses 12 --port 9090	Simulated presses.
+#		python fleet.py query --port 9090
+#
+# =============================================================================
+import argparse
+import errno
+import json
+import select
+import socket
+import threading
+import time
+from collections import deque
+
+from scheduler import monotonic
+
+
+PORT = 9090
+MAX_LINE = 1024 * 1024		# Longest message line, a longer one drops the connection.
+RUNNING_MODES = [ "Auto", "Auto2", "Auto_Stop" ]
+
+
+# -------------------------------------------------------------------------
+def encode( msg ):
+	return ( json.dumps( msg ) + "\n" ).encode( 'utf-8' )
+
+
+# Press side.  Sends status and shots to the coordinator from its own thread
+# and reconnects if the link drops.  Use add() as an engine cycle listener.
+# =============================================================================
+class FleetReporter( threading.Thread ):
+
+	# 'status' returns the flat press status dict, see MainWindow.status().
+	# 'clock' is the engine clock the cycle records are timed on.
+	# -------------------------------------------------------------------------
+	def __init__( self, name, status, host="localhost", port=PORT, period=1., clock=monotonic ):
+		super( FleetReporter, self ).__init__()
+		self.daemon = True
+		self.name = name
+		self.status = status
+		self.host = host
+		self.port = port
+		self.period = period
+		self.clock = clock
+		self.shots = deque( maxlen=1000 )		# Kept while disconnected.
+		self.unsent = []		# Shots taken off 'shots' whose send failed.
+		self.stopEvent = threading.Event()
+		self.sock = None
+
+	# Queue a cycle record.  Never blocks, safe on the engine thread.
+	# -------------------------------------------------------------------------
+	def add( self, rec ):
+		# Wall clock time the cycle ended, worked out now while the two clocks
+		# still line up.
+		endTm = rec['start'] + rec['cycleTm']
+		self.shots.append( {
+			'time': time.time() - ( self.clock() - endTm ),
+			'cycleTm': rec['cycleTm'],
+			'detectWait': rec['detectWait'],
+			'mode': rec['mode'],
+		} )
+
+	# -------------------------------------------------------------------------
+	def stop( self ):
+		self.stopEvent.set()
+		if self.is_alive():
+			self.join( 2. )
+
+	# -------------------------------------------------------------------------
+	def run( self ):
+		while not self.stopEvent.is_set():
+			try:
+				self.sock = socket.create_connection( ( self.host, self.port ), 5. )
+				self.sock.sendall( encode( { 'type': "hello", 'press': self.name } ) )
+				while not self.stopEvent.is_set():
+					self.send()
+					self.stopEvent.wait( self.period )
+			except ( socket.error, socket.timeout ):
+				pass
+			finally:
+				if self.sock is not None:
+					self.sock.close()
+					self.sock = None
+			self.stopEvent.wait( 5. )		# Wait before trying to reconnect.
+
+	# Send the queued shots and the current status in one write.  If the
+	# write fails the shots are sent again after the reconnect.  Some may
+	# then arrive twice, none are lost.
+	# -------------------------------------------------------------------------
+	def send( self ):
+		while True:
+			try:
+				self.unsent.append( self.shots.popleft() )
+			except IndexError:
+				break
+		del self.unsent[:-self.shots.maxlen]
+		msgs = [ encode( { 'type': "shot", 'shot': shot } ) for shot in self.unsent ]
+		msgs.append( encode( { 'type': "status", 'status': self.status() } ) )
+		self.sock.sendall( b''.join( msgs ) )
+		self.unsent = []
+
+
+# Coordinator side state of one press.
+# =============================================================================
+class PressState( object ):
+
+	# -------------------------------------------------------------------------
+	def __init__( self, name, now, window=600. ):
+		self.name = name
+		self.window = window
+		self.status = {}
+		self.statusTm = None		# When the last status came in.
+		self.shots = deque()		# Shot end times in the last window, oldest first.
+		self.shotCount = 0
+		self.lastCycleTm = None
+		self.upTm = 0.
+		self.downTm = 0.
+		self.connected = True
+		self.firstTm = now
+
+	# Shots are timed by the press, so a batch sent late after a reconnect
+	# still lands in the minute it was made.  A press clock ahead of ours is
+	# taken as now.
+	# -------------------------------------------------------------------------
+	def addShot( self, shot, now ):
+		tm = min( shot.get( 'time', now ), now )
+		self.shotCount += 1
+		self.lastCycleTm = shot.get( 'cycleTm' )
+		if now - tm > self.window:
+			return
+		self.firstTm = min( self.firstTm, tm )
+		if self.shots and tm < self.shots[-1]:
+			tm = self.shots[-1]		# Keep them in order for tick().
+		self.shots.append( tm )
+
+	# Running means reporting, in an auto mode and not e-stopped.
+	# -------------------------------------------------------------------------
+	def running( self, now, staleTm=5. ):
+		if not self.connected or self.statusTm is None or now - self.statusTm > staleTm:
+			return False
+		return self.status.get( 'mode' ) in RUNNING_MODES and not self.status.get( 'estop' )
+
+	# Add 'dt' seconds to up or down time and drop shots older than the window.
+	# -------------------------------------------------------------------------
+	def tick( self, now, dt ):
+		if self.running( now ):
+			self.upTm += dt
+		else:
+			self.downTm += dt
+		while self.shots and now - self.shots[0] > self.window:
+			self.shots.popleft()
+
+	# Parts per hour over the last window, or since first seen if sooner.
+	# -------------------------------------------------------------------------
+	def partsPerHour( self, now ):
+		span = min( self.window, now - self.firstTm )
+		if span <= 0.:
+			return 0.
+		return 3600. * len( self.shots ) / span
+
+	# -------------------------------------------------------------------------
+	def summary( self, now ):
+		total = self.upTm + self.downTm
+		return {
+			'press': self.name,
+			'connected': self.connected,
+			'running': self.running( now ),
+			'mode': self.status.get( 'mode' ),
+			'state': self.status.get( 'state' ),
+			'tempC': self.status.get( 'tempC' ),
+			'shots': self.shotCount,
+			'partsPerHour': self.partsPerHour( now ),
+			'lastCycleTm': self.lastCycleTm,
+			'upTm': self.upTm,
+			'downTm': self.downTm,
+			'availability': self.upTm / total if total else 0.,
+		}
+
+
+# The coordinator.  One select() loop serves every connection.
+# =============================================================================
+class FleetCoordinator( object ):
+
+	# -------------------------------------------------------------------------
+	def __init__( self, host="", port=PORT, window=600., clock=time.time ):
+		self.clock = clock
+		self.window = window
+		self.listener = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+		self.listener.setsockopt( socket.SOL_SOCKET, socket.SO_REUSEADDR, 1 )
+		self.listener.bind( ( host, port ) )
+		self.listener.listen( 64 )
+		self.listener.setblocking( False )
+		self.port = self.listener.getsockname()[1]
+		self.conns = {}			# Socket -> [ press name or None, read buffer, write buffer ]
+		self.presses = {}		# Press name -> PressState
+		self.lastTick = clock()
+		self.stopping = False
+
+	# Run until stop().  'report' is called every 'reportPeriod' seconds.
+	# -------------------------------------------------------------------------
+	def serve( self, report=None, reportPeriod=5. ):
+		nextReport = self.clock() + reportPeriod
+		while not self.stopping:
+			self.poll( 0.5 )
+			if report is not None and self.clock() >= nextReport:
+				nextReport += reportPeriod
+				report( self )
+
+	# -------------------------------------------------------------------------
+	def stop( self ):
+		self.stopping = True
+
+	# -------------------------------------------------------------------------
+	def close( self ):
+		for sock in list( self.conns ):
+			self.drop( sock )
+		self.listener.close()
+
+	# One pass of the event loop, waiting up to 'timeout' seconds.
+	# -------------------------------------------------------------------------
+	def poll( self, timeout ):
+		readers = [ self.listener ] + list( self.conns )
+		writers = [ sock for sock, conn in self.conns.items() if conn[2] ]
+		readable, writable, failed = select.select( readers, writers, readers, timeout )
+		for sock in readable:
+			if sock is self.listener:
+				self.accept()
+			elif sock in self.conns:
+				self.read( sock )
+		for sock in writable:
+			if sock in self.conns:
+				self.write( sock )
+		for sock in failed:
+			if sock in self.conns:
+				self.drop( sock )
+		self.tick()
+
+	# -------------------------------------------------------------------------
+	def accept( self ):
+		try:
+			sock, addr = self.listener.accept()
+		except socket.error:
+			return
+		sock.setblocking( False )
+		self.conns[sock] = [ None, b'', b'' ]
+
+	# -------------------------------------------------------------------------
+	def read( self, sock ):
+		try:
+			data = sock.recv( 65536 )
+		except socket.error as e:
+			if e.args[0] in ( errno.EAGAIN, errno.EWOULDBLOCK ):
+				return
+			data = b''
+		if not data:
+			self.drop( sock )
+			return
+		conn = self.conns[sock]
+		conn[1] += data
+		while b'\n' in conn[1]:
+			line, conn[1] = conn[1].split( b'\n', 1 )
+			try:
+				msg = json.loads( line.decode( 'utf-8' ) )
+			except ValueError:
+				continue
+			if not isinstance( msg, dict ):
+				self.drop( sock )		# Not one of ours.
+				return
+			self.handle( sock, conn, msg )
+		if len( conn[1] ) > MAX_LINE:
+			self.drop( sock )
+
+	# -------------------------------------------------------------------------
+	def write( self, sock ):
+		conn = self.conns[sock]
+		try:
+			sent = sock.send( conn[2] )
+		except socket.error:
+			self.drop( sock )
+			return
+		conn[2] = conn[2][sent:]
+
+	# -------------------------------------------------------------------------
+	def drop( self, sock ):
+		conn = self.conns.pop( sock )
+		if conn[0] in self.presses:
+			self.presses[conn[0]].connected = False
+		sock.close()
+
+	# -------------------------------------------------------------------------
+	def handle( self, sock, conn, msg ):
+		now = self.clock()
+		kind = msg.get( 'type' )
+		if kind == "hello":
+			conn[0] = msg.get( 'press' )
+			press = self.presses.get( conn[0] )
+			if press is None:
+				press = self.presses[conn[0]] = PressState( conn[0], now, self.window )
+			press.connected = True
+		elif kind == "query":
+			conn[2] += encode( self.summary() )
+		elif conn[0] in self.presses:
+			press = self.presses[conn[0]]
+			if kind == "status":
+				press.status = msg.get( 'status' ) or {}
+				press.statusTm = now
+			elif kind == "shot":
+				press.addShot( msg.get( 'shot' ) or {}, now )
+
+	# Up / down time, once per loop pass.
+	# -------------------------------------------------------------------------
+	def tick( self ):
+		now = self.clock()
+		dt = now - self.lastTick
+		self.lastTick = now
+		for press in self.presses.values():
+			press.tick( now, dt )
+
+	# Fleet totals and every press.
+	# -------------------------------------------------------------------------
+	def summary( self ):
+		now = self.clock()
+		presses = [ self.presses[name].summary( now ) for name in sorted( self.presses ) ]
+		up = sum( p['upTm'] for p in presses )
+		down = sum( p['downTm'] for p in presses )
+		return {
+			'time': now,
+			'presses': presses,
+			'running': sum( 1 for p in presses if p['running'] ),
+			'shots': sum( p['shots'] for p in presses ),
+			'partsPerHour': sum( p['partsPerHour'] for p in presses ),
+			'downTm': down,
+			'availability': up / ( up + down ) if up + down else 0.,
+		}
+
+
+# Console table of a fleet summary.
+# -------------------------------------------------------------------------
+def formatSummary( s ):
+	lines = [ "{0:<12} {1:<9} {2:<7} {3:>7} {4:>8} {5:>8} {6:>6}".format(
+		"Press", "Mode", "State", "Shots", "Parts/Hr", "Down s", "Avail" ) ]
+	for p in s['presses']:
+		lines.append( "{0:<12} {1:<9} {2:<7} {3:>7} {4:>8.0f} {5:>8.0f} {6:>5.0f}%".format(
+			p['press'], p['mode'] if p['connected'] else "offline", p['state'] or "",
+			p['shots'], p['partsPerHour'], p['downTm'], p['availability'] * 100. ) )
+	lines.append( "Fleet: {0}/{1} running  {2} shots  {3:.0f} parts/hr  {4:.0f}% available".format(
+		s['running'], len( s['presses'] ), s['shots'], s['partsPerHour'], s['availability'] * 100. ) )
+	return "\n".join( lines )
+
+
+# -------------------------------------------------------------------------
+def printSummary( coord ):
+	print( formatSummary( coord.summary() ) + "\n" )
+
+
+# Run 'count' simulated presses in this process, each reporting to the
+# coordinator.  Cycle times are spread so the fleet is not in step.
+# -------------------------------------------------------------------------
+def simPresses( count, host, port ):
+	from control import ControlEngine
+	from hal import SimBackend
+	from statusserver import snapshotStatus
+
+	presses = []
+	for i in range( count ):
+		sim = SimBackend()
+		engine = ControlEngine( sim.close, sim.inj, sim.blowOff, sim.heater,
+			sim.estop, sim.partDet )
+		engine.attachInputs( sim.ups )
+		cycTm = 2. + 0.25 * ( i % 8 )
+		engine.post( "params", { 'CycTm': cycTm, 'InjTm': cycTm / 2., 'MoldOpenDelay': 0.5 } )
+		reporter = FleetReporter( "sim{:02d}".format( i + 1 ),
+			lambda engine=engine: snapshotStatus( engine.lastSnapshot, engine.clock() ),
+			host, port )
+		engine.cycleListeners.append( reporter.add )
+		sim.start()
+		engine.start()
+		engine.post( "start" )
+		reporter.start()
+		presses.append( ( sim, engine, reporter ) )
+	return presses
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser( description="Arburg fleet coordinator." )
+	parser.add_argument( 'command', choices=[ "serve", "sim", "query" ] )
+	parser.add_argument( '--host', default="localhost", help="Coordinator host (sim, query)" )
+	parser.add_argument( '--port', type=int, default=PORT )
+	parser.add_argument( '--presses', type=int, default=4, help="Simulated presses (sim)" )
+	parser.add_argument( '--window', type=float, default=600., help="Throughput window (s)" )
+	args = parser.parse_args()
+
+	if args.command == "serve":
+		coord = FleetCoordinator( port=args.port, window=args.window )
+		try:
+			coord.serve( printSummary )
+		except KeyboardInterrupt:
+			pass
+		coord.close()
+	elif args.command == "sim":
+		presses = simPresses( args.presses, args.host, args.port )
+		try:
+			while True:
+				time.sleep( 1. )
+		except KeyboardInterrupt:
+			pass
+		for sim, engine, reporter in presses:
+			reporter.stop()
+			engine.stop()
+			sim.stop()
+	else:
+		sock = socket.create_connection( ( args.host, args.port ), 5. )
+		sock.sendall( encode( { 'type': "query" } ) )
+		data = b''
+		while not data.endswith( b'\n' ):
+			chunk = sock.recv( 65536 )
+			if not chunk:
+				break
+			data += chunk
+		sock.close()
+		print( formatSummary( json.loads( data.decode( 'utf-8' ) ) ) )
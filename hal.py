@@ -0,0 +1,272 @@
+# =============================================================================
+#
+#	Hardware Abstraction Layer - Pi GPIO or an in-memory simulated press.
+#
+#	The controller talks to the press through a backend with these members:
+#
+#		close, inj, heater, blowOff, estopOut	Outputs: on(), off(), is_lit
+#		estop, partDet, ups						Inputs: is_pressed, plus the
+#												when_pressed / when_released
+#												edge callbacks
+#		tempSensor								readTempC()
+#
+#	PiBackend builds the gpiozero and MAX6675 objects.  Those libraries are
+#	only imported when it is used, so everything else loads on any machine.
+#	SimBackend is an in-memory press: the mold, the part drop switch and the
+#	barrel thermal mass.  Pick one with the 'Backend' setting or the
+#	ARBURG_BACKEND environment variable ("pi" or "sim").
+#
+# =============================================================================
+import heapq
+import os
+import threading
+import time
+
+from scheduler import monotonic
+from heater import BarrelModel
+
+
+# Returns the backend named 'name'.  The ARBURG_BACKEND environment variable
+# wins over the name passed in.
+# -------------------------------------------------------------------------
+def makeBackend( name="pi", **kwargs ):
+	name = os.environ.get( 'ARBURG_BACKEND', name ).lower()
+	if name == "pi":
+		return PiBackend( **kwargs )
+	if name == "sim":
+		return SimBackend( **kwargs )
+	raise ValueError( "Unknown Backend -> {}".format( name ) )
+
+
+# Real hardware on the Raspberry Pi.
+# =============================================================================
+class PiBackend( object ):
+
+	name = "pi"
+
+	# -------------------------------------------------------------------------
+	def __init__( self ):
+		from gpiozero import LED, Button
+		import Adafruit_GPIO.SPI as SPI
+		import MAX6675.MAX6675 as MAX6675
+
+		# The MAX6675 is a SPI based thermocouple interface chip.  The MAX6675
+		# handles reading a K type thermocouple.  Also handles cold junction
+		# compensation.
+		self.tempSensor = MAX6675.MAX6675( spi=SPI.SpiDev( 0, 0 ) )
+
+		# Setup the GPIO.
+		self.close = LED( 6, active_high=True )
+		self.inj = LED( 13, active_high=True )
+		self.heater = LED( 19, active_high=True )		# Heater Band relay output.
+		self.blowOff = LED( 5, active_high=True )		# Blow Off (part eject) Air Cylinder
+		self.estopOut = LED( 20 )						# Output for estop detection.
+		self.estop = Button( 21, pull_up=True )			# E-Stop Input
+		self.partDet = Button( 16, pull_up=True )		# Part Shoot Detect Switch
+		self.ups = Button( 26, pull_up=True )			# Detects power loss so we can shutdown.
+		for out in self.outputs():
+			out.off()
+
+	# -------------------------------------------------------------------------
+	def outputs( self ):
+		return [ self.close, self.inj, self.heater, self.blowOff, self.estopOut ]
+
+	# Nothing to run, the pins report edges themselves.
+	# -------------------------------------------------------------------------
+	def start( self ):
+		pass
+
+	# -------------------------------------------------------------------------
+	def stop( self ):
+		for out in self.outputs():
+			out.off()
+
+
+# Simulated output pin.  Calls 'onChange( pin )' when it switches.
+# =============================================================================
+class SimOutput( object ):
+
+	# -------------------------------------------------------------------------
+	def __init__( self, name, onChange=None ):
+		self.name = name
+		self.is_lit = False
+		self.onChange = onChange
+
+	# -------------------------------------------------------------------------
+	def on( self ):
+		if not self.is_lit:
+			self.is_lit = True
+			if self.onChange:
+				self.onChange( self )
+
+	# -------------------------------------------------------------------------
+	def off( self ):
+		if self.is_lit:
+			self.is_lit = False
+			if self.onChange:
+				self.onChange( self )
+
+
+# Simulated input button with gpiozero style edge callbacks.
+# =============================================================================
+class SimInput( object ):
+
+	# -------------------------------------------------------------------------
+	def __init__( self, name, pressed=False ):
+		self.name = name
+		self.is_pressed = pressed
+		self.when_pressed = None
+		self.when_released = None
+
+	# Change the input level and fire the edge callback.
+	# -------------------------------------------------------------------------
+	def set( self, pressed ):
+		if pressed == self.is_pressed:
+			return
+		self.is_pressed = pressed
+		callback = self.when_pressed if pressed else self.when_released
+		if callback:
+			callback()
+
+
+# Simulated thermocouple reading the barrel model.  Reads NaN if unplugged.
+# =============================================================================
+class SimThermocouple( object ):
+
+	# -------------------------------------------------------------------------
+	def __init__( self, model ):
+		self.model = model
+		self.plugged = True
+
+	# -------------------------------------------------------------------------
+	def readTempC( self ):
+		if not self.plugged:
+			return float( 'nan' )
+		# The MAX6675 reads in 0.25 deg C steps.
+		return round( self.model.sensor * 4. ) / 4.
+
+
+# An in-memory press.  Time only moves when advance( now ) is called, so the
+# same model runs in real time (start() runs a thread that advances it off
+# the monotonic clock) or on a virtual clock many times faster.
+#
+# The mold model: a part forms whenever the mold is closed while injecting.
+# When the mold opens, the part falls on its own 'dropTm' seconds later, or
+# 'blowTm' seconds after the blow off turns on, whichever is first.  The
+# falling part holds the part detect switch open for 'pulseTm' seconds.
+# =============================================================================
+class SimBackend( object ):
+
+	name = "sim"
+
+	# -------------------------------------------------------------------------
+	def __init__( self, clock=monotonic, dropTm=1.2, blowTm=0.15, pulseTm=0.02,
+			model=None ):
+		self.clock = clock
+		self.dropTm = dropTm
+		self.blowTm = blowTm
+		self.pulseTm = pulseTm
+		self.model = model if model is not None else BarrelModel()
+		self.now = clock()
+		self.events = []		# Heap of ( time, seq, function ).
+		self.seq = 0
+		self.lock = threading.RLock()	# Engine thread vs. sim thread.
+
+		self.close = SimOutput( "close", self.outputChanged )
+		self.inj = SimOutput( "inj", self.outputChanged )
+		self.heater = SimOutput( "heater" )
+		self.blowOff = SimOutput( "blowOff", self.outputChanged )
+		self.estopOut = SimOutput( "estopOut" )
+		self.estop = SimInput( "estop", pressed=False )
+		self.partDet = SimInput( "partDet", pressed=True )	# Active low.
+		self.ups = SimInput( "ups", pressed=True )			# Power good.
+		self.tempSensor = SimThermocouple( self.model )
+
+		self.partInMold = False		# A shot was injected into the closed mold.
+		self.partFalling = False	# The part drop is scheduled.
+		self.dropAt = None			# When the falling part hits the switch.
+		self.dropToken = 0			# Cancels a drop replaced by an earlier one.
+		self.parts = 0				# Parts that fell out.
+		self.thread = None
+		self.stopEvent = threading.Event()
+
+	# Schedule 'fn' to run at simulated time 'tm'.
+	# -------------------------------------------------------------------------
+	def schedule( self, tm, fn ):
+		self.seq += 1
+		heapq.heappush( self.events, ( tm, self.seq, fn ) )
+
+	# Time of the next scheduled event, or None.
+	# -------------------------------------------------------------------------
+	def nextEvent( self ):
+		if self.events:
+			return self.events[0][0]
+		return None
+
+	# Run the simulation forward to time 'now'.
+	# -------------------------------------------------------------------------
+	def advance( self, now ):
+		with self.lock:
+			while self.events and self.events[0][0] <= now:
+				tm, seq, fn = heapq.heappop( self.events )
+				self.stepModel( tm )
+				fn()
+			self.stepModel( now )
+
+	# -------------------------------------------------------------------------
+	def stepModel( self, tm ):
+		dt = tm - self.now
+		if dt > 0.:
+			self.model.step( self.heater.is_lit, dt )
+			self.now = tm
+
+	# Mold physics, run whenever close, inj or blowOff switch.
+	# -------------------------------------------------------------------------
+	def outputChanged( self, pin ):
+		with self.lock:
+			if self.close.is_lit and self.inj.is_lit:
+				self.partInMold = True
+			if not self.close.is_lit and self.partInMold and not self.partFalling:
+				dropAt = self.now + self.dropTm
+				if self.blowOff.is_lit:
+					dropAt = min( dropAt, self.now + self.blowTm )
+				self.dropPart( dropAt )
+			elif pin is self.blowOff and pin.is_lit and self.partFalling:
+				# Blow off hits a part still stuck in the open mold.
+				if self.now + self.blowTm < self.dropAt:
+					self.dropPart( self.now + self.blowTm )
+
+	# -------------------------------------------------------------------------
+	def dropPart( self, tm ):
+		self.partFalling = True
+		self.dropAt = tm
+		self.dropToken += 1
+		token = self.dropToken
+
+		def fall():
+			if self.dropToken != token:
+				return		# Superseded by an earlier drop time.
+			self.partInMold = False
+			self.partFalling = False
+			self.parts += 1
+			self.partDet.set( False )
+			self.schedule( self.now + self.pulseTm, lambda: self.partDet.set( True ) )
+
+		self.schedule( tm, fall )
+
+	# Run the model in real time on its own thread.
+	# -------------------------------------------------------------------------
+	def start( self ):
+		def run():
+			while not self.stopEvent.is_set():
+				self.advance( self.clock() )
+				time.sleep( 0.002 )
+		self.thread = threading.Thread( target=run )
+		self.thread.daemon = True
+		self.thread.start()
+
+	# -------------------------------------------------------------------------
+	def stop( self ):
+		self.stopEvent.set()
+		if self.thread is not None:
+			self.thread.join( 1.0 )
@@ -0,0 +1,184 @@
+# =============================================================================
+#
+#	Heater Band Controller - PID temperature control of the barrel heater.
+#
+#	Replaces the old commented out heaterControl() / heaterControlUpdate().
+#	That was a P+I loop whose "anti-windup" drove the integral by the error
+#	while saturated, which could just as well wind it up.  This one is a full
+#	PID with:
+#
+#	 - Conditional integration.  The integral only moves while the error is
+#	   inside the integral band, and not when the move would push a saturated
+#	   output further into saturation.
+#	 - Derivative on measurement, so setpoint steps do not kick the output.
+#	 - Time proportional relay drive.  The heater relay is on for out% of
+#	   each HeaterPeriod window.  The duty is latched at the start of each
+#	   window so the relay switches at most once on and once off per window.
+#
+#	BarrelModel is a simple thermal mass model of the barrel, so loop tuning
+#	and settling time can be tried off the machine.  Run this file to
+#	benchmark the saved heater settings against the model:
+#
+#		python heater.py [SetPt] [Seconds]
+#
+# =============================================================================
+
+
+# =============================================================================
+class HeaterController( object ):
+
+	# kp - Proportional gain (% out per deg C of error).
+	# ki - Integral gain (% out per deg C per second).
+	# kd - Derivative gain (% out per deg C per second of temperature change).
+	# iBand - Only integrate while the error is within +/- this (deg C).
+	# period - Relay time proportioning window (s).
+	# -------------------------------------------------------------------------
+	def __init__( self, kp=30., ki=1., kd=0., iBand=20., period=30.,
+			outMin=0., outMax=100. ):
+		self.kp = float( kp )
+		self.ki = float( ki )
+		self.kd = float( kd )
+		self.iBand = float( iBand )
+		self.period = float( period )
+		self.outMin = outMin
+		self.outMax = outMax
+		self.reset()
+
+	# Build a controller from the settings.  'get' is a settings lookup like
+	# store.get( key, default ).
+	# -------------------------------------------------------------------------
+	@classmethod
+	def fromSettings( cls, get ):
+		return cls(
+			kp=get( 'HeaterP', 30 ),
+			ki=get( 'HeaterI', 1 ),
+			kd=get( 'HeaterD', 0 ),
+			iBand=get( 'HeaterIBand', 20 ),
+			period=get( 'HeaterPeriod', 30 ) )
+
+	# Clear the integral and the relay window.  Call when the heater is
+	# disabled so it starts fresh when enabled again.
+	# -------------------------------------------------------------------------
+	def reset( self ):
+		self.i = 0.				# Integral term (% out).
+		self.out = 0.			# Output (% on time).
+		self.lastTemp = None
+		self.lastTm = None
+		self.windowStart = None	# Start of the current relay window.
+		self.windowDuty = 0.	# Output latched for the current window.
+
+	# Calculate the output from a new temperature reading taken at 'now'.
+	# Returns the output percent.
+	# -------------------------------------------------------------------------
+	def update( self, setPt, temp, now ):
+		dt = 0.
+		if self.lastTm is not None:
+			dt = now - self.lastTm
+
+		# A positive error means the temperature is low and we need more output.
+		err = setPt - temp
+		p = self.kp * err
+
+		# Derivative on the measurement, not the error.
+		d = 0.
+		if dt > 0. and self.lastTemp is not None:
+			d = -self.kd * ( temp - self.lastTemp ) / dt
+
+		# Conditional integration.
+		if dt > 0. and abs( err ) < self.iBand:
+			i = self.i + self.ki * err * dt
+			trial = p + i + d
+			pushingHigh = trial > self.outMax and err > 0.
+			pushingLow = trial < self.outMin and err < 0.
+			if not ( pushingHigh or pushingLow ):
+				self.i = i
+
+		out = p + self.i + d
+		self.out = min( self.outMax, max( self.outMin, out ) )
+		self.lastTemp = temp
+		self.lastTm = now
+		return self.out
+
+	# Time proportional relay drive.  Returns True if the relay should be on
+	# at time 'now'.
+	# -------------------------------------------------------------------------
+	def relay( self, now ):
+		if self.windowStart is None or now - self.windowStart >= self.period:
+			self.windowStart = now
+			self.windowDuty = self.out
+		onTm = self.windowDuty / 100. * self.period
+		return ( now - self.windowStart ) < onTm
+
+
+# A lumped thermal mass model of the barrel and heater band.  The heater puts
+# in 'watts' while on, the barrel loses heat to the room in proportion to
+# the temperature difference, and the thermocouple lags the barrel.
+# =============================================================================
+class BarrelModel( object ):
+
+	# -------------------------------------------------------------------------
+	def __init__( self, watts=800., heatCap=2500., loss=2.0, ambient=25.,
+			sensorLag=8. ):
+		self.watts = watts			# Heater band power (W).
+		self.heatCap = heatCap		# Barrel heat capacity (J/deg C).
+		self.loss = loss			# Loss to the room (W/deg C).
+		self.ambient = ambient		# Room temperature (deg C).
+		self.sensorLag = sensorLag	# Thermocouple time constant (s).
+		self.temp = ambient			# Barrel temperature (deg C).
+		self.sensor = ambient		# Thermocouple reading (deg C).
+
+	# Run the model forward 'dt' seconds with the heater on or off.
+	# -------------------------------------------------------------------------
+	def step( self, heaterOn, dt ):
+		power = self.watts if heaterOn else 0.
+		self.temp += ( power - self.loss * ( self.temp - self.ambient ) ) * dt / self.heatCap
+		self.sensor += ( self.temp - self.sensor ) * dt / self.sensorLag
+		return self.sensor
+
+
+# Run the controller against the model from room temperature.  The
+# controller sees a new reading every 'sampleTm' seconds, like the MAX6675.
+# Returns ( settle time or None, overshoot, trace ).  Settle time is when
+# the reading last entered and then stayed within +/- 'band' of the setpoint.
+# -------------------------------------------------------------------------
+def settleTime( ctl, model, setPt, duration=3600., dt=0.1, sampleTm=0.22, band=2. ):
+	ctl.reset()
+	trace = []
+	settled = None
+	peak = model.sensor
+	nextSample = 0.
+	on = False
+	tm = 0.
+	while tm < duration:
+		if tm >= nextSample:
+			ctl.update( setPt, model.sensor, tm )
+			nextSample += sampleTm
+		on = ctl.relay( tm )
+		temp = model.step( on, dt )
+		trace.append( ( tm, temp, ctl.out ) )
+		peak = max( peak, temp )
+		if abs( temp - setPt ) <= band:
+			if settled is None:
+				settled = tm
+		else:
+			settled = None
+		tm += dt
+	return settled, max( 0., peak - setPt ), trace
+
+
+if __name__ == '__main__':
+	import sys
+	from prefstore import PrefStore
+
+	store = PrefStore()
+	setPt = float( sys.argv[1] ) if len( sys.argv ) > 1 else store.get( 'SetPt' )
+	duration = float( sys.argv[2] ) if len( sys.argv ) > 2 else 3600.
+
+	ctl = HeaterController.fromSettings( store.get )
+	settled, overshoot, trace = settleTime( ctl, BarrelModel(), setPt, duration )
+	print( "SetPt: {0:.0f}C  P: {1}  I: {2}  D: {3}  IBand: {4}  Period: {5}s".format(
+		setPt, ctl.kp, ctl.ki, ctl.kd, ctl.iBand, ctl.period ) )
+	if settled is None:
+		print( "Did not settle within {0:.0f}s".format( duration ) )
+	else:
+		print( "Settled in {0:.0f}s, overshoot {1:.1f}C".format( settled, overshoot ) )
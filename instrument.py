@@ -0,0 +1,142 @@
+# =============================================================================
+#
+#	Hot Path Timing - Per call duration histograms for the loop handlers.
+#
+#	Wrap a handler with @profiler.timed( "name" ).  While the profiler is
+#	off the wrapper only checks one flag and calls straight through.  While
+#	it is on, each call's duration lands in a fixed bucket histogram, so the
+#	cost per call never grows however long it runs.
+#
+#	Turn it on with the 'Profile' setting, ARBURG_PROFILE=1, or at run time
+#	over the status server (POST /profile/on).  GET /profile dumps the table.
+#
+# =============================================================================
+import bisect
+import functools
+import os
+
+from scheduler import monotonic
+
+
+# Histogram bucket upper bounds (s), 10us to 100ms.  Anything slower lands in
+# the last (overflow) bucket.
+BOUNDS = [ 10e-6, 20e-6, 50e-6, 100e-6, 200e-6, 500e-6,
+	1e-3, 2e-3, 5e-3, 10e-3, 20e-3, 50e-3, 100e-3 ]
+
+
+# Fixed bucket histogram of durations.
+# =============================================================================
+class Histogram( object ):
+
+	# -------------------------------------------------------------------------
+	def __init__( self, bounds=BOUNDS ):
+		self.bounds = bounds
+		self.reset()
+
+	# -------------------------------------------------------------------------
+	def reset( self ):
+		self.counts = [0] * ( len( self.bounds ) + 1 )
+		self.count = 0
+		self.total = 0.
+		self.max = 0.
+
+	# -------------------------------------------------------------------------
+	def add( self, dt ):
+		self.counts[bisect.bisect_left( self.bounds, dt )] += 1
+		self.count += 1
+		self.total += dt
+		if dt > self.max:
+			self.max = dt
+
+	# Upper bound of the bucket holding percentile 'p' (0 - 100).  The max
+	# seen for the overflow bucket.
+	# -------------------------------------------------------------------------
+	def percentile( self, p ):
+		if self.count == 0:
+			return 0.
+		rank = self.count * p / 100.
+		seen = 0
+		for i, n in enumerate( self.counts ):
+			seen += n
+			if seen >= rank and n:
+				return self.bounds[i] if i < len( self.bounds ) else self.max
+		return self.max
+
+
+# A histogram per handler name.
+# =============================================================================
+class Profiler( object ):
+
+	# -------------------------------------------------------------------------
+	def __init__( self, enabled=False, clock=monotonic ):
+		self.enabled = enabled
+		self.clock = clock
+		self.hists = {}
+
+	# -------------------------------------------------------------------------
+	def reset( self ):
+		for h in self.hists.values():
+			h.reset()
+
+	# Record one call of 'name' taking 'dt' seconds.
+	# -------------------------------------------------------------------------
+	def add( self, name, dt ):
+		h = self.hists.get( name )
+		if h is None:
+			h = self.hists[name] = Histogram()
+		h.add( dt )
+
+	# Decorator timing each call of the wrapped function as 'name'.
+	# -------------------------------------------------------------------------
+	def timed( self, name ):
+		def wrap( fn ):
+			@functools.wraps( fn )
+			def timedCall( *args, **kwargs ):
+				if not self.enabled:
+					return fn( *args, **kwargs )
+				start = self.clock()
+				try:
+					return fn( *args, **kwargs )
+				finally:
+					self.add( name, self.clock() - start )
+			return timedCall
+		return wrap
+
+	# Turn timing on or off.  Returns the report so far.
+	# -------------------------------------------------------------------------
+	def setEnabled( self, enabled ):
+		self.enabled = enabled
+		return self.report()
+
+	# Status server page to dump the timings.
+	# -------------------------------------------------------------------------
+	def pages( self ):
+		return { "/profile": self.report }
+
+	# Status server actions (POST only) to toggle and clear the timings.
+	# -------------------------------------------------------------------------
+	def actions( self ):
+		return {
+			"/profile/on": lambda: self.setEnabled( True ),
+			"/profile/off": lambda: self.setEnabled( False ),
+			"/profile/reset": lambda: self.reset() or self.report(),
+		}
+
+	# Table of the handlers, slowest total time first.
+	# -------------------------------------------------------------------------
+	def report( self ):
+		lines = [ "Profiling {}".format( "on" if self.enabled else "off" ),
+			"{0:<16} {1:>8} {2:>10} {3:>9} {4:>9} {5:>9} {6:>9}".format(
+				"Handler", "Calls", "Total ms", "Mean us", "p50 us", "p99 us", "Max us" ) ]
+		hists = sorted( self.hists.items(), key=lambda item: -item[1].total )
+		for name, h in hists:
+			if h.count == 0:
+				continue
+			lines.append( "{0:<16} {1:>8} {2:>10.1f} {3:>9.0f} {4:>9.0f} {5:>9.0f} {6:>9.0f}".format(
+				name, h.count, h.total * 1e3, h.total / h.count * 1e6,
+				h.percentile( 50 ) * 1e6, h.percentile( 99 ) * 1e6, h.max * 1e6 ) )
+		return "\n".join( lines ) + "\n"
+
+
+# The one profiler everything shares.
+profiler = Profiler( enabled=os.environ.get( 'ARBURG_PROFILE', "0" ) not in [ "", "0" ] )
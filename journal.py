@@ -0,0 +1,303 @@
+# =============================================================================
+#
+#	Journal - Append-only, crash safe record of what the press was doing.
+#
+#	The control engine notes every mode, state and output change, each
+#	finished cycle, e-stop and UPS edges.  Each entry is one fixed width
+#	little endian record (see BODY) holding the whole machine position at
+#	that moment, plus a CRC.  add() only appends to a deque on the engine
+#	thread.  A background thread writes the queued records in one write and
+#	one fsync per flush period, or right away after flushSoon().
+#
+#	Because every record is the full position, replay on start up only has
+#	to find the newest record with a good CRC at the end of the file.  That
+#	tells where the last run stopped (mode, state, cycle time, outputs) and
+#	restores the part counters.  A run that ended with stop() leaves a
+#	"Shutdown" record.  Anything else, a crash or a power cut, leaves the last
+#	thing the press did.
+#
+#	The file is started over (the old one kept as .old) when it passes
+#	maxBytes, checked by the writer after each flush and again on start up.
+#	The new file opens with a "Start" record of the current position, so
+#	replay never needs the old one.
+#
+#	Read a journal for analysis with readJournal(), which returns a NumPy
+#	structured array like shotlog.readShots().
+#
+# =============================================================================
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+
+from control import ControlEngine, AUTO, AUTO2, AUTO_STOP, IDLE
+from scheduler import monotonic
+
+
+MAGIC = b'ARBJRNL1'
+VERSION = 1
+HEADER = struct.Struct( '<8sII' )		# Magic, version, record size.
+
+# time		Wall clock time (s since epoch).
+# timer		Cycle time (s).
+# kind		Index into EVENTS.
+# mode, state	Index into ControlEngine.modes / states.
+# outputs	Output bits, see OUTPUTS.
+# partCount, totalCount	Part counters.
+BODY = struct.Struct( '<dfBBBBII' )
+CRC = struct.Struct( '<I' )
+RECORD_SIZE = BODY.size + CRC.size
+
+# Event kinds.  The engine notes the ones from "Mode" on, the journal itself
+# writes the first three.
+EVENTS = [ "Start", "Shutdown", "PowerDown", "Mode", "State", "Output", "Cycle",
+	"Count", "EStop", "PowerLost", "PowerOK" ]
+OUTPUTS = [ "close", "inj", "blowOff", "heater" ]		# Bit 0 up.
+
+
+# -------------------------------------------------------------------------
+def packEntry( wallTm, kind, mode, state, outputs, timer, partCount, totalCount ):
+	body = BODY.pack( wallTm, timer, EVENTS.index( kind ), mode, state, outputs,
+		partCount, totalCount )
+	return body + CRC.pack( zlib.crc32( body ) & 0xffffffff )
+
+
+# Unpack one record.  Returns None if the CRC is bad (a torn write).
+# -------------------------------------------------------------------------
+def unpackEntry( data ):
+	body = data[:BODY.size]
+	crc, = CRC.unpack( data[BODY.size:RECORD_SIZE] )
+	if zlib.crc32( body ) & 0xffffffff != crc:
+		return None
+	wallTm, timer, kind, mode, state, outputs, partCount, totalCount = BODY.unpack( body )
+	return {
+		'time': wallTm,
+		'kind': EVENTS[kind] if kind < len( EVENTS ) else None,
+		'modeId': mode,
+		'stateId': state,
+		'outputs': outputs,
+		'timer': timer,
+		'partCount': partCount,
+		'totalCount': totalCount,
+	}
+
+
+# Where the journal at 'path' says the press stopped.  Reads back from the
+# end to the newest good record.  Returns None for no journal.
+#
+#	clean		True if the last run ended with stop().
+#	interrupted	True if it stopped part way through an auto cycle.
+# -------------------------------------------------------------------------
+def replay( path, chunk=64 ):
+	try:
+		f = open( path, 'rb' )
+	except IOError:
+		return None
+	with f:
+		magic, version, size = HEADER.unpack( f.read( HEADER.size ) )
+		if magic != MAGIC or size != RECORD_SIZE:
+			raise ValueError( "Not a version {} journal -> {}".format( VERSION, path ) )
+		f.seek( 0, os.SEEK_END )
+		end = HEADER.size + ( f.tell() - HEADER.size ) // size * size	# Drop a partial record.
+		while end > HEADER.size:
+			start = max( HEADER.size, end - chunk * size )
+			f.seek( start )
+			data = f.read( end - start )
+			for i in range( len( data ) - size, -1, -size ):
+				entry = unpackEntry( data[i:i + size] )
+				if entry is not None:
+					return describe( entry )
+			end = start
+	return None
+
+
+# Add names and the clean / interrupted flags to an unpacked entry.
+# -------------------------------------------------------------------------
+def describe( entry ):
+	modes, states = ControlEngine.modes, ControlEngine.states
+	entry['mode'] = modes[entry['modeId']] if entry['modeId'] < len( modes ) else None
+	entry['state'] = states[entry['stateId']] if entry['stateId'] < len( states ) else None
+	entry['on'] = [ name for i, name in enumerate( OUTPUTS ) if entry['outputs'] & ( 1 << i ) ]
+	entry['clean'] = entry['kind'] == "Shutdown"
+	entry['interrupted'] = ( not entry['clean'] and entry['modeId'] in ( AUTO, AUTO2, AUTO_STOP )
+		and entry['stateId'] != IDLE )
+	return entry
+
+
+# One line description of a replayed position.
+# -------------------------------------------------------------------------
+def formatLastRun( last ):
+	text = "{0} at {1}: {2} / {3}, {4:.2f}s into the cycle, parts {5} ({6} total)".format(
+		last['kind'], time.strftime( "%Y-%m-%d %H:%M:%S", time.localtime( last['time'] ) ),
+		last['mode'], last['state'], last['timer'], last['partCount'], last['totalCount'] )
+	if last['on']:
+		text += ", on: " + " ".join( last['on'] )
+	return text
+
+
+# The writer.  Use add() as an engine journal listener.
+# =============================================================================
+class Journal( threading.Thread ):
+
+	# -------------------------------------------------------------------------
+	def __init__( self, path="journal.bin", maxBytes=4 * 1024 * 1024,
+			flushPeriod=1., clock=monotonic ):
+		super( Journal, self ).__init__()
+		self.daemon = True
+		self.path = path
+		self.maxBytes = maxBytes
+		self.flushPeriod = flushPeriod
+		self.clock = clock
+		self.pending = deque()
+		self.wake = threading.Event()
+		self.stopping = False
+		self.lock = threading.Lock()		# One writer at a time.
+		self.written = 0		# Records written since start.
+		self.syncs = 0			# fsync calls since start.
+
+		try:
+			self.last = replay( path )		# Where the last run stopped.
+		except ( ValueError, struct.error ) as e:
+			print( "Journal Error: {}".format( e ) )
+			self.last = None
+		self.entry = None		# Newest entry, for the closing record.
+		self.f = None
+		self.openFile()
+
+	# Queue an engine entry.  Never blocks, safe on the engine thread.
+	# -------------------------------------------------------------------------
+	def add( self, entry ):
+		# Monotonic to wall clock time now, while the two clocks line up.
+		wallTm = time.time() - ( self.clock() - entry[0] )
+		self.pending.append( ( wallTm, ) + entry[1:] )
+		self.entry = entry
+
+	# Ask the writer to write and sync now.  Does not wait.  Use this on UPS
+	# power loss.
+	# -------------------------------------------------------------------------
+	def flushSoon( self ):
+		self.wake.set()
+
+	# Stop the writer, write anything queued and a closing record of 'kind'
+	# ("Shutdown", or "PowerDown" for a UPS shut down) with the outputs off.
+	# -------------------------------------------------------------------------
+	def stop( self, kind="Shutdown" ):
+		self.stopping = True
+		self.wake.set()
+		if self.is_alive():
+			self.join( 5. )
+		if self.entry is not None:
+			now, _, mode, state, outputs, timer, partCount, totalCount = self.entry
+			self.pending.append( ( time.time(), kind, mode, state, 0, timer, partCount, totalCount ) )
+		self.writePending()
+		with self.lock:
+			if self.f is not None:
+				self.f.close()
+				self.f = None
+
+	# -------------------------------------------------------------------------
+	def run( self ):
+		while not self.stopping:
+			self.wake.wait( self.flushPeriod )
+			self.wake.clear()
+			try:
+				self.writePending()
+			except Exception as e:
+				print( "Journal Error: {}".format( e ) )
+
+	# Pack and write everything queued, then one fsync for the batch.
+	# -------------------------------------------------------------------------
+	def writePending( self ):
+		with self.lock:
+			chunks = []
+			while True:
+				try:
+					chunks.append( packEntry( *self.pending.popleft() ) )
+				except IndexError:
+					break
+			if not chunks or self.f is None:
+				return
+			self.f.write( b''.join( chunks ) )
+			self.f.flush()
+			os.fsync( self.f.fileno() )
+			self.written += len( chunks )
+			self.syncs += 1
+			if self.f.tell() > self.maxBytes:
+				self.rotate()
+
+	# Move the full file to .old and start a new one from a Start record of
+	# the newest entry.  Writer lock held.
+	# -------------------------------------------------------------------------
+	def rotate( self ):
+		self.f.close()
+		os.rename( self.path, self.path + ".old" )
+		self.f = open( self.path, 'ab' )
+		data = HEADER.pack( MAGIC, VERSION, RECORD_SIZE )
+		if self.entry is not None:
+			now, _, mode, state, outputs, timer, partCount, totalCount = self.entry
+			data += packEntry( time.time(), "Start", mode, state, outputs, timer,
+				partCount, totalCount )
+		self.f.write( data )
+		self.f.flush()
+		os.fsync( self.f.fileno() )
+
+	# Open the journal for appending.  A torn last record is cut off, and a
+	# full file is moved to .old and started over from a Start record.
+	# -------------------------------------------------------------------------
+	def openFile( self ):
+		directory = os.path.dirname( self.path )
+		if directory and not os.path.isdir( directory ):
+			os.makedirs( directory )
+		size = os.path.getsize( self.path ) if os.path.exists( self.path ) else 0
+		if size > self.maxBytes or ( size and self.last is None ):
+			os.rename( self.path, self.path + ".old" )		# Full, or not a journal.
+			size = 0
+
+		self.f = open( self.path, 'ab' )
+		if size == 0:
+			self.f.write( HEADER.pack( MAGIC, VERSION, RECORD_SIZE ) )
+		elif ( size - HEADER.size ) % RECORD_SIZE:
+			self.f.truncate( size - ( size - HEADER.size ) % RECORD_SIZE )
+
+		last = self.last
+		if last is not None:
+			self.entry = ( None, "Start", last['modeId'], last['stateId'], 0,
+				last['timer'], last['partCount'], last['totalCount'] )
+			self.pending.append( ( time.time(), ) + self.entry[1:] )
+		self.writePending()
+
+
+# NumPy dtype matching a record.
+# -------------------------------------------------------------------------
+def journalDtype():
+	import numpy as np
+	return np.dtype( { 'names': [ 'time', 'timer', 'kind', 'mode', 'state', 'outputs',
+			'partCount', 'totalCount', 'crc' ],
+		'formats': [ '<f8', '<f4', 'u1', 'u1', 'u1', 'u1', '<u4', '<u4', '<u4' ] } )
+
+
+# Read a journal file (and its .old file first, if there is one) into a
+# NumPy structured array.  Records with a bad CRC are dropped.
+# -------------------------------------------------------------------------
+def readJournal( path ):
+	import numpy as np
+
+	dtype = journalDtype()
+	arrays = []
+	for name in [ path + ".old", path ]:
+		if not os.path.exists( name ):
+			continue
+		with open( name, 'rb' ) as f:
+			magic, version, size = HEADER.unpack( f.read( HEADER.size ) )
+			if magic != MAGIC or size != RECORD_SIZE:
+				raise ValueError( "Not a version {} journal -> {}".format( VERSION, name ) )
+			data = f.read()
+		count = len( data ) // size
+		data = data[:count * size]
+		good = [ i for i in range( count ) if unpackEntry( data[i * size:( i + 1 ) * size] ) ]
+		arrays.append( np.frombuffer( data, dtype=dtype )[good] )
+	if not arrays:
+		return np.zeros( 0, dtype=dtype )
+	return np.concatenate( arrays )
@@ -12,61 +12,87 @@
 #	Logic needs rewrite and a on/off button needs added to enable and disable.
 #
 # =============================================================================
+from startup import startup		# First, so it times everything after.
+
 import kivy
 #kivy.require('1.0.5')
 
 from kivy.uix.floatlayout import FloatLayout
 from kivy.uix.gridlayout import GridLayout
 from kivy.uix.boxlayout import BoxLayout
-from kivy.uix.popup import Popup
 from kivy.uix.label import Label
 from kivy.uix.button import Button
 from kivy.app import App
-from kivy.properties import *
-from kivy.uix.textinput import TextInput
+from kivy.properties import BooleanProperty, ListProperty, NumericProperty
 from kivy.core.window import Window 
 from kivy.clock import Clock
 from kivy.config import Config
 
-from SevenSeg_Disp import Segment
-
-from gpiozero import LED, Button
-import Adafruit_GPIO.SPI as SPI
-import MAX6675.MAX6675 as MAX6675
-
-from pypref import Preferences
-pref = Preferences(filename="settings.py")
-# create preferences dict example
-#pdict = { 'MaxTime': 45, 'CycleTm': 15.0, 'InjTm': 10.0, 'SetPt': 225 }
-#pref.set_preferences(pdict)
-
-from time import localtime, strftime
-
-print "SetPt: ", pref.get('SetPt')
-
-# The MAX6675 is a SPI based thermocouple interface chip.  The MAX6675 handles
-# reading a K type thermocouple.  Also handles cold junction compensation.
-tempTC = MAX6675.MAX6675( spi=SPI.SpiDev( 0, 0 ) )
-
-Config.set('graphics', 'width', '800')
-Config.set('graphics', 'height', '480')
-Config.write()
+from SevenSeg_Disp import Segment, SegmentDisplay
+from control import ControlEngine, ejectSequence
+from thermo import TempSampler, isNaN
+from heater import HeaterController
+from shotlog import ShotLog
+from spc import ShiftStats
+from instrument import profiler
+from statusserver import StatusServer, snapshotStatus
+from fleet import FleetReporter
+from journal import Journal, formatLastRun
+from uibind import UiBinding, setMaxFps
+from trend import TrendHistory
+
+from hal import makeBackend
+
+from prefstore import PrefStore
+# Settings are read once into the store's memory cache, see prefstore.py for
+# the names and defaults.  Writes go to the file from a background thread so
+# nothing here ever waits on the SD card.
+store = PrefStore()
+
+from time import localtime, strftime, time
+import shlex
+import socket
+import subprocess
+
+startup.mark( "Imports" )
+
+print "SetPt: ", store.get('SetPt'), " Recipe: ", store.recipe
+startup.mark( "Settings" )
+
+# The press I/O.  Set 'Backend' in the settings (or ARBURG_BACKEND) to "pi"
+# for the real machine or "sim" for the simulated press.  See hal.py.
+press = makeBackend( store.get( 'Backend' ) )
+# SPI reads are blocking, so they run on the sampler's own thread.
+tempSampler = TempSampler( press.tempSensor )
+# Every finished cycle is recorded to disk from the shot log's own thread.
+shotLog = ShotLog( store.get( 'ShotLogDir' ) )
+startup.mark( "Press I/O" )
+# Mode, state and output changes go to the crash safe journal.  Replaying it
+# says where the last run stopped, see journal.py.
+journal = Journal( store.get( 'JournalFile' ) )
+if journal.last is not None:
+	print "Last Run:", formatLastRun( journal.last )
+startup.mark( "Journal Replay" )
+
+# Handler timing histograms, see instrument.py.
+if store.get( 'Profile' ):
+	profiler.enabled = True
+
+# Actual cycle time statistics for this shift (since the app started).
+shiftStats = ShiftStats()
+
+# Display update period and frame rate cap (fps), running and idle.  Idle is
+# Manual, Abort or Init with the cycle in Idle, when nothing on screen moves.
+RUN_PERIOD, RUN_FPS = 0.1, 60
+IDLE_PERIOD, IDLE_FPS = 0.5, 10
+
+# Only write the Kivy config when the size really changed, not every start.
+if Config.get('graphics', 'width') != '800' or Config.get('graphics', 'height') != '480':
+	Config.set('graphics', 'width', '800')
+	Config.set('graphics', 'height', '480')
+	Config.write()
 Window.size = (800, 480)
-
-# Setup the GPIO.
-close = LED(6, active_high=True )
-close.off()
-inj = LED( 13, active_high=True )
-inj.off()
-heater = LED( 19, active_high=True )		# Heater Band relay output.
-heater.off()
-blowOff = LED( 5, active_high=True )		# Blow Off (part eject) Air Cylinder
-blowOff.off()
-estopOut = LED( 20 )						# Output for estop detection.
-estopOut.off()
-estop = Button( 21, pull_up=True )			# E-Stop Input
-partDet = Button( 16, pull_up=True )		# Part Shoot Detect Switch
-ups = Button( 26, pull_up=True )			# Detects power loss so we can shutdown.
+startup.mark( "Window" )
 
 
 # Builds the main window for everything else to live inside of.
@@ -81,8 +107,8 @@ class MainWindow( FloatLayout ):
 	autoStop = BooleanProperty( False )
 
 	# Temperature setpoint for the heater bands.
-	# Get value from settings.py file.
-	tempSetPt = NumericProperty( pref.get('SetPt', default=200) )	
+	# Set from the settings on start up.
+	tempSetPt = NumericProperty( 200 )
 
 	tempSensor = NumericProperty( 80 )	# Temperature on the thermocouple.
 
@@ -95,26 +121,44 @@ class MainWindow( FloatLayout ):
 	tempLblColor = ListProperty( (1,0,0,1) )
 
 	# Controls the length of the sliders for setting time.
-	maxTime = NumericProperty( pref.get('MaxTime', default=45) )
-	timeStep = NumericProperty( pref.get('TimeStep', default=0.5) )
-	heaterPeriod = pref.get( 'HeaterPeriod', default=30 )
-	totalCount = NumericProperty( pref.get( 'TotalCount', default=0 ) )
-	heaterP = pref.get( 'HeaterP', default=30 ) # PID proportional value.
-	heaterI = pref.get( 'HeaterI', default=1 ) 	# PID integral value.
-	heaterIBand = pref.get( 'HeaterIBand', default=20 ) # Integral Band value.
-	setptStep = pref.get( 'SetPtStep', default=50 ) # Step change to adjust setpt.
-	tempOKBand = pref.get( 'TempOKBand', default=10 ) # Temp OK band around setpt.
-	openDelay = pref.get( 'MoldOpenDelay', default=1. ) # Min mold hold open delay.
+	maxTime = NumericProperty( 45 )
+	timeStep = NumericProperty( 0.5 )
+	totalCount = NumericProperty( 0 )
+
+	# Recipe names for the recipe spinner.
+	recipeNames = ListProperty( [] )
+
+	# Window attribute (or widget id and property) for each setting.  These
+	# are loaded from the settings cache on start up and follow it after.
+	settingAttrs = {
+		'SetPt': 'tempSetPt',
+		'MaxTime': 'maxTime',
+		'TimeStep': 'timeStep',
+		'TotalCount': 'totalCount',
+		'HeaterPeriod': 'heaterPeriod',
+		'HeaterP': 'heaterP',			# PID proportional value.
+		'HeaterI': 'heaterI',			# PID integral value.
+		'HeaterIBand': 'heaterIBand',	# Integral Band value.
+		'SetPtStep': 'setptStep',		# Step change to adjust setpt.
+		'TempOKBand': 'tempOKBand',		# Temp OK band around setpt.
+		'MoldOpenDelay': 'openDelay',	# Min mold hold open delay.
+		'AdaptiveOpen': 'adaptiveOpen',	# Learn a shorter open delay.
+		'OpenMargin': 'openMargin',		# Safety margin on the learned drop time.
+		'ShotProfile': 'shotProfile',	# Double inject stages.
+		'EjectSeq': 'ejectSeq',			# Eject sequences, see control.py.
+		'DoubleEjectSeq': 'doubleEjectSeq',
+	}
+	settingWidgets = {
+		'CycleTm': ( 'cycTm', 'value' ),
+		'InjTm': ( 'injTm', 'value' ),
+		'DoubleEject': ( 'partDbleEjectLbl', 'active' ),
+		'DoubleInject': ( 'partDbleInjectLbl', 'active' ),
+	}
 	cnt = 0
 	chatterLockout = False	# Keeps the relay from turning on again within one cycle.
-	partDetLatch = False
-
-	arburgModes = [ "Init", "Abort", "Auto", "Auto2", "Auto_Stop", "Manual" ]
-	arburgStates = [ "Idle", "Close", "Inject", "Cool", "Open", "Eject", "Inject2", "Cool2", "Detect" ]
-	arburgMode = "Init"		# Default Mode
-	arburgState = "Idle"	# Default State
-	arburgModeOld = ""		# Detects changes in Mode.
-	arburgStateOld = ""		# Detects changes in State.
+
+	arburgMode = "Init"		# Mode, as last reported by the control engine.
+	arburgState = "Idle"	# State, as last reported by the control engine.
 	temp = False
 	#autoStop = False
 
@@ -123,296 +167,380 @@ class MainWindow( FloatLayout ):
 
 	# -------------------------------------------------------------------------
 	def __init__(self, **kwargs):
-		# Setup main timer to run 10 times per second.
-		self.clock = Clock.schedule_interval( self.partDetTimer, 0.1 )
-		self.clock = Clock.schedule_interval( self.opTimer, 0.1 )
+		# Setup the display update timer to run 10 times per second, slower
+		# while idle, see setIdle().  Machine timing runs on the control engine
+		# thread, not here.  The time of day only changes once a second.
+		self.clock = Clock.schedule_interval( self.opTimer, RUN_PERIOD )
+		self.idle = False
+		self.ui = UiBinding()				# Skips widget sets that change nothing.
 		self.cycleEnable = False	# Track current cycle state.
 		self.partCount = 0			# Counter number of parts made.
 		self.heaterTm = 0			# Heater cycle time.
 		self.tempCnt = 10			# On zero count, read temp sensor.
+		self.manualSent = ( False, False )	# Last solenoid switches sent to engine.
+		self.paramsSent = None				# Last cycle settings sent to engine.
+		self.trend = TrendHistory()			# Decimated temperature history.
+		self.shiftReport = shiftStats.report()	# For the status server.
+		self.countSync = None				# Total count sent to the engine.
+		self.powerLostTm = None				# When the UPS reported power lost.
+		self.upsSeen = False				# UPS has read power good since start.
+		for key, attr in self.settingAttrs.items():
+			setattr( self, attr, store.get( key ) )
 		super( MainWindow, self ).__init__(**kwargs)
-		self.ids.cycTm.value = pref.get('CycleTm', default=20. )
-		self.ids.injTm.value = pref.get('InjTm', default=10. )
-		self.ids.partDbleEjectLbl.active = pref.get( 'DoubleEject', default=False)
-		self.ids.partDbleInjectLbl.active = pref.get( 'DoubleInject', default=False)
-
-
-	# This is the main Operations Timer for the whole system.
-	# This should run at 10Hz.
+		for key in list( self.settingAttrs ) + list( self.settingWidgets ):
+			self.settingChanged( key, store.get( key ) )
+			store.bind( key, self.settingChanged )
+		self.recipeNames = store.recipeNames()
+		self.ids.recipe.text = store.recipe
+		self.updateClock()
+
+		# In Manual the solenoid switches go to the engine at once, not on the
+		# next display update.
+		self.ids.closeSol.bind( active=self.switchChanged )
+		self.ids.injSol.bind( active=self.switchChanged )
+
+		# After a crash or power cut carry on the counts.  The journal is
+		# synced every second and the settings file less often, so the
+		# journal's total count wins.
+		last = journal.last
+		partCount = 0
+		if last is not None and not last['clean']:
+			partCount = last['partCount']
+			if last['totalCount'] != self.totalCount:
+				store.update( { 'TotalCount': last['totalCount'] } )
+			if last['interrupted']:
+				Clock.schedule_once( lambda dt: self.showLastRun( last ), 0 )
+
+		# The control engine owns the outputs and runs the machine cycle on its
+		# own thread.  This window only sends it commands and shows its state.
+		self.engine = ControlEngine( press.close, press.inj, press.blowOff,
+			press.heater, press.estop, press.partDet,
+			partCount=partCount, totalCount=self.totalCount,
+			heaterCtl=HeaterController.fromSettings( store.get ),
+			tempSource=tempSampler.reading )
+		self.engine.attachInputs( press.ups )
+		self.engine.cycleListeners.append( shotLog.add )
+		self.engine.cycleListeners.append( shiftStats.add )
+		self.engine.journalListeners.append( journal.add )
+		self.postParams()
+		self.engine.start()
+
+		# Press status over HTTP.  StatusPort 0 turns it off.
+		self.statusServer = None
+		port = store.get( 'StatusPort' )
+		if port:
+			try:
+				self.statusServer = StatusServer( self.status, port, store.get( 'StatusHost' ),
+					pages=self.statusPages(), actions=profiler.actions() )
+				self.statusServer.start()
+			except Exception as e:
+				print "Status Server Error:", e
+
+		# Report to the fleet coordinator, see fleet.py.  No FleetHost, no report.
+		self.fleetReporter = None
+		if store.get( 'FleetHost' ):
+			self.fleetReporter = FleetReporter( store.get( 'FleetName' ) or socket.gethostname(),
+				self.status, store.get( 'FleetHost' ), store.get( 'FleetPort' ) )
+			self.engine.cycleListeners.append( self.fleetReporter.add )
+			self.fleetReporter.start()
+
+
+	# This is the display update timer.  It runs at 10Hz but the machine does
+	# not depend on it, so a slow redraw can not stretch the cycle.
 	# -------------------------------------------------------------------------
+	@profiler.timed( "opTimer" )
 	def opTimer( self, *largs ):
 
-		self.refresh_task()
+		self.postParams()
 
-		self.updatePartDet()
+		snap = self.engine.latest()
+		if snap is not None:
+			self.updateFromEngine( snap )
+		if shiftStats.update():
+			self.updateCycleStats()
 
+		self.updateTemp()
 		#self.heaterTimer()	# Handles Heater Band Stuff
-		self.updateEStop()	# Read E-Stop button and update.
-	 	# Update the time on the display.
-	 	self.ids.timeLbl.text = strftime( "%l:%M:%S %P" )
-
-		# Exit if mode is not in the list of acceptable modes.
-		if self.arburgMode not in self.arburgModes:
-			print "\n\n\rError: Unknown Mode ->", self.arburgMode
-			print "Exiting App\n\r"
-			App.get_running_app().stop()
-
-		# The next block of code does all the mode switching logic.  Each modeXXX()
-		# function is called once on switching to that new mode.
-
-		# On Init mode, do init stuff then go to Manual mode.
-		if (self.arburgMode == "Init") and (self.arburgMode != self.arburgModeOld):
-			self.arburgModeOld = self.arburgMode
-			self.modeInit()
-
-		# Abort current cycle.
-		if (self.arburgMode == "Abort") and (self.arburgMode != self.arburgModeOld):
-			self.arburgModeOld = self.arburgMode
-			self.modeAbort()
-
-		# Run machine in Auto cycle.
-		if (self.arburgMode == "Auto") and (self.arburgMode != self.arburgModeOld):
-			self.arburgModeOld = self.arburgMode
-			self.modeAuto()
-
-		# Run machine in Auto two shot mode (injects a double shot).
-		if (self.arburgMode == "Auto2") and (self.arburgMode != self.arburgModeOld):
-			self.arburgModeOld = self.arburgMode
-			self.modeAuto2()
-
-		# Auto_Stop, finish this cycle then stop by going to manual.
-		if (self.arburgMode == "Auto_Stop") and (self.arburgMode != self.arburgModeOld):
-			self.arburgModeOld = self.arburgMode
-			self.modeAutoStop()
-
-		# Manual mode idles the machine and allows manual cycling things.
-		if (self.arburgMode == "Manual") and (self.arburgMode != self.arburgModeOld):
-			self.arburgModeOld = self.arburgMode
-			self.modeManual()
+		self.setIdle( self.arburgMode in [ "Manual", "Abort", "Init" ]
+			and self.arburgState == "Idle" )
 
-		# The following functions are called at 10Hz rate based on the current mode.
-		# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-		# If either Auto or Auto_Stop call self.auto().
-		if self.arburgMode in ["Auto", "Auto_Stop"]:
-			self.auto()
+	# Update the time on the display, then again just after the next second
+	# ticks over.
+	# -------------------------------------------------------------------------
+	@profiler.timed( "updateClock" )
+	def updateClock( self, *args ):
+		self.ui.show( self.ids.timeLbl, 'text', strftime( "%l:%M:%S %P" ) )
+		Clock.schedule_once( self.updateClock, 1.01 - time() % 1. )
 
-		if self.arburgMode == "Manual":
-			self.manual()
+	# Slow the display timer and the frame rate down while idle.  The manual
+	# solenoid switches are bound to manual() so they still act at once.
+	# -------------------------------------------------------------------------
+	def setIdle( self, idle ):
+		if idle == self.idle:
+			return
+		self.idle = idle
+		self.clock.cancel()
+		self.clock = Clock.schedule_interval( self.opTimer, IDLE_PERIOD if idle else RUN_PERIOD )
+		setMaxFps( Clock, IDLE_FPS if idle else RUN_FPS )
 
 
-	# This function handles Auto and Auto_Stop mode.  Call this function at 10Hz.
+	# Show the newest engine snapshot on the display.
 	# -------------------------------------------------------------------------
-	def auto( self ):
-		# If Idle, switch to Close state...
-		if self.arburgState == "Idle":
-			self.arburgState = "Close"
-			self.timer = 0.
-			self.cycleEnable = True
-			#print "Auto: Idle to Close"
-			close.on()
-			inj.on()
-			self.ids.closeSol.active = True
-			self.ids.injSol.active = True
-		# Else, for any of the following modes run the timer up.
-		elif self.arburgState in [ "Close", "Inject", "Cool", "Eject", "Open", "Inject2", "Cool2" ]:
-			self.timer += 0.1
-
-		if self.arburgState == "Close":
-			if self.timer >= self.ids.injTm.value:
-				self.arburgState = "Cool"
-				#print "Auto: Close to Cool"
-				inj.off()
-				self.ids.injSol.active = False
-
-		if self.arburgState == "Cool":
-			if self.timer >= self.ids.cycTm.value:
-				self.arburgState = "Open"
-				#print "Auto: Cool to Open"
-				self.partDetLatch = False	# Clear the high speed part detect latch.
-				close.off()
-				self.ids.closeSol.active = False
-
-		if self.arburgState == "Open":
-			if self.timer >= self.ids.cycTm.value + self.openDelay:
-				self.arburgState = "Eject"
-				blowOff.on()
-	 			self.partCount += 1
- 				self.totalCount += 1
- 				pref.update_preferences( { 'TotalCount': self.totalCount } )
-	 			self.ids.partCount.text = str( self.partCount )
-
-		if self.arburgState == "Eject":
-			if self.ids.partDbleEjectLbl.active == True:
-				# Crapy Double Pump during eject.
-				# ------------------------------------------------------------
-				# Time Values Were: 1.2, 2.2, 3.2 or 0.7, 1.5, 2.0
-				if self.timer >= self.ids.cycTm.value + self.openDelay + 2.0:
-					self.arburgState = "Detect"
-				elif self.timer >= self.ids.cycTm.value + self.openDelay + 1.5:
-					close.off()
-				elif self.timer >= self.ids.cycTm.value + self.openDelay + 0.7:
-					blowOff.off()
-					close.on()
-			else:
-				# Normal Eject
-				# ------------------------------------------------------------
-				if self.timer >= self.ids.cycTm.value + self.openDelay + 0.2:
-					blowOff.off()
-				if self.timer >= self.ids.cycTm.value + self.openDelay + 0.4:
-					self.arburgState = "Detect"
-
-		if self.arburgState == "Detect":
-			if self.arburgMode == "Auto_Stop":
-				self.arburgMode = "Manual"
-				#print "Auto_Stop: Detect to Manual/Idle"
-			elif self.partDetLatch == True:
-				self.arburgState = "Close"
-				self.timer = 0.
-				close.on()
-				inj.on()
-				self.ids.closeSol.active = True
-				self.ids.injSol.active = True
-				#print "Auto: Detect to Close"
-
-
-	# This function handles Manual mode.  Call this function at 10Hz while in manual.
-	# -------------------------------------------------------------------------
-	def manual( self ):
-		if self.ids.closeSol.active:
-			close.on()
-		else:
-			close.off()
+	@profiler.timed( "updateFromEngine" )
+	def updateFromEngine( self, snap ):
+		self.ui.show( self, 'timer', snap['timer'] )
+		self.refresh_task()
+		self.updatePartDet( snap['partDet'] )
+		self.updateEStop( snap['estop'] )
 
-		if self.ids.injSol.active:
-			inj.on()
-		else:
-			inj.off()
+		# Entering manual mode clears the solenoid switches.
+		if snap['mode'] != self.arburgMode and snap['mode'] == "Manual":
+			self.modeManual()
+		self.arburgMode = snap['mode']
+		self.arburgState = snap['state']
 
+		# In manual the switches drive the outputs.  Otherwise, they show them.
+		if self.arburgMode == "Manual":
+			self.manual()
+		else:
+			self.ui.show( self.ids.closeSol, 'active', snap['close'] )
+			self.ui.show( self.ids.injSol, 'active', snap['inj'] )
+		self.ui.show( self.ids.heaterOut, 'active', snap['heater'] )
+		self.ui.show( self, 'heaterOut', snap['heaterOut'] )
+
+		if snap['partCount'] != self.partCount:
+			self.partCount = snap['partCount']
+			self.ids.partCount.text = str( self.partCount )
+		if self.countSync is not None:
+			# A new recipe's count was sent, skip snapshots from before it.
+			if snap['totalCount'] == self.countSync:
+				self.countSync = None
+		elif snap['totalCount'] != self.totalCount:
+			self.totalCount = snap['totalCount']
+			store.update( { 'TotalCount': self.totalCount } )
+
+		# On UPS power loss, get the settings and journal on disk while we
+		# still can.  If the power stays off for UpsGrace seconds, shut down.
+		# Only once the UPS has read power good, a missing UPS board or wire
+		# reads as power lost from the start.
+		if snap['powerOK']:
+			self.upsSeen = True
+			self.powerLostTm = None
+		elif self.upsSeen:
+			store.flushSoon()
+			journal.flushSoon()
+			grace = store.get( 'UpsGrace' )
+			if self.powerLostTm is None:
+				self.powerLostTm = snap['time']
+			elif grace and snap['time'] - self.powerLostTm >= grace:
+				self.powerDown()
+
+
+	# Extra plain text pages for the status server.
+	# -------------------------------------------------------------------------
+	def statusPages( self ):
+		pages = profiler.pages()
+		pages["/startup"] = lambda: startup.report( store.get( 'StartupTarget' ) )
+		pages["/shift"] = lambda: self.shiftReport + "\n"
+		return pages
+
+	# Press status for the status server.  Runs on the server threads, so it
+	# only reads values already published by the engine.
+	# -------------------------------------------------------------------------
+	def status( self ):
+		return snapshotStatus( self.engine.lastSnapshot, self.engine.clock(), {
+			'setPt': self.tempSetPt,
+			'partsPerHour': shiftStats.partsPerHour(),
+		} )
 
 
+	# A setting changed, from start up, a save or a recipe switch.  Show it.
 	# -------------------------------------------------------------------------
-	def modeInit( self ):
-		self.arburgMode = "Manual"	# Go from Init to Manual mode.
-		#print "UPS Status OK: ", ups.is_pressed
-		#print "Init"
-
+	def settingChanged( self, key, val ):
+		if key in self.settingWidgets:
+			wid, prop = self.settingWidgets[key]
+			setattr( self.ids[wid], prop, val )
+			return
+		if key == 'TotalCount' and hasattr( self, 'engine' ) and val != self.totalCount:
+			self.countSync = val
+			self.engine.post( "totalCount", val )
+		setattr( self, self.settingAttrs[key], val )
+
+	# Switch to recipe 'name', a new name saves the current settings as it.
 	# -------------------------------------------------------------------------
-	def modeAbort( self ):
-		close.off()
-		inj.off()
-		self.ids.closeSol.active = False
-		self.ids.injSol.active = False
-		self.arburgState = "Idle"
-		#print "Abort"
+	def selectRecipe( self, name ):
+		if not name or name == store.recipe:
+			return
+		self.saveSettings()		# Keep the edits made to the old recipe.
+		store.selectRecipe( name )
+		self.recipeNames = store.recipeNames()
+
+	# Popup to name a new recipe.  It starts as a copy of the current one.
+	# -------------------------------------------------------------------------
+	def newRecipe( self ):
+		from kivy.uix.popup import Popup
+		from kivy.uix.textinput import TextInput
+
+		box = BoxLayout( orientation='vertical', spacing=10 )
+		name = TextInput( multiline=False, size_hint_y=None, height=40 )
+		box.add_widget( name )
+		buttons = BoxLayout( size_hint_y=None, height=50, spacing=10 )
+		okBtn = Button( text="Save As" )
+		cancelBtn = Button( text="Cancel" )
+		buttons.add_widget( okBtn )
+		buttons.add_widget( cancelBtn )
+		box.add_widget( buttons )
+		popup = Popup( title="New Recipe (Mold) Name", content=box,
+			size_hint=(None, None), size=(400, 200) )
+
+		def ok( *args ):
+			popup.dismiss()
+			self.selectRecipe( name.text.strip() )
+			self.ids.recipe.text = store.recipe
+
+		okBtn.bind( on_press=ok )
+		cancelBtn.bind( on_press=popup.dismiss )
+		popup.bind( on_dismiss=lambda *args: setattr( self.ids.recipe, 'text', store.recipe ) )
+		popup.open()
+
 
+	# Show the actual cycle time statistics.  Only runs after a cycle ends.
+	# The shift report is made here too, the status server threads only read
+	# it.
 	# -------------------------------------------------------------------------
-	def modeAuto( self ):
-		self.arburgState = "Idle"	# Start auto mode in the idle state.
-		#print "Auto"
+	@profiler.timed( "updateCycleStats" )
+	def updateCycleStats( self ):
+		self.shiftReport = shiftStats.report()
+		s = shiftStats.summary()['cycleTm']
+		text = 'Actual: {0:.2f}s ({1:.0f} Parts/Hr)  p95 {2:.2f}s  sd {3:.2f}s'.format(
+			s['mean'], shiftStats.partsPerHour(), s['p95'], s['std'] )
+		self.ids.cycleStats.text = text
+		# Last X-bar / R subgroup outside the control limits shows in red.
+		self.ui.show( self.ids.cycleStats, 'color', (1,0,0,1) if s['outOfControl'] else (1,1,1,1) )
+
+
+	# Show the newest thermocouple reading.  Never waits on the SPI bus.
+	# -------------------------------------------------------------------------
+	@profiler.timed( "updateTemp" )
+	def updateTemp( self ):
+		# Every reading since the last pass goes to the trend, this timer runs
+		# slower than the sampler while idle.
+		for tm, tc in tempSampler.since( self.trend.lastTm ):
+			self.trend.add( tm, tc, self.tempSetPt, self.heaterOut )
+
+		reading = tempSampler.reading()
+		if reading is None:
+			temp = 0		# Sensor unplugged or not read yet.
+		else:
+			temp = int( reading[1] )
+		self.ui.show( self, 'tempSensor', temp )
+
+		# Set temp label color blue if too cold!
+		if temp < ( self.tempSetPt - self.tempOKBand ):
+			color = ( 0,0,1,1)
+		# Set temp label color red if too hot!
+		elif temp > ( self.tempSetPt + self.tempOKBand ):
+			color = ( 1,0,0,1)
+		# Else, set label color green if just right.
+		else:
+			color = ( 0,1,0,1)
+		self.ui.show( self, 'tempLblColor', color )
 
+
+	# Send the cycle settings to the engine when any of them change.
 	# -------------------------------------------------------------------------
-	def modeAuto2( self ):
-		pass
-		#print "Auto2"
+	def postParams( self ):
+		params = {
+			'InjTm': self.ids.injTm.value,
+			'CycTm': self.ids.cycTm.value,
+			'MoldOpenDelay': self.openDelay,
+			'AdaptiveOpen': self.adaptiveOpen,
+			'OpenMargin': self.openMargin,
+			'DoubleEject': self.ids.partDbleEjectLbl.active,
+			'DoubleInject': self.ids.partDbleInjectLbl.active,
+			'ShotProfile': self.shotProfile,
+			'EjectSeq': self.ejectSeq,
+			'DoubleEjectSeq': self.doubleEjectSeq,
+			'HeaterEn': self.ids.heaterEn.active,
+			'SetPt': self.tempSetPt,
+		}
+		if params != self.paramsSent:
+			self.paramsSent = params
+			self.engine.post( "params", params )
+
+
+	# This function handles Manual mode.  Send the solenoid switches to the
+	# engine when they change.
+	# -------------------------------------------------------------------------
+	def manual( self ):
+		sw = ( self.ids.closeSol.active, self.ids.injSol.active )
+		if sw != self.manualSent:
+			self.manualSent = sw
+			self.engine.post( "manual", *sw )
 
 	# -------------------------------------------------------------------------
-	def modeAutoStop( self ):
-		pass
-		#print "Auto_Stop"
+	def switchChanged( self, *args ):
+		if self.arburgMode == "Manual":
+			self.manual()
 
 	# On manual mode, make sure everything starts in the off position.
 	# -------------------------------------------------------------------------
 	def modeManual( self ):
-		close.off()
-		inj.off()
 		self.ids.closeSol.active = False
 		self.ids.injSol.active = False	
+		self.manualSent = ( False, False )
 		self.autoStop = False
-		#print "Manual"
-
 
-	# Pool the part detect switch at 100Hz and latch true if detected.
-	# -------------------------------------------------------------------------
-	def partDetTimer( self, *largs ):
-		if partDet.is_pressed == False:
-			self.partDetLatch = True
 
 	# -------------------------------------------------------------------------
-	def updatePartDet( self ):
-		if partDet.is_pressed == True:
-			self.ids.partDetLbl.active = False
-		else:
-			self.ids.partDetLbl.active = True
+	@profiler.timed( "updatePartDet" )
+	def updatePartDet( self, pressed ):
+		self.ui.show( self.ids.partDetLbl, 'active', not pressed )
 
 
+	# The display only redraws the digits that changed.
+	@profiler.timed( "refresh_task" )
 	def refresh_task( self, *args ):
-		s = "{:04.1f}".format( self.timer )		# Convert float to string like "12.3".
-		self.ids.seg1.value = s[0]				# Assign first 7-segment to tens digit.
-		self.ids.seg2.value = s[1:3]			# 2nd 7-segment gets ones digit, plus decimal point.
-		self.ids.seg3.value = s[3]				# 3rd 7-segment gets tenths digit.
+		self.ui.show( self.ids.cycleDisp, 'number', self.timer )
 		#self.counts += self.rate
 		#if self.counts >= 99.8: self.rate = -0.1
 		#if self.counts <=  0.1: self.rate = 0.1
 
 
 
-	# Call this often to handle the e-stop getting pressed.  Note, the e-stop
-	# button also cuts 110vac to the mold close and inject solenoids.
+	# Handle the e-stop getting pressed.  The engine turns the outputs off and
+	# aborts the cycle.  This just updates the buttons to match.
 	# -------------------------------------------------------------------------
-	def updateEStop( self ):
-		# E-Stop is active low...
-		#if estop.is_pressed == False:
-		if estop.is_pressed:
+	@profiler.timed( "updateEStop" )
+	def updateEStop( self, pressed ):
+		if pressed:
 			# Unselect cycle button and depress abort button.  Then, disable 
 			# both buttons until the e-stop is released.
 			self.ids.cycleStart.state = 'normal'
-			self.ids.abortCycle.disabled = True
 			self.ids.abortCycle.state = 'down'
 			self.ids.abortCycle.disabled = True
 			self.ids.heaterEn.active = False
 
-			# Make sure everything is aborted / off on e-stop pressed.
+			# Make sure everything shows aborted / off on e-stop pressed.
 			self.ids.closeSol.active = False
 			self.ids.injSol.active = False
 			self.abortDisabled = True
-			self.timer = 0.
 			self.cycleEnable = False
-			close.off()
-			inj.off()
-			heater.off()
-			heater2.off()
-			self.arburgMode = "Abort"
-			self.arburgState = "Idle"
 		else:
-			self.ids.abortCycle.disabled = False		
+			self.ui.show( self.ids.abortCycle, 'disabled', False )
 
 
 	# Start a cycle on pressing this button.  Or, enter Auto_Stop if depressed.
 	# -------------------------------------------------------------------------
 	def enableStart( self, enState ):
 		if enState == 'down':
-			self.arburgMode = "Auto"
+			self.engine.post( "start" )
 		else:
-			self.arburgMode = "Auto_Stop"
+			self.engine.post( "stop" )
 			# autoStop disables the cycle-start button until the cycle completes.
 			self.autoStop = True
 
-
-		"""
-		if enState == 'down':
-			# if self.arburgState == 'Idle':
-			#if self.cycleEnable == False:
-			self.timer = 0.
-			self.cycleEnable = True
-			self.arburgState = 'Auto'
-			print("Start Button")
-		else:
-			self.arburgState = 'Idle'
-			#self.cycleEnable = False
-		return True
-		"""
-
 	# On Abort Button active, disable the cycle start button.  Keep enable 
 	# button disabled until abort button is released.
 	# -------------------------------------------------------------------------
@@ -425,24 +553,22 @@ class MainWindow( FloatLayout ):
 			self.cycleEnable = False
 			self.ids.cycleStart.state = 'normal'
 			self.chatterLockout == False
-			close.off()
-			inj.off()
-			blowOff.off()
 			#print('Abort Button Down')
-			self.arburgMode = "Abort"
-			self.arburgState = "Idle"
+			self.engine.post( "abort" )
 		else:
 			#print('Abort Button Up')
 			self.abortDisabled = False
-			self.arburgMode = "Manual"
-			self.arburgState = "Idle"
+			self.engine.post( "release" )
 			self.autoStop = False
 		return True
 
 	# Update the text over the slider for total cycle time.
 	# -------------------------------------------------------------------------
-	def cycleTmText( self, val ):
-		val = self.ids.cycTm.value + self.openDelay
+	def cycleTmText( self, val, doubleInject=False ):
+		if doubleInject:
+			val = sum( tm for kind, tm in self.shotProfile ) + self.openDelay
+		else:
+			val = self.ids.cycTm.value + self.openDelay
 		if val > 0: 
 			s = '{0:.1f}s ({1:.0f} Parts/Hr)'.format( val, 60*(60. / val) )
 		else:
@@ -458,28 +584,149 @@ class MainWindow( FloatLayout ):
 			s = "0"
 		return s
 
-	# Save all the settings to settings.py file.
+	# Save all the settings to the current recipe.  The file is written in one
+	# go by the store's background thread.
 	# -------------------------------------------------------------------------
 	def saveSettings( self ):
-		pref.update_preferences( { 'SetPt': self.tempSetPt } )
-		pref.update_preferences( { 'CycleTm': self.ids.cycTm.value } )
-		pref.update_preferences( { 'InjTm': self.ids.injTm.value } )
-		pref.update_preferences( { 'HeaterPeriod': self.heaterPeriod } )
-		pref.update_preferences( { 'TotalCount': self.totalCount } )
-		pref.update_preferences( { 'MoldOpenDelay': self.openDelay } )
-		pref.update_preferences( { 'DoubleEject': self.ids.partDbleEjectLbl.active})
-		pref.update_preferences( { 'DoubleInject': self.ids.partDbleInjectLbl.active})
+		store.update( {
+			'SetPt': self.tempSetPt,
+			'CycleTm': self.ids.cycTm.value,
+			'InjTm': self.ids.injTm.value,
+			'HeaterPeriod': self.heaterPeriod,
+			'TotalCount': self.totalCount,
+			'MoldOpenDelay': self.openDelay,
+			'DoubleEject': self.ids.partDbleEjectLbl.active,
+			'DoubleInject': self.ids.partDbleInjectLbl.active,
+			'EjectSeq': self.ejectSeq,
+			'DoubleEjectSeq': self.doubleEjectSeq,
+		} )
+		store.flushSoon()
 
 	# On "Close App" button...
 	# -------------------------------------------------------------------------
 	def closeApp( self ):
+		print "Loop Timing:", self.engine.sched.report()
+		print shiftStats.report()
+		if profiler.enabled:
+			print profiler.report()
+			print self.ui.report()
 		App.get_running_app().stop()
 
+	# The UPS is running out.  Stop everything, write the journal and
+	# settings, then shut the Pi down (see ArburgApp.on_stop).
+	# -------------------------------------------------------------------------
+	def powerDown( self ):
+		app = App.get_running_app()
+		if app.stopKind == "PowerDown":
+			return
+		print "Power Lost: Shutting down"
+		app.stopKind = "PowerDown"
+		self.closeApp()
+
+	# Warn that the last run stopped part way through a cycle, so there may
+	# be a part or a short shot in the mold.
+	# -------------------------------------------------------------------------
+	def showLastRun( self, last ):
+		from kivy.uix.popup import Popup
+
+		box = BoxLayout( orientation='vertical', spacing=10 )
+		box.add_widget( Label( text="The last run stopped part way through a cycle.\n"
+			"{} / {} at {:.1f}s, {} parts.\nCheck the mold before starting.".format(
+				last['mode'], last['state'], last['timer'], last['partCount'] ),
+			halign='center' ) )
+		okBtn = Button( text="OK", size_hint_y=None, height=50 )
+		box.add_widget( okBtn )
+		popup = Popup( title="Last Run", content=box,
+			size_hint=(None, None), size=(450, 250) )
+		okBtn.bind( on_press=popup.dismiss )
+		popup.open()
+
+	# Popup to edit the eject sequences, one "seconds action" step per line.
+	# Save checks both, then sends them to the engine and the settings file.
+	# -------------------------------------------------------------------------
+	def editEject( self ):
+		from kivy.uix.popup import Popup
+		from kivy.uix.textinput import TextInput
+
+		def seqText( seq ):
+			return "\n".join( "{0:.2f} {1}".format( float( tm ), action ) for tm, action in seq )
+
+		def parseSeq( text ):
+			seq = []
+			for line in text.splitlines():
+				if line.strip():
+					tm, action = line.split()
+					seq.append( [ float( tm ), action ] )
+			ejectSequence( seq )	# Raises ValueError if it is no good.
+			return seq
+
+		box = BoxLayout( orientation='vertical', spacing=5 )
+		grid = GridLayout( cols=2, spacing=10 )
+		grid.add_widget( Label( text="Eject", size_hint_y=None, height=30 ) )
+		grid.add_widget( Label( text="Double Eject", size_hint_y=None, height=30 ) )
+		normal = TextInput( text=seqText( self.ejectSeq ) )
+		double = TextInput( text=seqText( self.doubleEjectSeq ) )
+		grid.add_widget( normal )
+		grid.add_widget( double )
+		box.add_widget( grid )
+		msg = Label( text="Actions: blowOn blowOff closeOn closeOff end",
+			size_hint_y=None, height=30, font_size=16 )
+		box.add_widget( msg )
+		buttons = BoxLayout( size_hint_y=None, height=50, spacing=10 )
+		saveBtn = Button( text="Save" )
+		cancelBtn = Button( text="Cancel" )
+		buttons.add_widget( saveBtn )
+		buttons.add_widget( cancelBtn )
+		box.add_widget( buttons )
+
+		popup = Popup( title="Eject Sequence (s after mold open delay)", content=box,
+			size_hint=(None, None), size=(600, 420) )
+
+		def save( *args ):
+			try:
+				ejectSeq = parseSeq( normal.text )
+				doubleEjectSeq = parseSeq( double.text )
+			except ( ValueError, TypeError ) as e:
+				msg.text = "Error: {}".format( e )
+				msg.color = (1,0,0,1)
+				return
+			store.update( { 'EjectSeq': ejectSeq, 'DoubleEjectSeq': doubleEjectSeq } )
+			store.flushSoon()
+			popup.dismiss()
+
+		saveBtn.bind( on_press=save )
+		cancelBtn.bind( on_press=popup.dismiss )
+		popup.open()
+
+	# Popup with the live barrel temperature (red), setpoint (green) and heater
+	# duty (yellow, 0-100% full height) trend.
 	# -------------------------------------------------------------------------
 	def chartTemp( self ):
-		popup = Popup(title='Temperature Charting Popup',
-		    content=Label(text='Future Feature - Maybe Someday...'),
-		    size_hint=(None, None), size=(400, 400) )
+		from kivy.uix.popup import Popup
+		from kivy.uix.togglebutton import ToggleButton
+		from chart import TempChart, SPANS
+
+		chart = TempChart( self.trend, tempLo=0, tempHi=max( 300, self.tempSetPt + 50 ) )
+		box = BoxLayout( orientation='vertical', spacing=5 )
+		box.add_widget( chart )
+		buttons = BoxLayout( size_hint_y=None, height=50, spacing=10 )
+		for span in SPANS:
+			if span < 3600:
+				text = "{} min".format( span // 60 )
+			else:
+				text = "{} hr".format( span // 3600 )
+			btn = ToggleButton( text=text, group='chartSpan',
+				state='down' if span == chart.span else 'normal' )
+			btn.bind( on_press=lambda b, span=span: setattr( chart, 'span', span ) )
+			buttons.add_widget( btn )
+		closeBtn = Button( text="Close" )
+		buttons.add_widget( closeBtn )
+		box.add_widget( buttons )
+
+		popup = Popup( title=u"Barrel Temp {0}-{1}\u00b0C".format( int( chart.tempLo ), int( chart.tempHi ) ),
+			content=box, size_hint=(None, None), size=(790, 470) )
+		closeBtn.bind( on_press=popup.dismiss )
+		popup.bind( on_dismiss=lambda *args: chart.stop() )
 		popup.open()
 
 	# -------------------------------------------------------------------------
@@ -488,18 +735,50 @@ class MainWindow( FloatLayout ):
 		pass
 
 
-# Used to test if a number is NaN (Not a Number).  The thermocouple lib 
-# returns a NaN if the sensor is unplugged.
-# -------------------------------------------------------------------------
-def isNaN(num):
-    return num != num
-
-
 # Main Arburg app starts here.
 # =============================================================================
 class ArburgApp(App):
+    stopKind = "Shutdown"   # Closing journal record, "PowerDown" for the UPS.
+
+    def load_kv(self, filename=None):
+        loaded = super(ArburgApp, self).load_kv(filename)
+        startup.mark( "KV File" )
+        return loaded
+
     def build(self):
-        return MainWindow()
+        press.start()
+        tempSampler.start()
+        shotLog.start()
+        journal.start()
+        startup.mark( "Threads" )
+        self.mainWindow = MainWindow()
+        startup.mark( "Main Window" )
+        return self.mainWindow
+
+    # The window is up, report the start up time once the first frame is
+    # drawn.
+    def on_start(self):
+        Clock.schedule_once( lambda dt: self.ready(), 0 )
+
+    def ready(self):
+        startup.ready()
+        print startup.report( store.get( 'StartupTarget' ) )
+
+    # Stop the control engine so the outputs are left off, then write out
+    # any unsaved settings.  A UPS power down then shuts the Pi down.
+    def on_stop(self):
+        self.mainWindow.engine.stop()
+        journal.stop( self.stopKind )
+        if self.mainWindow.statusServer is not None:
+            self.mainWindow.statusServer.stop()
+        if self.mainWindow.fleetReporter is not None:
+            self.mainWindow.fleetReporter.stop()
+        tempSampler.stop()
+        press.stop()
+        shotLog.stop()
+        store.close()
+        if self.stopKind == "PowerDown" and store.get( 'ShutdownCmd' ):
+            subprocess.call( shlex.split( store.get( 'ShutdownCmd' ) ) )
 
 
 if __name__ == '__main__':
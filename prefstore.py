@@ -0,0 +1,362 @@
+# =============================================================================
+#
+#	Settings Store - Typed, cached settings with per-mold recipes.
+#
+#	The settings live in one JSON file, read once at startup and checked
+#	against SCHEMA.  Everything after that is served from memory.  Values of
+#	the wrong type fall back to the schema default, and a file that will not
+#	parse is moved to .bad and the defaults used, so a hand edited file can
+#	not take the app down.  SCHEMA is also the one place the defaults live.
+#
+#	Settings marked as recipe settings (cycle times, eject, setpoint, mold
+#	part count) are kept per mold.  selectRecipe() switches the whole set at
+#	once.  The rest are machine settings shared by all molds.
+#
+#	bind( key, callback ) calls callback( key, value ) whenever that setting
+#	changes, from update() or a recipe switch, on the caller's thread.
+#
+#	Writes are write-behind.  update() only changes memory and a background
+#	thread writes the file at most once per flush period, and on close() or
+#	flushSoon() (UPS power loss).  Each write goes to a temp file that is
+#	synced and renamed over the old one, so a power cut leaves either the old
+#	or the new file, never a half written one.
+#
+#	The first start after the switch from pypref reads the old settings.py
+#	into the new file.
+#
+# =============================================================================
+import ast
+import json
+import os
+import tempfile
+import threading
+
+from control import DEFAULT_PROFILE, EJECT_SEQ, DOUBLE_EJECT_SEQ
+
+
+# Every setting: type, default, and True if it is kept per recipe.
+SCHEMA = {
+	# Machine
+	'Backend': ( str, "pi", False ),			# "pi" or "sim", see hal.py.
+	'ShotLogDir': ( str, "shotlog", False ),
+	'JournalFile': ( str, "journal.bin", False ),
+	'UpsGrace': ( float, 5., False ),			# Power lost to shut down (s), 0 never.
+	'ShutdownCmd': ( str, "sudo shutdown -h now", False ),
+	'StatusPort': ( int, 8080, False ),			# 0 turns the status server off.
+	'StatusHost': ( str, "127.0.0.1", False ),	# Status server address, "" for all interfaces.
+	'FleetHost': ( str, "", False ),			# Fleet coordinator, "" for none.
+	'FleetPort': ( int, 9090, False ),
+	'FleetName': ( str, "", False ),			# Name in the fleet, "" for the host name.
+	'Profile': ( bool, False, False ),			# Handler timing, see instrument.py.
+	'StartupTarget': ( float, 10., False ),		# Warn if start up takes longer (s).
+	'MaxTime': ( float, 45., False ),			# Time slider length (s).
+	'TimeStep': ( float, 0.5, False ),			# Time slider step (s).
+	'HeaterP': ( float, 30., False ),			# PID proportional value.
+	'HeaterI': ( float, 1., False ),			# PID integral value.
+	'HeaterD': ( float, 0., False ),			# PID derivative value.
+	'HeaterIBand': ( float, 20., False ),		# Integral band (deg C).
+	'HeaterPeriod': ( float, 30., False ),		# Heater relay window (s).
+	'SetPtStep': ( float, 50., False ),			# Step change to adjust setpt.
+	'TempOKBand': ( float, 10., False ),		# Temp OK band around setpt.
+	# Recipe
+	'SetPt': ( float, 200., True ),				# Barrel temperature (deg C).
+	'CycleTm': ( float, 20., True ),			# Mold close time (s).
+	'InjTm': ( float, 10., True ),				# Injection time (s).
+	'MoldOpenDelay': ( float, 1., True ),		# Min mold hold open delay (s).
+	'AdaptiveOpen': ( bool, False, True ),		# Learn a shorter open delay.
+	'OpenMargin': ( float, 0.2, True ),			# Margin on the learned drop time (s).
+	'DoubleEject': ( bool, False, True ),
+	'DoubleInject': ( bool, False, True ),
+	'ShotProfile': ( list, DEFAULT_PROFILE, True ),
+	'EjectSeq': ( list, EJECT_SEQ, True ),
+	'DoubleEjectSeq': ( list, DOUBLE_EJECT_SEQ, True ),
+	'TotalCount': ( int, 0, True ),				# Parts made on this mold.
+}
+
+try:
+	STRING_TYPES = basestring		# Python 2 str or unicode.
+except NameError:
+	STRING_TYPES = str
+
+VERSION = 1
+DEFAULT_RECIPE = "Default"
+
+
+# Returns 'val' as setting 'key's type.  Raises ValueError if it is not.
+# Unknown keys pass through as they are.
+# -------------------------------------------------------------------------
+def checkValue( key, val ):
+	if key not in SCHEMA:
+		return val
+	kind = SCHEMA[key][0]
+	if kind is bool:
+		if isinstance( val, bool ):
+			return val
+	elif kind is float:
+		if isinstance( val, ( int, float ) ) and not isinstance( val, bool ):
+			return float( val )
+	elif kind is int:
+		if isinstance( val, ( int, float ) ) and not isinstance( val, bool ) and val == int( val ):
+			return int( val )
+	elif kind is str:
+		if isinstance( val, STRING_TYPES ):
+			return val
+	elif kind is list:
+		if isinstance( val, ( list, tuple ) ):
+			return [ list( v ) if isinstance( v, ( list, tuple ) ) else v for v in val ]
+	raise ValueError( "Setting {} must be {} -> {!r}".format( key, kind.__name__, val ) )
+
+
+# Reads the preferences dict out of an old pypref settings.py without
+# importing it.
+# -------------------------------------------------------------------------
+def readPypref( path ):
+	values = {}
+	with open( path ) as f:
+		for line in f:
+			line = line.strip()
+			if not line.startswith( "preferences[" ):
+				continue
+			target, text = line.split( "=", 1 )
+			key = ast.literal_eval( target.strip()[len( "preferences[" ):-1] )
+			values[key] = ast.literal_eval( text.strip() )
+	return values
+
+
+# The settings.  get() and update() only touch memory and never block on
+# the disk.
+# =============================================================================
+class PrefStore( object ):
+
+	# -------------------------------------------------------------------------
+	def __init__( self, path=None, flushPeriod=10., legacy="settings.py" ):
+		home = os.path.expanduser( '~' )
+		self.fullpath = path or os.path.join( home, "settings.json" )
+		self.flushPeriod = flushPeriod
+		self.dirty = False
+		self.writes = 0				# Number of times the file was written.
+		self.lock = threading.Lock()		# Guards the values and dirty.
+		self.fileLock = threading.Lock()	# One file write at a time.
+		self.wake = threading.Event()
+		self.stopping = False
+		self.listeners = {}			# Setting -> list of callbacks.
+
+		self.clear()
+		legacyPath = os.path.join( home, legacy ) if legacy else None
+		try:
+			if os.path.exists( self.fullpath ):
+				self.load()
+			elif legacyPath and os.path.exists( legacyPath ):
+				self.loadValues( readPypref( legacyPath ) )
+				self.dirty = True		# Save it in the new format.
+		except ( IOError, ValueError, SyntaxError, AttributeError, TypeError ) as e:
+			self.loadFailed( self.fullpath if os.path.exists( self.fullpath ) else legacyPath, e )
+		self.values = self.merged()
+
+		self.thread = threading.Thread( target=self.run )
+		self.thread.daemon = True
+		self.thread.start()
+
+	# Back to no settings, every one reads as the schema default.
+	# -------------------------------------------------------------------------
+	def clear( self ):
+		self.machine = {}			# Machine settings.
+		self.recipes = { DEFAULT_RECIPE: {} }	# Recipe name -> recipe settings.
+		self.recipe = DEFAULT_RECIPE
+
+	# A settings file could not be read at all.  Keep it as .bad for a look
+	# later and start from the defaults.
+	# -------------------------------------------------------------------------
+	def loadFailed( self, path, e ):
+		print( "Settings Error: Can not read {} -> {}".format( path, e ) )
+		self.clear()
+		self.dirty = False
+		try:
+			os.rename( path, path + ".bad" )
+		except OSError as e:
+			print( "Settings Error: {}".format( e ) )
+
+	# Read and check the settings file.
+	# -------------------------------------------------------------------------
+	def load( self ):
+		with open( self.fullpath ) as f:
+			data = json.load( f )
+		if data.get( 'version' ) != VERSION:
+			print( "Settings Error: Unknown settings version -> {}".format( data.get( 'version' ) ) )
+		self.machine = self.checked( data.get( 'machine', {} ) )
+		self.recipes = dict( ( name, self.checked( recipe ) )
+			for name, recipe in data.get( 'recipes', {} ).items() )
+		self.recipe = data.get( 'recipe', DEFAULT_RECIPE )
+		if self.recipe not in self.recipes:
+			self.recipes[self.recipe] = {}
+
+	# Sort a flat dict of settings into machine and current recipe settings.
+	# -------------------------------------------------------------------------
+	def loadValues( self, values ):
+		for key, val in self.checked( values ).items():
+			if isRecipe( key ):
+				self.recipes[self.recipe][key] = val
+			else:
+				self.machine[key] = val
+
+	# Copy of 'values' with the bad ones dropped, so they read as the default.
+	# -------------------------------------------------------------------------
+	def checked( self, values ):
+		good = {}
+		for key, val in values.items():
+			try:
+				good[str( key )] = checkValue( key, val )
+			except ValueError as e:
+				print( "Settings Error: {}".format( e ) )
+		return good
+
+	# Flat dict of every setting for the current recipe.
+	# -------------------------------------------------------------------------
+	def merged( self ):
+		values = dict( ( key, spec[1] ) for key, spec in SCHEMA.items() )
+		values.update( self.machine )
+		values.update( self.recipes[self.recipe] )
+		return values
+
+	# Cached value, the schema default if it was never set.
+	# -------------------------------------------------------------------------
+	def get( self, key, default=None ):
+		val = self.values.get( key )
+		if val is None:
+			return default
+		if isinstance( val, list ):
+			return [ list( v ) if isinstance( v, list ) else v for v in val ]
+		return val
+
+	# Call 'callback( key, value )' whenever setting 'key' changes.
+	# -------------------------------------------------------------------------
+	def bind( self, key, callback ):
+		self.listeners.setdefault( key, [] ).append( callback )
+
+	# Merge a dict of settings.  Raises ValueError, changing nothing, if any
+	# value is the wrong type.  The file is written later by the flush thread.
+	# -------------------------------------------------------------------------
+	def update( self, prefs ):
+		prefs = dict( ( key, checkValue( key, val ) ) for key, val in prefs.items() )
+		changed = []
+		with self.lock:
+			for key, val in prefs.items():
+				if self.values.get( key ) != val:
+					if isRecipe( key ):
+						self.recipes[self.recipe][key] = val
+					else:
+						self.machine[key] = val
+					self.values[key] = val
+					self.dirty = True
+					changed.append( key )
+		self.notify( changed )
+
+	# -------------------------------------------------------------------------
+	def notify( self, keys ):
+		for key in keys:
+			for callback in self.listeners.get( key, [] ):
+				callback( key, self.get( key ) )
+
+	# Names of the saved recipes, sorted.
+	# -------------------------------------------------------------------------
+	def recipeNames( self ):
+		return sorted( self.recipes )
+
+	# Switch to recipe 'name'.  A new name starts as a copy of the current
+	# recipe, with its total part count back at 0.  Listeners hear about
+	# every setting that changed.
+	# -------------------------------------------------------------------------
+	def selectRecipe( self, name ):
+		with self.lock:
+			if name == self.recipe:
+				return
+			if name not in self.recipes:
+				self.recipes[name] = dict( ( key, val )
+					for key, val in self.values.items() if isRecipe( key ) )
+				self.recipes[name]['TotalCount'] = SCHEMA['TotalCount'][1]
+			old = self.values
+			self.recipe = name
+			self.values = self.merged()
+			self.dirty = True
+			changed = [ key for key in self.values if old.get( key ) != self.values[key] ]
+		self.notify( changed )
+
+	# Ask the flush thread to write now instead of at the end of the period.
+	# Does not wait for the write.  Use this on UPS power loss.
+	# -------------------------------------------------------------------------
+	def flushSoon( self ):
+		self.wake.set()
+
+	# Stop the flush thread and write anything pending.  Blocks until done.
+	# -------------------------------------------------------------------------
+	def close( self ):
+		self.stopping = True
+		self.wake.set()
+		self.thread.join( 5. )
+		self.flush()
+
+	# -------------------------------------------------------------------------
+	def run( self ):
+		while not self.stopping:
+			self.wake.wait( self.flushPeriod )
+			self.wake.clear()
+			try:
+				self.flush()
+			except Exception as e:
+				print( "Settings Save Error: {}".format( e ) )
+
+	# Write the settings file if anything changed.
+	# -------------------------------------------------------------------------
+	def flush( self ):
+		with self.fileLock:
+			with self.lock:
+				if not self.dirty:
+					return
+				data = {
+					'version': VERSION,
+					'recipe': self.recipe,
+					'machine': dict( self.machine ),
+					'recipes': dict( ( name, dict( recipe ) ) for name, recipe in self.recipes.items() ),
+				}
+				self.dirty = False
+			try:
+				self.writeFile( json.dumps( data, indent=1, sort_keys=True ) + "\n" )
+			except Exception:
+				with self.lock:
+					self.dirty = True	# Try again on the next flush.
+				raise
+			self.writes += 1
+
+	# Atomic write: temp file in the same directory, fsync, then rename.
+	# -------------------------------------------------------------------------
+	def writeFile( self, text ):
+		directory, name = os.path.split( self.fullpath )
+		fd, tmpPath = tempfile.mkstemp( prefix=name + '.', suffix='.tmp', dir=directory or '.' )
+		try:
+			with os.fdopen( fd, 'w' ) as f:
+				f.write( text )
+				f.flush()
+				os.fsync( f.fileno() )
+			os.rename( tmpPath, self.fullpath )
+		except Exception:
+			if os.path.exists( tmpPath ):
+				os.remove( tmpPath )
+			raise
+
+		# Sync the directory so the rename itself survives a power cut.
+		try:
+			dirFd = os.open( directory or '.', os.O_RDONLY )
+		except OSError:
+			return
+		try:
+			os.fsync( dirFd )
+		except OSError:
+			pass
+		finally:
+			os.close( dirFd )
+
+
+# True if setting 'key' is kept per recipe.
+# -------------------------------------------------------------------------
+def isRecipe( key ):
+	return key in SCHEMA and SCHEMA[key][2]
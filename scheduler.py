@@ -0,0 +1,168 @@
+# =============================================================================
+#
+#	Control Loop Scheduler - Monotonic clock timing for the Arburg controller.
+#
+#	The old code advanced the cycle timer with 'timer += 0.1' on every Kivy
+#	tick, so any late tick stretched the inject / cool / open phases.  Here
+#	every tick and every phase change is stamped against a monotonic clock.
+#	Phase deadlines are measured from the start of the cycle, so a late tick
+#	delays only that one transition and never pushes out the later ones.
+#
+# =============================================================================
+import time
+
+try:
+	from time import monotonic
+except ImportError:
+	# Python 2 has no monotonic clock in the time module.  On Linux (the Pi)
+	# call clock_gettime( CLOCK_MONOTONIC ) directly.  Anywhere else, fall
+	# back to the wall clock so the code still runs on a desktop.
+	try:
+		import ctypes
+		import os
+
+		CLOCK_MONOTONIC = 1
+
+		class _Timespec( ctypes.Structure ):
+			_fields_ = [ ('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long) ]
+
+		_librt = ctypes.CDLL( 'librt.so.1', use_errno=True )
+		_clockGettime = _librt.clock_gettime
+		_clockGettime.argtypes = [ ctypes.c_int, ctypes.POINTER( _Timespec ) ]
+
+		def monotonic():
+			t = _Timespec()
+			if _clockGettime( CLOCK_MONOTONIC, ctypes.pointer( t ) ) != 0:
+				errno = ctypes.get_errno()
+				raise OSError( errno, os.strerror( errno ) )
+			return t.tv_sec + t.tv_nsec * 1e-9
+
+	except (OSError, AttributeError):
+		monotonic = time.time
+
+
+# Runs a fixed rate loop against the monotonic clock.  Call tick() once per
+# loop.  Each tick is compared to its ideal time to get the jitter.  A tick
+# that is a full period or more late counts as an overrun.  Missed ticks
+# are dropped rather than run back to back.
+# =============================================================================
+class LoopScheduler( object ):
+
+	# -------------------------------------------------------------------------
+	def __init__( self, period, clock=monotonic ):
+		self.period = float( period )
+		self.clock = clock
+		self.reset()
+
+	# -------------------------------------------------------------------------
+	def reset( self ):
+		self.now = self.clock()
+		self.nextTick = None	# Ideal time of the next tick.
+		self.ticks = 0			# Total ticks run.
+		self.overruns = 0		# Ticks late by a full period or more.
+		self.missed = 0			# Ticks skipped because of overruns.
+		self.lastJitter = 0.	# Lateness of the last tick (seconds).
+		self.maxJitter = 0.		# Worst lateness seen (seconds).
+		self.sumJitter = 0.		# Used to calculate the mean jitter.
+
+	# Call once per loop.  Returns the monotonic time stamp for this tick.
+	# -------------------------------------------------------------------------
+	def tick( self ):
+		self.now = self.clock()
+		if self.nextTick is None:
+			self.nextTick = self.now
+
+		jitter = self.now - self.nextTick
+		if jitter < 0.:
+			jitter = 0.		# Early ticks (extra deadline wakeups) are not jitter.
+		self.ticks += 1
+		self.lastJitter = jitter
+		self.sumJitter += jitter
+		if jitter > self.maxJitter:
+			self.maxJitter = jitter
+
+		# If this tick ran a whole period late, skip the missed ticks and line
+		# up with the next one.  Running them back to back would only burn CPU.
+		if jitter >= self.period:
+			self.overruns += 1
+			skipped = int( jitter / self.period )
+			self.missed += skipped
+			self.nextTick += skipped * self.period
+
+		# Only move the ideal time forward on the regular tick.  Extra wakeups
+		# for phase deadlines between ticks leave it alone.
+		if self.now >= self.nextTick:
+			self.nextTick += self.period
+		return self.now
+
+	# Seconds to wait before the next tick or the given deadline, whichever
+	# comes first.  Never returns a negative number.
+	# -------------------------------------------------------------------------
+	def timeToNext( self, deadline=None ):
+		now = self.clock()
+		nxt = self.nextTick if self.nextTick is not None else now
+		if deadline is not None and deadline < nxt:
+			nxt = deadline
+		return max( 0., nxt - now )
+
+	# -------------------------------------------------------------------------
+	def stats( self ):
+		if self.ticks:
+			mean = self.sumJitter / self.ticks
+		else:
+			mean = 0.
+		return {
+			'period': self.period,
+			'ticks': self.ticks,
+			'overruns': self.overruns,
+			'missed': self.missed,
+			'lastJitter': self.lastJitter,
+			'meanJitter': mean,
+			'maxJitter': self.maxJitter,
+		}
+
+	# -------------------------------------------------------------------------
+	def report( self ):
+		s = self.stats()
+		return ( "Ticks: {ticks}  Overruns: {overruns}  Missed: {missed}  "
+			"Jitter last/mean/max: {0:.1f}/{1:.1f}/{2:.1f}ms".format(
+				s['lastJitter'] * 1000., s['meanJitter'] * 1000.,
+				s['maxJitter'] * 1000., **s ) )
+
+
+# Stamps each phase change of a machine cycle against the monotonic clock.
+# elapsed() is the cycle time since start(), always taken from the clock, so
+# it does not drift with the tick rate.
+# =============================================================================
+class PhaseClock( object ):
+
+	# -------------------------------------------------------------------------
+	def __init__( self ):
+		self.startTm = None
+		self.marks = []			# List of ( phase, time stamp ) in order.
+
+	# Start a new cycle at time stamp 'now' in the given phase.
+	# -------------------------------------------------------------------------
+	def start( self, now, phase="Close" ):
+		self.startTm = now
+		self.marks = [ ( phase, now ) ]
+
+	# Record that the cycle entered 'phase' at time stamp 'now'.
+	# -------------------------------------------------------------------------
+	def mark( self, phase, now ):
+		self.marks.append( ( phase, now ) )
+
+	# Seconds since the start of the cycle.
+	# -------------------------------------------------------------------------
+	def elapsed( self, now ):
+		if self.startTm is None:
+			return 0.
+		return now - self.startTm
+
+	# List of ( phase, seconds ) for each phase finished so far.
+	# -------------------------------------------------------------------------
+	def durations( self ):
+		out = []
+		for i in range( len( self.marks ) - 1 ):
+			out.append( ( self.marks[i][0], self.marks[i+1][1] - self.marks[i][1] ) )
+		return out
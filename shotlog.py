@@ -0,0 +1,212 @@
+# =============================================================================
+#
+#	Shot Log - Append-only binary record of every molding cycle.
+#
+#	Each finished cycle is one fixed width 60 byte little endian record
+#	(see RECORD).  The control engine hands records to add(), which only
+#	appends to a deque.  A background thread packs and writes them in
+#	batches, so the control loop never does file I/O.  A new file is
+#	started each day and whenever the current one passes maxBytes.
+#
+#	Read the files back for analysis with readShots(), which returns a NumPy
+#	structured array (one row per shot) built straight from the file bytes.
+#
+#		shots = readShots( "shotlog" )
+#		print( shots['cycleTm'].mean() )
+#
+# =============================================================================
+import glob
+import os
+import struct
+import threading
+import time
+from collections import deque
+
+from control import ControlEngine
+from scheduler import monotonic
+
+
+MAGIC = b'ARBSHOT2'
+VERSION = 2
+HEADER = struct.Struct( '<8sII' )		# Magic, version, record size.
+
+# start		Wall clock time the cycle started (s since epoch).
+# cycleTm	Total cycle time (s).
+# close .. detect	Time spent in each state (s).  inject2 and cool2 are
+#			the later shot profile stages of Auto2, 0 in Auto.
+# injTm, coolTm		Inject and cool settings for the shot (s).
+# detectLatency		Mold open to part detect (s), NaN if not seen.
+# tempC		Barrel temperature (deg C), NaN if not read.
+# mode		Index into ControlEngine.modes.
+# doubleEject	1 if double eject was on.
+FIELDS = [
+	( 'start', 'd' ),
+	( 'cycleTm', 'f' ),
+	( 'close', 'f' ),
+	( 'cool', 'f' ),
+	( 'inject2', 'f' ),
+	( 'cool2', 'f' ),
+	( 'open', 'f' ),
+	( 'eject', 'f' ),
+	( 'detect', 'f' ),
+	( 'injTm', 'f' ),
+	( 'coolTm', 'f' ),
+	( 'detectLatency', 'f' ),
+	( 'tempC', 'f' ),
+	( 'mode', 'B' ),
+	( 'doubleEject', 'B' ),
+]
+RECORD = struct.Struct( '<' + ''.join( f for n, f in FIELDS ) + '2x' )
+
+NAN = float( 'nan' )
+
+
+# Pack one engine cycle record.  'wallStart' is the wall clock start time.
+# -------------------------------------------------------------------------
+def packShot( rec, wallStart ):
+	phases = rec['phases']
+
+	def num( val ):
+		return NAN if val is None else val
+
+	mode = rec['mode']
+	return RECORD.pack(
+		wallStart,
+		rec['cycleTm'],
+		phases.get( "Close", 0. ),
+		phases.get( "Cool", 0. ),
+		phases.get( "Inject2", 0. ),
+		phases.get( "Cool2", 0. ),
+		phases.get( "Open", 0. ),
+		phases.get( "Eject", 0. ),
+		phases.get( "Detect", 0. ),
+		rec['injTm'],
+		rec['coolTm'],
+		num( rec['detectLatency'] ),
+		num( rec['tempC'] ),
+		ControlEngine.modes.index( mode ) if mode in ControlEngine.modes else 255,
+		1 if rec['doubleEject'] else 0 )
+
+
+# The writer.  Use add() as an engine cycle listener.
+# =============================================================================
+class ShotLog( threading.Thread ):
+
+	# -------------------------------------------------------------------------
+	def __init__( self, directory="shotlog", maxBytes=8 * 1024 * 1024,
+			flushPeriod=1., clock=monotonic ):
+		super( ShotLog, self ).__init__()
+		self.daemon = True
+		self.directory = directory
+		self.maxBytes = maxBytes
+		self.flushPeriod = flushPeriod
+		self.clock = clock
+		self.pending = deque()
+		self.stopEvent = threading.Event()
+		self.f = None
+		self.day = None
+		self.path = None
+		self.written = 0		# Shots written since start.
+
+	# Queue a cycle record.  Never blocks, safe on the engine thread.
+	# -------------------------------------------------------------------------
+	def add( self, rec ):
+		# Turn the monotonic start time into wall clock time now, while the two
+		# clocks still line up with this cycle.
+		wallStart = time.time() - ( self.clock() - rec['start'] )
+		self.pending.append( ( rec, wallStart ) )
+
+	# -------------------------------------------------------------------------
+	def stop( self ):
+		self.stopEvent.set()
+		if self.is_alive():
+			self.join( 5. )
+		self.writePending()
+		self.closeFile()
+
+	# -------------------------------------------------------------------------
+	def run( self ):
+		while not self.stopEvent.is_set():
+			self.stopEvent.wait( self.flushPeriod )
+			try:
+				self.writePending()
+			except Exception as e:
+				print( "Shot Log Error: {}".format( e ) )
+
+	# Pack and write everything queued, in one write call.
+	# -------------------------------------------------------------------------
+	def writePending( self ):
+		chunks = []
+		while True:
+			try:
+				rec, wallStart = self.pending.popleft()
+			except IndexError:
+				break
+			chunks.append( packShot( rec, wallStart ) )
+		if not chunks:
+			return
+		self.openFile()
+		self.f.write( b''.join( chunks ) )
+		self.f.flush()
+		self.written += len( chunks )
+
+	# Open a new file on the first write, a new day, or when this one is full.
+	# -------------------------------------------------------------------------
+	def openFile( self ):
+		day = time.strftime( "%Y%m%d" )
+		if self.f is not None:
+			if day == self.day and self.f.tell() < self.maxBytes:
+				return
+			self.closeFile()
+
+		if not os.path.isdir( self.directory ):
+			os.makedirs( self.directory )
+		self.day = day
+		self.path = os.path.join( self.directory,
+			"shots-{}.bin".format( time.strftime( "%Y%m%d-%H%M%S" ) ) )
+		self.f = open( self.path, 'ab' )
+		if self.f.tell() == 0:
+			self.f.write( HEADER.pack( MAGIC, VERSION, RECORD.size ) )
+
+	# -------------------------------------------------------------------------
+	def closeFile( self ):
+		if self.f is not None:
+			self.f.flush()
+			os.fsync( self.f.fileno() )
+			self.f.close()
+			self.f = None
+
+
+# NumPy dtype matching RECORD.
+# -------------------------------------------------------------------------
+def shotDtype():
+	import numpy as np
+	names = [ n for n, f in FIELDS ] + [ 'pad' ]
+	formats = [ '<f8' if f == 'd' else '<f4' if f == 'f' else 'u1' for n, f in FIELDS ] + [ 'V2' ]
+	return np.dtype( { 'names': names, 'formats': formats } )
+
+
+# Read one shot file, or every shots-*.bin file in a directory (oldest
+# first), into a NumPy structured array.
+# -------------------------------------------------------------------------
+def readShots( path ):
+	import numpy as np
+
+	if os.path.isdir( path ):
+		files = sorted( glob.glob( os.path.join( path, "shots-*.bin" ) ) )
+	else:
+		files = [ path ]
+
+	dtype = shotDtype()
+	arrays = []
+	for name in files:
+		with open( name, 'rb' ) as f:
+			magic, version, size = HEADER.unpack( f.read( HEADER.size ) )
+			if magic != MAGIC or size != RECORD.size:
+				raise ValueError( "Not a version {} shot log -> {}".format( VERSION, name ) )
+			data = f.read()
+		count = len( data ) // size		# Drop a partly written last record.
+		arrays.append( np.frombuffer( data[:count * size], dtype=dtype ) )
+	if not arrays:
+		return np.zeros( 0, dtype=dtype )
+	return np.concatenate( arrays )
@@ -0,0 +1,153 @@
+# =============================================================================
+#
+#	Cycle Simulator - Runs the auto cycle against the simulated press on a
+#	virtual clock, thousands of times faster than real time.
+#
+#	The control engine and the SimBackend press are stepped together.  Time
+#	jumps straight to the next thing that can happen: a phase deadline, or
+#	the first engine tick after a simulated input edge (the real engine only
+#	sees edges on its next pass).  Nothing sleeps.
+#
+#	Ex:	python simulate.py --cycles 5000 --cyc 18 --inj 9 --open 0.8
+#
+#	Settings not given on the command line come from the saved settings.
+#
+# =============================================================================
+import argparse
+import math
+import time
+
+from control import ControlEngine
+from hal import SimBackend
+
+
+# Run 'cycles' auto cycles with the given settings dict (CycTm, InjTm,
+# MoldOpenDelay, AdaptiveOpen, DoubleEject, DoubleInject, ShotProfile,
+# EjectSeq, DoubleEjectSeq).  'press' is a dict of SimBackend options
+# (dropTm, blowTm, pulseTm).  Returns the list of cycle records.
+# -------------------------------------------------------------------------
+def runCycles( settings, cycles=1000, press=None, period=0.01 ):
+	sim = SimBackend( clock=lambda: 0., **( press or {} ) )
+	clock = lambda: sim.now		# Virtual time, moved by sim.advance().
+	engine = ControlEngine( sim.close, sim.inj, sim.blowOff, sim.heater,
+		sim.estop, sim.partDet, period=period, clock=clock )
+	engine.attachInputs( sim.ups )
+
+	records = []
+	engine.cycleListeners.append( records.append )
+	engine.post( "params", settings )
+	engine.step( 0. )
+	engine.post( "start" )
+	engine.step( 0. )
+
+	now = 0.
+	while len( records ) < cycles:
+		now = nextWake( engine, sim, now, period )
+		sim.advance( now )
+		engine.step( now )
+	return records
+
+
+# Virtual time of the next engine pass that can change anything.
+# -------------------------------------------------------------------------
+def nextWake( engine, sim, now, period ):
+	wake = engine.deadlineAt()
+	if wake is not None:
+		# Land just past the deadline so float rounding in start + deadline
+		# can not leave the cycle timer a hair short of it.
+		wake += 1e-9
+	event = sim.nextEvent()
+	if event is not None:
+		tick = math.ceil( event / period ) * period		# Next tick on or after it.
+		if wake is None or tick < wake:
+			wake = tick
+	if wake is None or wake <= now:
+		wake = now + period
+	return wake
+
+
+# Summary of a list of cycle records.
+# -------------------------------------------------------------------------
+def summarize( records ):
+	total = sum( r['cycleTm'] for r in records )
+	phases = {}
+	for r in records:
+		for phase, tm in r['phases'].items():
+			phases.setdefault( phase, [] ).append( tm )
+	latency = [ r['detectLatency'] for r in records if r['detectLatency'] is not None ]
+	waits = [ r['detectWait'] for r in records ]
+
+	return {
+		'cycles': len( records ),
+		'simSeconds': total,
+		'partsPerHour': 3600. * len( records ) / total if total else 0.,
+		'meanCycleTm': total / len( records ) if records else 0.,
+		'phases': dict( ( p, ( sum( v ) / len( v ), min( v ), max( v ) ) )
+			for p, v in phases.items() ),
+		'detectWait': ( sum( waits ) / len( waits ), max( waits ) ) if waits else ( 0., 0. ),
+		'detectLatency': ( sum( latency ) / len( latency ), max( latency ) ) if latency else None,
+	}
+
+
+# -------------------------------------------------------------------------
+def printSummary( s, wall ):
+	print( "Cycles: {0}  Parts/Hr: {1:.1f}  Mean Cycle: {2:.3f}s".format(
+		s['cycles'], s['partsPerHour'], s['meanCycleTm'] ) )
+	for phase in [ "Close", "Cool", "Inject2", "Cool2", "Open", "Eject", "Detect" ]:
+		if phase in s['phases']:
+			mean, lo, hi = s['phases'][phase]
+			print( "  {0:<7} mean {1:.3f}s  min {2:.3f}s  max {3:.3f}s".format( phase, mean, lo, hi ) )
+	print( "  Detect wait mean {0:.3f}s  max {1:.3f}s".format( *s['detectWait'] ) )
+	if s['detectLatency']:
+		print( "  Open to part detect mean {0:.3f}s  max {1:.3f}s".format( *s['detectLatency'] ) )
+	if wall > 0.:
+		print( "Simulated {0:.0f}s in {1:.2f}s ({2:.0f}x real time)".format(
+			s['simSeconds'], wall, s['simSeconds'] / wall ) )
+
+
+# Cycle settings from the saved settings, see prefstore.py.
+# -------------------------------------------------------------------------
+def savedSettings():
+	from prefstore import PrefStore
+	store = PrefStore()
+	settings = dict( ( key, store.get( key ) ) for key in [ 'InjTm', 'MoldOpenDelay',
+		'AdaptiveOpen', 'OpenMargin', 'DoubleEject', 'DoubleInject', 'ShotProfile',
+		'EjectSeq', 'DoubleEjectSeq' ] )
+	settings['CycTm'] = store.get( 'CycleTm' )
+	return settings
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser( description="Simulate Arburg auto cycles." )
+	parser.add_argument( '--cycles', type=int, default=1000 )
+	parser.add_argument( '--cyc', type=float, help="Mold close time (s)" )
+	parser.add_argument( '--inj', type=float, help="Injection time (s)" )
+	parser.add_argument( '--open', type=float, help="Mold open delay (s)" )
+	parser.add_argument( '--adaptive', action='store_true', help="Learn the mold open delay" )
+	parser.add_argument( '--double', action='store_true', help="Double eject" )
+	parser.add_argument( '--double-inject', action='store_true', help="Run the shot profile (Auto2)" )
+	parser.add_argument( '--profile', help="Shot profile, eg. inject:6,cool:2,inject:4,cool:8" )
+	parser.add_argument( '--drop', type=float, default=1.2, help="Part drop time after open (s)" )
+	parser.add_argument( '--blow', type=float, default=0.15, help="Part drop time after blow off (s)" )
+	args = parser.parse_args()
+
+	settings = savedSettings()
+	if args.cyc is not None:
+		settings['CycTm'] = args.cyc
+	if args.inj is not None:
+		settings['InjTm'] = args.inj
+	if args.open is not None:
+		settings['MoldOpenDelay'] = args.open
+	if args.double:
+		settings['DoubleEject'] = True
+	if args.adaptive:
+		settings['AdaptiveOpen'] = True
+	if args.double_inject:
+		settings['DoubleInject'] = True
+	if args.profile:
+		settings['ShotProfile'] = [ [ kind, float( tm ) ]
+			for kind, tm in ( stage.split( ':' ) for stage in args.profile.split( ',' ) ) ]
+
+	start = time.time()
+	records = runCycles( settings, args.cycles, { 'dropTm': args.drop, 'blowTm': args.blow } )
+	printSummary( summarize( records ), time.time() - start )
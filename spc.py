@@ -0,0 +1,289 @@
+# =============================================================================
+#
+#	Cycle Statistics - Running SPC numbers for actual cycle times.
+#
+#	Every finished cycle feeds each tracked value (cycle time, detect wait)
+#	into three aggregates, all updated in constant time per shot:
+#
+#		RunningStats	Shift count, mean, variance (Welford), min and max.
+#		RollingWindow	The last 'size' shots, kept sorted for percentiles.
+#		XbarR			X-bar / R chart of consecutive subgroups, with the
+#						control limits from the shift's grand mean and mean
+#						range.
+#
+#	ShiftStats is the control engine cycle listener.  add() only queues the
+#	record, the UI thread folds the queue in with update().
+#
+#	The shift report is also on the status server at /shift.
+#
+# =============================================================================
+import bisect
+import math
+import time
+from collections import deque
+
+
+# X-bar / R chart constants by subgroup size: ( A2, D3, D4 ).
+XBAR_R = {
+	2: ( 1.880, 0., 3.267 ),
+	3: ( 1.023, 0., 2.574 ),
+	4: ( 0.729, 0., 2.282 ),
+	5: ( 0.577, 0., 2.114 ),
+	6: ( 0.483, 0., 2.004 ),
+	7: ( 0.419, 0.076, 1.924 ),
+	8: ( 0.373, 0.136, 1.864 ),
+	9: ( 0.337, 0.184, 1.816 ),
+	10: ( 0.308, 0.223, 1.777 ),
+}
+
+
+# Count, mean and variance without keeping the samples (Welford's method).
+# =============================================================================
+class RunningStats( object ):
+
+	# -------------------------------------------------------------------------
+	def __init__( self ):
+		self.reset()
+
+	# -------------------------------------------------------------------------
+	def reset( self ):
+		self.count = 0
+		self.mean = 0.
+		self.m2 = 0.		# Sum of squared differences from the mean.
+		self.min = None
+		self.max = None
+
+	# -------------------------------------------------------------------------
+	def add( self, x ):
+		self.count += 1
+		delta = x - self.mean
+		self.mean += delta / self.count
+		self.m2 += delta * ( x - self.mean )
+		if self.min is None or x < self.min:
+			self.min = x
+		if self.max is None or x > self.max:
+			self.max = x
+
+	# Sample variance.
+	# -------------------------------------------------------------------------
+	def variance( self ):
+		if self.count < 2:
+			return 0.
+		return self.m2 / ( self.count - 1 )
+
+	# -------------------------------------------------------------------------
+	def std( self ):
+		return math.sqrt( self.variance() )
+
+
+# The newest 'size' values in arrival order and in sorted order.  The window
+# size is fixed, so an add is bounded work no matter how long the shift runs.
+# =============================================================================
+class RollingWindow( object ):
+
+	# -------------------------------------------------------------------------
+	def __init__( self, size=100 ):
+		self.values = deque( maxlen=size )
+		self.sorted = []
+
+	# -------------------------------------------------------------------------
+	def reset( self ):
+		self.values.clear()
+		self.sorted = []
+
+	# -------------------------------------------------------------------------
+	def __len__( self ):
+		return len( self.values )
+
+	# -------------------------------------------------------------------------
+	def add( self, x ):
+		if len( self.values ) == self.values.maxlen:
+			del self.sorted[bisect.bisect_left( self.sorted, self.values[0] )]
+		self.values.append( x )
+		bisect.insort( self.sorted, x )
+
+	# Percentile 'p' (0 - 100) of the window, linear between ranks.
+	# -------------------------------------------------------------------------
+	def percentile( self, p ):
+		n = len( self.sorted )
+		if n == 0:
+			return None
+		pos = ( n - 1 ) * p / 100.
+		lo = int( pos )
+		hi = min( lo + 1, n - 1 )
+		return self.sorted[lo] + ( self.sorted[hi] - self.sorted[lo] ) * ( pos - lo )
+
+
+# X-bar / R chart.  Consecutive shots are grouped 'size' at a time.  The
+# limits come from the mean of all the subgroup means and ranges so far.
+# =============================================================================
+class XbarR( object ):
+
+	# -------------------------------------------------------------------------
+	def __init__( self, size=5 ):
+		if size not in XBAR_R:
+			raise ValueError( "X-bar/R subgroup size must be 2 to 10 -> {}".format( size ) )
+		self.size = size
+		self.a2, self.d3, self.d4 = XBAR_R[size]
+		self.reset()
+
+	# -------------------------------------------------------------------------
+	def reset( self ):
+		self.group = []
+		self.groups = 0
+		self.xbarSum = 0.
+		self.rSum = 0.
+		self.lastXbar = None
+		self.lastR = None
+
+	# Returns True when 'x' completes a subgroup.
+	# -------------------------------------------------------------------------
+	def add( self, x ):
+		self.group.append( x )
+		if len( self.group ) < self.size:
+			return False
+		self.lastXbar = sum( self.group ) / float( self.size )
+		self.lastR = max( self.group ) - min( self.group )
+		self.xbarSum += self.lastXbar
+		self.rSum += self.lastR
+		self.groups += 1
+		self.group = []
+		return True
+
+	# Dict of the center lines and limits, or None before the first subgroup.
+	# -------------------------------------------------------------------------
+	def limits( self ):
+		if self.groups == 0:
+			return None
+		xbarbar = self.xbarSum / self.groups
+		rbar = self.rSum / self.groups
+		return {
+			'xbar': xbarbar,
+			'xbarUCL': xbarbar + self.a2 * rbar,
+			'xbarLCL': xbarbar - self.a2 * rbar,
+			'rbar': rbar,
+			'rUCL': self.d4 * rbar,
+			'rLCL': self.d3 * rbar,
+		}
+
+	# True if the newest subgroup is outside the control limits.
+	# -------------------------------------------------------------------------
+	def outOfControl( self ):
+		lim = self.limits()
+		if lim is None:
+			return False
+		tol = 1e-9		# Rounding, when every shot is the same the limits close up.
+		return ( self.lastXbar > lim['xbarUCL'] + tol or self.lastXbar < lim['xbarLCL'] - tol
+			or self.lastR > lim['rUCL'] + tol or self.lastR < lim['rLCL'] - tol )
+
+
+# All three aggregates for one value.
+# =============================================================================
+class MetricStats( object ):
+
+	# -------------------------------------------------------------------------
+	def __init__( self, window=100, subgroup=5 ):
+		self.running = RunningStats()
+		self.window = RollingWindow( window )
+		self.chart = XbarR( subgroup )
+
+	# -------------------------------------------------------------------------
+	def reset( self ):
+		self.running.reset()
+		self.window.reset()
+		self.chart.reset()
+
+	# -------------------------------------------------------------------------
+	def add( self, x ):
+		self.running.add( x )
+		self.window.add( x )
+		self.chart.add( x )
+
+	# -------------------------------------------------------------------------
+	def summary( self ):
+		r = self.running
+		return {
+			'count': r.count,
+			'mean': r.mean,
+			'std': r.std(),
+			'min': r.min,
+			'max': r.max,
+			'p50': self.window.percentile( 50 ),
+			'p95': self.window.percentile( 95 ),
+			'limits': self.chart.limits(),
+			'outOfControl': self.chart.outOfControl(),
+		}
+
+
+# Shift statistics for the cycle records from the control engine.  Use add()
+# as the engine cycle listener and call update() from the UI thread.
+# =============================================================================
+class ShiftStats( object ):
+
+	# Record keys tracked.
+	metrics = [ 'cycleTm', 'detectWait' ]
+
+	# -------------------------------------------------------------------------
+	def __init__( self, window=100, subgroup=5 ):
+		self.stats = dict( ( name, MetricStats( window, subgroup ) ) for name in self.metrics )
+		self.pending = deque()
+		self.reset()
+
+	# Start a new shift.
+	# -------------------------------------------------------------------------
+	def reset( self ):
+		for m in self.stats.values():
+			m.reset()
+		self.shiftStart = time.time()
+
+	# Queue a cycle record.  Never blocks, safe on the engine thread.
+	# -------------------------------------------------------------------------
+	def add( self, rec ):
+		self.pending.append( rec )
+
+	# Fold in the queued records.  Returns how many there were.
+	# -------------------------------------------------------------------------
+	def update( self ):
+		n = 0
+		while True:
+			try:
+				rec = self.pending.popleft()
+			except IndexError:
+				return n
+			for name in self.metrics:
+				val = rec.get( name )
+				if val is not None:
+					self.stats[name].add( val )
+			n += 1
+
+	# -------------------------------------------------------------------------
+	def summary( self ):
+		out = dict( ( name, m.summary() ) for name, m in self.stats.items() )
+		out['shiftStart'] = self.shiftStart
+		return out
+
+	# Parts per hour from the actual mean cycle time, 0 before the first cycle.
+	# -------------------------------------------------------------------------
+	def partsPerHour( self ):
+		mean = self.stats['cycleTm'].running.mean
+		return 3600. / mean if mean > 0. else 0.
+
+	# Shift report, one line per value.
+	# -------------------------------------------------------------------------
+	def report( self ):
+		lines = [ "Shift since {}".format( time.strftime( "%Y-%m-%d %H:%M", time.localtime( self.shiftStart ) ) ) ]
+		for name in self.metrics:
+			s = self.stats[name].summary()
+			if s['count'] == 0:
+				lines.append( "  {0:<10} no cycles".format( name ) )
+				continue
+			line = "  {0:<10} n {1}  mean {2:.3f}s  sd {3:.3f}s  min {4:.3f}s  max {5:.3f}s  p50 {6:.3f}s  p95 {7:.3f}s".format(
+				name, s['count'], s['mean'], s['std'], s['min'], s['max'], s['p50'], s['p95'] )
+			lim = s['limits']
+			if lim is not None:
+				line += "  X-bar {0:.3f} [{1:.3f}, {2:.3f}]  R {3:.3f} [{4:.3f}, {5:.3f}]".format(
+					lim['xbar'], lim['xbarLCL'], lim['xbarUCL'], lim['rbar'], lim['rLCL'], lim['rUCL'] )
+				if s['outOfControl']:
+					line += "  OUT OF CONTROL"
+			lines.append( line )
+		return "\n".join( lines )
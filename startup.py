@@ -0,0 +1,120 @@
+# =============================================================================
+#
+#	Startup Timing - Where the time goes between power on and a working HMI.
+#
+#	main.py imports this first, then marks each start up step with
+#	startup.mark( "name" ).  When the first frame is on screen, ready()
+#	prints how long each step took, the total from the process start and,
+#	on Linux, from power on (boot).  A start slower than the target prints a
+#	warning.
+#
+#	With ARBURG_STARTUP=1 every import is timed too, and the report lists
+#	the slowest ones.  The hook comes off again at ready(), so it costs
+#	nothing once running.
+#
+#	The report is also on the status server at /startup.
+#
+# =============================================================================
+import os
+import sys
+
+try:
+	import __builtin__ as builtins		# Python 2
+except ImportError:
+	import builtins
+
+from scheduler import monotonic
+
+
+# =============================================================================
+class StartupTimer( object ):
+
+	# -------------------------------------------------------------------------
+	def __init__( self, clock=monotonic ):
+		self.clock = clock
+		self.start = clock()
+		self.marks = []			# ( step name, time it ended ).
+		self.imports = []		# ( module, depth, seconds ) of timed imports.
+		self.depth = 0
+		self.realImport = None
+		self.readyTm = None
+		self.bootTm = None		# Boot to ready (s), None if not known.
+
+	# The step 'name' just finished.
+	# -------------------------------------------------------------------------
+	def mark( self, name ):
+		self.marks.append( ( name, self.clock() ) )
+
+	# Time every import of a module not loaded yet.
+	# -------------------------------------------------------------------------
+	def hookImports( self ):
+		if self.realImport is not None:
+			return
+		self.realImport = builtins.__import__
+
+		def timedImport( name, *args, **kwargs ):
+			if name in sys.modules:
+				return self.realImport( name, *args, **kwargs )
+			self.depth += 1
+			start = self.clock()
+			try:
+				return self.realImport( name, *args, **kwargs )
+			finally:
+				self.depth -= 1
+				self.imports.append( ( name, self.depth, self.clock() - start ) )
+
+		builtins.__import__ = timedImport
+
+	# -------------------------------------------------------------------------
+	def unhookImports( self ):
+		if self.realImport is not None:
+			builtins.__import__ = self.realImport
+			self.realImport = None
+
+	# The HMI is up.
+	# -------------------------------------------------------------------------
+	def ready( self ):
+		self.mark( "First Frame" )
+		self.readyTm = self.clock()
+		self.unhookImports()
+		self.bootTm = uptime()
+
+	# -------------------------------------------------------------------------
+	def report( self, target=None, top=12 ):
+		lines = [ "Startup Steps" ]
+		last = self.start
+		for name, tm in self.marks:
+			lines.append( "  {0:<20} {1:>7.0f} ms".format( name, ( tm - last ) * 1e3 ) )
+			last = tm
+		if self.readyTm is not None:
+			total = self.readyTm - self.start
+			text = "Ready in {0:.2f}s".format( total )
+			if self.bootTm is not None:
+				text += " ({0:.1f}s after power on)".format( self.bootTm )
+			lines.append( text )
+			if target and total > target:
+				lines.append( "Warning: Start up is over the {0:.1f}s target".format( target ) )
+
+		if self.imports:
+			outer = [ imp for imp in self.imports if imp[1] == 0 ]
+			lines.append( "Imports {0:.0f} ms, slowest first".format(
+				sum( dt for name, depth, dt in outer ) * 1e3 ) )
+			for name, depth, dt in sorted( outer, key=lambda imp: -imp[2] )[:top]:
+				lines.append( "  {0:<28} {1:>7.0f} ms".format( name, dt * 1e3 ) )
+		return "\n".join( lines ) + "\n"
+
+
+# Seconds since the machine booted, None if not known.
+# -------------------------------------------------------------------------
+def uptime():
+	try:
+		with open( "/proc/uptime" ) as f:
+			return float( f.read().split()[0] )
+	except ( IOError, OSError, ValueError, IndexError ):
+		return None
+
+
+# The one timer main.py shares.
+startup = StartupTimer()
+if os.environ.get( 'ARBURG_STARTUP', "0" ) not in [ "", "0" ]:
+	startup.hookImports()
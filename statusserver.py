@@ -0,0 +1,181 @@
+# =============================================================================
+#
+#	Status Server - Press state over HTTP.
+#
+#		/status		JSON of the newest press status.
+#		/metrics	The same numbers in Prometheus text format.
+#
+#	Other plain text pages can be added with the 'pages' argument.  Anything
+#	that changes state goes in 'actions' instead, which only answer a POST,
+#	so a crawler or a link preview can never trip one.
+#
+#	The server runs on its own threads and only reads the status snapshot the
+#	control engine already published.  A scrape never touches the GPIO and
+#	never takes a lock the control loop uses.
+#
+#	It only listens on this machine (127.0.0.1) unless given another host.
+#	The actions have no login, so open it to the network ("" for every
+#	interface) only on a trusted plant network.
+#
+#	Ex:	curl http://127.0.0.1:8080/status
+#
+# =============================================================================
+import json
+import threading
+
+try:
+	from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+	from SocketServer import ThreadingMixIn
+except ImportError:
+	from http.server import BaseHTTPRequestHandler, HTTPServer
+	from socketserver import ThreadingMixIn
+
+
+# Prometheus metrics: ( name, type, help, status key ).
+METRICS = [
+	( 'arburg_timer_seconds', 'gauge', "Time in the current cycle.", 'timer' ),
+	( 'arburg_part_count', 'gauge', "Parts made since the app started.", 'partCount' ),
+	( 'arburg_total_count', 'gauge', "Parts on the recipe's total counter.", 'totalCount' ),
+	( 'arburg_temp_celsius', 'gauge', "Barrel temperature.", 'tempC' ),
+	( 'arburg_temp_setpoint_celsius', 'gauge', "Barrel temperature setpoint.", 'setPt' ),
+	( 'arburg_heater_duty_percent', 'gauge', "Heater band output.", 'heaterOut' ),
+	( 'arburg_estop', 'gauge', "1 while the e-stop is active.", 'estop' ),
+	( 'arburg_power_ok', 'gauge', "0 after the UPS reports power lost.", 'powerOK' ),
+	( 'arburg_loop_ticks_total', 'counter', "Control loop passes.", 'loopTicks' ),
+	( 'arburg_loop_overruns_total', 'counter', "Control loop passes that ran late.", 'loopOverruns' ),
+	( 'arburg_loop_missed_total', 'counter', "Control loop ticks skipped.", 'loopMissed' ),
+	( 'arburg_loop_jitter_seconds', 'gauge', "Last control loop wake up jitter.", 'loopJitter' ),
+	( 'arburg_loop_jitter_max_seconds', 'gauge', "Worst control loop wake up jitter.", 'loopJitterMax' ),
+	( 'arburg_status_age_seconds', 'gauge', "Age of the engine snapshot.", 'age' ),
+]
+
+
+# Flat status dict from an engine snapshot.  'extra' is merged in last.
+# -------------------------------------------------------------------------
+def snapshotStatus( snap, now, extra=None ):
+	status = {}
+	if snap is not None:
+		loop = snap['loop']
+		status.update( {
+			'mode': snap['mode'],
+			'state': snap['state'],
+			'timer': snap['timer'],
+			'partCount': snap['partCount'],
+			'totalCount': snap['totalCount'],
+			'tempC': snap['tempC'],
+			'heaterOut': snap['heaterOut'],
+			'estop': snap['estop'],
+			'powerOK': snap['powerOK'],
+			'loopTicks': loop['ticks'],
+			'loopOverruns': loop['overruns'],
+			'loopMissed': loop['missed'],
+			'loopJitter': loop['lastJitter'],
+			'loopJitterMax': loop['maxJitter'],
+			'age': now - snap['time'],
+		} )
+	if extra:
+		status.update( extra )
+	return status
+
+
+# Prometheus text format of a status dict.  Missing and None values are left
+# out.
+# -------------------------------------------------------------------------
+def formatMetrics( status ):
+	lines = []
+	for name, kind, text, key in METRICS:
+		val = status.get( key )
+		if val is None:
+			continue
+		lines.append( "# HELP {} {}".format( name, text ) )
+		lines.append( "# TYPE {} {}".format( name, kind ) )
+		lines.append( "{} {}".format( name, float( val ) ) )
+	for key in [ 'mode', 'state' ]:
+		if status.get( key ) is not None:
+			lines.append( "# TYPE arburg_{} gauge".format( key ) )
+			lines.append( 'arburg_{0}{{{0}="{1}"}} 1'.format( key, status[key] ) )
+	return "\n".join( lines ) + "\n"
+
+
+# -------------------------------------------------------------------------
+class StatusHandler( BaseHTTPRequestHandler ):
+
+	# -------------------------------------------------------------------------
+	def do_GET( self ):
+		path = self.path.split( '?' )[0]
+		page = self.server.pages.get( path )
+		if page is not None:
+			try:
+				self.reply( 200, "text/plain", page() )
+			except Exception as e:
+				self.reply( 500, "text/plain", "Page Error: {}\n".format( e ) )
+			return
+		try:
+			status = self.server.status()
+		except Exception as e:
+			self.reply( 500, "text/plain", "Status Error: {}\n".format( e ) )
+			return
+		if path in [ "/", "/status" ]:
+			self.reply( 200, "application/json", json.dumps( status, sort_keys=True ) )
+		elif path == "/metrics":
+			self.reply( 200, "text/plain; version=0.0.4", formatMetrics( status ) )
+		else:
+			self.reply( 404, "text/plain", "Not Found\n" )
+
+	# -------------------------------------------------------------------------
+	def do_POST( self ):
+		path = self.path.split( '?' )[0]
+		action = self.server.actions.get( path )
+		if action is None:
+			self.reply( 404, "text/plain", "Not Found\n" )
+			return
+		try:
+			self.reply( 200, "text/plain", action() )
+		except Exception as e:
+			self.reply( 500, "text/plain", "Action Error: {}\n".format( e ) )
+
+	# -------------------------------------------------------------------------
+	def reply( self, code, contentType, body ):
+		body = body.encode( 'utf-8' )
+		self.send_response( code )
+		self.send_header( "Content-Type", contentType )
+		self.send_header( "Content-Length", str( len( body ) ) )
+		self.end_headers()
+		self.wfile.write( body )
+
+	# Keep scrapes off the console.
+	# -------------------------------------------------------------------------
+	def log_message( self, format, *args ):
+		pass
+
+
+# -------------------------------------------------------------------------
+class ThreadingHTTPServer( ThreadingMixIn, HTTPServer ):
+	daemon_threads = True
+	allow_reuse_address = True
+
+
+# The server.  'status' is called for each request and returns a flat dict,
+# see snapshotStatus().  It must only read cached values.  'pages' maps more
+# paths to functions returning plain text, 'actions' the same for POST.
+# =============================================================================
+class StatusServer( threading.Thread ):
+
+	# -------------------------------------------------------------------------
+	def __init__( self, status, port=8080, host="127.0.0.1", pages=None, actions=None ):
+		super( StatusServer, self ).__init__()
+		self.daemon = True
+		self.httpd = ThreadingHTTPServer( ( host, port ), StatusHandler )
+		self.httpd.status = status
+		self.httpd.pages = pages or {}
+		self.httpd.actions = actions or {}
+
+	# -------------------------------------------------------------------------
+	def run( self ):
+		self.httpd.serve_forever( poll_interval=0.5 )
+
+	# -------------------------------------------------------------------------
+	def stop( self ):
+		if self.is_alive():
+			self.httpd.shutdown()
+		self.httpd.server_close()
@@ -0,0 +1,171 @@
+# =============================================================================
+#
+#	Thermocouple Sampler - Background reads of the MAX6675 barrel temperature.
+#
+#	tempTC.readTempC() is a blocking SPI transfer, so it can not sit in the
+#	control loop.  TempSampler reads the chip on its own thread as fast as
+#	the chip converts (0.22s max per conversion, reading sooner just aborts
+#	the conversion in progress) and keeps the samples in a fixed size ring
+#	buffer.  The controller and the UI read the buffer without locks.
+#
+# =============================================================================
+import threading
+import time
+from array import array
+
+from scheduler import monotonic
+
+
+# MAX6675 max conversion time (s).  Reading faster than this restarts the
+# conversion and returns the old value.
+MAX6675_PERIOD = 0.22
+
+
+# Used to test if a number is NaN (Not a Number).  The thermocouple lib
+# returns a NaN if the sensor is unplugged.
+# -------------------------------------------------------------------------
+def isNaN(num):
+	return num != num
+
+
+# Fixed size ring buffer of numeric records.  Each record is 'fields'
+# floats.  There must be only one writer thread.  Readers never lock.  They
+# copy the data and then check the writer did not lap them while copying.
+# =============================================================================
+class RingBuffer( object ):
+
+	# -------------------------------------------------------------------------
+	def __init__( self, size, fields=1, typecode='d' ):
+		self.size = size
+		self.fields = fields
+		self.data = array( typecode, [0] * ( size * fields ) )
+		self.count = 0		# Total records ever written.
+
+	# -------------------------------------------------------------------------
+	def __len__( self ):
+		return min( self.count, self.size )
+
+	# Write one record.  Writer thread only.
+	# -------------------------------------------------------------------------
+	def append( self, *vals ):
+		base = ( self.count % self.size ) * self.fields
+		self.data[base:base + self.fields] = array( self.data.typecode, vals )
+		self.count += 1		# Publish the record after it is written.
+
+	# Newest record as a tuple, or None if empty.
+	# -------------------------------------------------------------------------
+	def last( self ):
+		count = self.count
+		if count == 0:
+			return None
+		base = ( ( count - 1 ) % self.size ) * self.fields
+		return tuple( self.data[base:base + self.fields] )
+
+	# List of the newest 'n' records (all if None), oldest first.  At most
+	# size - 1, the slot of the oldest is the one the writer fills next.
+	# -------------------------------------------------------------------------
+	def records( self, n=None ):
+		while True:
+			count = self.count
+			avail = min( count, self.size - 1 )
+			if n is not None:
+				avail = min( avail, n )
+			start = count - avail
+			out = []
+			for i in range( start, count ):
+				base = ( i % self.size ) * self.fields
+				out.append( tuple( self.data[base:base + self.fields] ) )
+			# If the writer wrapped onto the oldest record we copied, go again.
+			# It writes record 'count' into the slot of 'count - size' before
+			# it bumps the count, so that slot is already unsafe.
+			if self.count - start < self.size:
+				return out
+
+
+# Samples the MAX6675 on a background thread.  Bad (NaN) reads are counted
+# but never stored.
+# =============================================================================
+class TempSampler( threading.Thread ):
+
+	# -------------------------------------------------------------------------
+	def __init__( self, sensor, period=MAX6675_PERIOD, history=4096 ):
+		super( TempSampler, self ).__init__()
+		self.daemon = True
+		self.sensor = sensor
+		self.period = period
+		self.samples = RingBuffer( history, fields=2 )	# ( time stamp, deg C )
+		self.nanCount = 0			# Reads that came back NaN (sensor open).
+		self.errCount = 0			# Reads that raised an error.
+		self.sensorOK = False		# Last read was a good temperature.
+		self.stopEvent = threading.Event()
+
+	# -------------------------------------------------------------------------
+	def stop( self ):
+		self.stopEvent.set()
+		if self.is_alive():
+			self.join( 1.0 )
+
+	# -------------------------------------------------------------------------
+	def run( self ):
+		nextTm = monotonic()
+		while not self.stopEvent.is_set():
+			self.sample()
+			nextTm += self.period
+			wait = nextTm - monotonic()
+			if wait > 0.:
+				time.sleep( wait )
+			else:
+				nextTm = monotonic()	# Fell behind, do not burst to catch up.
+
+	# Take one reading.
+	# -------------------------------------------------------------------------
+	def sample( self ):
+		try:
+			tc = self.sensor.readTempC()
+		except Exception:
+			self.errCount += 1
+			self.sensorOK = False
+			return
+		if tc is None or isNaN( tc ):
+			self.nanCount += 1
+			self.sensorOK = False
+			return
+		self.samples.append( monotonic(), tc )
+		self.sensorOK = True
+
+	# Newest ( time stamp, deg C ), or None before the first good read.
+	# -------------------------------------------------------------------------
+	def latest( self ):
+		return self.samples.last()
+
+	# Good readings newer than time stamp 'tm' (every one kept if None), as
+	# ( time stamp, deg C ), oldest first.  Reads back from the newest 'n' at
+	# a time, so a caller that keeps up only copies a few.
+	# -------------------------------------------------------------------------
+	def since( self, tm, n=8 ):
+		while True:
+			recs = self.samples.records( n )
+			if tm is not None and recs and recs[0][0] <= tm:
+				return [ rec for rec in recs if rec[0] > tm ]
+			if len( recs ) < n:
+				return recs
+			n *= 2
+
+	# Newest ( time stamp, deg C ), or None if the sensor is unplugged or the
+	# reading is older than 'maxAge' seconds.
+	# -------------------------------------------------------------------------
+	def reading( self, maxAge=2. ):
+		last = self.samples.last()
+		if last is None or not self.sensorOK:
+			return None
+		if monotonic() - last[0] > maxAge:
+			return None
+		return last
+
+	# Newest temperature, or None if there is no good recent reading.
+	# -------------------------------------------------------------------------
+	def tempC( self, maxAge=2. ):
+		last = self.reading( maxAge )
+		if last is None:
+			return None
+		return last[1]
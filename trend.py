@@ -0,0 +1,103 @@
+# =============================================================================
+#
+#	Temperature Trend - Decimated history of the barrel temperature.
+#
+#	Raw samples are never kept.  Each TrendBuffer is a ring of one bucket
+#	per pixel column across the chart.  A new sample only updates the min and
+#	max temperature, setpoint and mean duty of the current bucket, so adding
+#	is O(1) and drawing is one pass over the columns no matter how many hours
+#	are on screen.  Kept apart from chart.py so recording does not need the
+#	Kivy graphics loaded.
+#
+# =============================================================================
+from array import array
+
+
+NAN = float( 'nan' )
+
+# Chart spans offered (s), and the pixel columns across the 800x480 screen.
+SPANS = [ 10 * 60, 60 * 60, 8 * 60 * 60 ]
+COLUMNS = 760
+
+
+# One pixel column per bucket, 'span' seconds across.
+# =============================================================================
+class TrendBuffer( object ):
+
+	# -------------------------------------------------------------------------
+	def __init__( self, span, columns=COLUMNS ):
+		self.span = span
+		self.columns = columns
+		self.bucketTm = span / float( columns )
+		self.tMin = array( 'd', [NAN] * columns )
+		self.tMax = array( 'd', [NAN] * columns )
+		self.setPt = array( 'd', [NAN] * columns )
+		self.dutySum = array( 'd', [0.] * columns )
+		self.count = array( 'l', [0] * columns )
+		self.bucket = None		# Absolute index of the newest bucket.
+
+	# -------------------------------------------------------------------------
+	def clear( self, i ):
+		self.tMin[i] = NAN
+		self.tMax[i] = NAN
+		self.setPt[i] = NAN
+		self.dutySum[i] = 0.
+		self.count[i] = 0
+
+	# Add a sample taken at time 'tm' (s).
+	# -------------------------------------------------------------------------
+	def add( self, tm, temp, setPt, duty ):
+		b = int( tm // self.bucketTm )
+		if self.bucket is None or b - self.bucket >= self.columns:
+			for i in range( self.columns ):
+				self.clear( i )
+			self.bucket = b
+		while self.bucket < b:		# Empty the buckets we moved past.
+			self.bucket += 1
+			self.clear( self.bucket % self.columns )
+		if b < self.bucket:
+			return		# Older than the newest bucket, ignore.
+
+		i = b % self.columns
+		if self.count[i] == 0:
+			self.tMin[i] = temp
+			self.tMax[i] = temp
+		else:
+			if temp < self.tMin[i]:
+				self.tMin[i] = temp
+			if temp > self.tMax[i]:
+				self.tMax[i] = temp
+		self.setPt[i] = setPt
+		self.dutySum[i] += duty
+		self.count[i] += 1
+
+	# Yields ( column, min, max, setpoint, mean duty ) for each filled bucket,
+	# oldest column (0) to newest.
+	# -------------------------------------------------------------------------
+	def buckets( self ):
+		if self.bucket is None:
+			return
+		first = self.bucket - self.columns + 1
+		for col in range( self.columns ):
+			i = ( first + col ) % self.columns
+			n = self.count[i]
+			if n:
+				yield col, self.tMin[i], self.tMax[i], self.setPt[i], self.dutySum[i] / n
+
+
+# A TrendBuffer for each chart span.  Feed it every sample.
+# =============================================================================
+class TrendHistory( object ):
+
+	# -------------------------------------------------------------------------
+	def __init__( self, spans=SPANS, columns=COLUMNS ):
+		self.buffers = dict( ( span, TrendBuffer( span, columns ) ) for span in spans )
+		self.lastTm = None
+
+	# -------------------------------------------------------------------------
+	def add( self, tm, temp, setPt, duty ):
+		if tm == self.lastTm:
+			return		# Same sample as last time.
+		self.lastTm = tm
+		for buf in self.buffers.values():
+			buf.add( tm, temp, setPt, duty )
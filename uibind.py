@@ -0,0 +1,66 @@
+# =============================================================================
+#
+#	UI Binding - Only touch the widgets when what they show changes.
+#
+#	Setting a Kivy property, even to the value it already has, costs a
+#	property dispatch, and a list or tuple (colors) never compares equal to
+#	the ObservableList it is stored as, so it redraws every time.  show()
+#	compares the new value with the one on the widget first and skips the
+#	set if they match.  The widget always holds what was last rendered, so
+#	this stays right when something else (the user, the kv rules) sets it.
+#
+#	setMaxFps() changes the Kivy frame rate cap at run time.  The window
+#	runs slow while the press sits in Manual / Idle and nothing moves, which
+#	saves CPU and heat in the closed box.
+#
+# =============================================================================
+
+
+# =============================================================================
+class UiBinding( object ):
+
+	# -------------------------------------------------------------------------
+	def __init__( self ):
+		self.sets = 0		# Property sets done.
+		self.skips = 0		# Property sets skipped, already shown.
+
+	# Set 'widget.prop' to 'val' if it is not already.  Returns True if set.
+	# -------------------------------------------------------------------------
+	def show( self, widget, prop, val ):
+		cur = getattr( widget, prop )
+		if isinstance( val, ( list, tuple ) ):
+			same = list( cur ) == list( val )
+		else:
+			same = cur == val
+		if same:
+			self.skips += 1
+			return False
+		setattr( widget, prop, val )
+		self.sets += 1
+		return True
+
+	# -------------------------------------------------------------------------
+	def report( self ):
+		total = self.sets + self.skips
+		return "UI Sets: {0}  Skipped: {1} ({2:.0f}%)".format( self.sets, self.skips,
+			100. * self.skips / total if total else 0. )
+
+
+maxFpsMissing = 0		# setMaxFps() calls that found no '_max_fps'.
+
+
+# Set the Kivy frame rate cap.  Kivy reads 'maxfps' from the config once at
+# start up, so this sets the clock's copy of it.  0 is no cap.  That copy is
+# the private '_max_fps', on the clock since Kivy 1.9 and still there in
+# 2.x (ClockBaseBehavior).  If a Kivy without it is installed, the display
+# keeps its start up rate; that is printed once and False returned.
+# -------------------------------------------------------------------------
+def setMaxFps( clock, fps ):
+	global maxFpsMissing
+	if not hasattr( clock, '_max_fps' ):
+		if maxFpsMissing == 0:
+			print( "UI Warning: This Kivy clock has no _max_fps, idle frame rate not set" )
+		maxFpsMissing += 1
+		return False
+	clock._max_fps = float( fps )
+	return True
@@ -0,0 +1,244 @@
+# =============================================================================
+#
+#	What If - Replays a recorded shot log with other cycle settings.
+#
+#	Each recorded shot gives how long its part took to drop after the mold
+#	opened.  That is the one thing the settings can not change, so the shift
+#	can be run again with another CycTm, InjTm, MoldOpenDelay or eject
+#	sequence, and the idle time between shots kept as it was.  The auto cycle
+#	is worked out for every shot at once with NumPy, so a day of shots takes
+#	a fraction of a second per setting.
+#
+#	The part drop, as in the simulated press, is when it falls by itself or
+#	a blow off time after the blow off comes on, whichever is first.  A part
+#	that came down after the recorded blow off came on may have needed it.
+#	Moving the blow off later moves its drop later by the same, moving it
+#	sooner is not counted on.  That errs on the side of more detect waits,
+#	never fewer.
+#
+#	Detect risk is the part of the shots where the part is not down by the
+#	end of the eject window, so the press sits in Detect waiting for it.
+#	Shots with no part detect at all are counted on their own.
+#
+#	Comma lists try every combination.
+#
+#	Ex:	python whatif.py shotlog --cyc 18,19,20 --open 0.6,0.8
+#		python whatif.py shotlog --eject 0:blowOn,0.3:blowOff,0.5:end
+#
+#	Settings not given on the command line stay as recorded.  The eject
+#	sequences the shots ran with come from the saved settings.  Adaptive open
+#	delay depends on each cycle before it, use simulate.py for that.
+#
+# =============================================================================
+import argparse
+import itertools
+import time
+
+import numpy as np
+
+from control import ejectSequence, shotStages, AUTO, AUTO2, EJECT_SEQ, DOUBLE_EJECT_SEQ
+from shotlog import readShots
+
+
+PERIOD = 0.01		# Engine loop period (s).
+
+
+# Time after the open delay the blow off first comes on (inf for never), and
+# the eject end, for an eject sequence.
+# -------------------------------------------------------------------------
+def ejectTimes( seq ):
+	steps, end = ejectSequence( seq )
+	blowOn = [ tm for tm, action in steps if action == "blowOn" ]
+	return ( blowOn[0] if blowOn else np.inf ), end
+
+
+# The recorded auto shots as a dict of per shot arrays.  'settings' holds
+# the eject sequences they ran with (EjectSeq, DoubleEjectSeq).
+#
+#	mold		Mold closed time (s).
+#	open, eject	Open delay and eject time (s).
+#	blowOn		Open to blow off on (s).
+#	drop		Open to part detect (s), NaN for none.
+#	gap			Idle time to the next shot (s).
+# -------------------------------------------------------------------------
+def recorded( shots, settings ):
+	auto = ( shots['mode'] == AUTO ) | ( shots['mode'] == AUTO2 )
+	gap = np.zeros( len( shots ) )
+	if len( shots ) > 1:
+		ends = shots['start'] + shots['cycleTm']
+		gap[:-1] = np.clip( shots['start'][1:] - ends[:-1], 0., None )
+	shots, gap = shots[auto], gap[auto]
+
+	single = ejectTimes( settings.get( 'EjectSeq', EJECT_SEQ ) )
+	dbl = ejectTimes( settings.get( 'DoubleEjectSeq', DOUBLE_EJECT_SEQ ) )
+	double = shots['doubleEject'] == 1
+	openTm = shots['open'].astype( float )
+	return {
+		'count': len( shots ),
+		'cycleTm': shots['cycleTm'].astype( float ),
+		'mode': shots['mode'],
+		'injTm': shots['injTm'].astype( float ),
+		'mold': ( shots['injTm'] + shots['coolTm'] ).astype( float ),
+		'open': openTm,
+		'eject': shots['eject'].astype( float ),
+		'double': double,
+		'singleSeq': single,
+		'doubleSeq': dbl,
+		'blowOn': openTm + np.where( double, dbl[0], single[0] ),
+		'drop': shots['detectLatency'].astype( float ),
+		'gap': gap,
+	}
+
+
+# Run the recorded shots with 'change', a dict of any of CycTm, InjTm,
+# MoldOpenDelay, DoubleEject, EjectSeq, DoubleEjectSeq, ShotProfile.
+# Returns a summary dict.
+# -------------------------------------------------------------------------
+def evaluate( rec, change, timeout=1., period=PERIOD ):
+	count = rec['count']
+	mold = rec['mold']
+	if 'CycTm' in change or 'InjTm' in change:
+		# Auto injects for InjTm then cools to CycTm.  The mold opens at
+		# whichever is later.
+		injTm = change.get( 'InjTm', rec['injTm'] )
+		cycTm = change.get( 'CycTm', rec['mold'] )
+		mold = np.where( rec['mode'] == AUTO, np.maximum( injTm, cycTm ), mold )
+	if 'ShotProfile' in change:
+		profileTm = sum( tm for kind, tm in shotStages( change['ShotProfile'] ) )
+		mold = np.where( rec['mode'] == AUTO2, profileTm, mold )
+
+	if 'MoldOpenDelay' in change:
+		openTm = np.full( count, float( change['MoldOpenDelay'] ) )
+	else:
+		openTm = rec['open']
+
+	if 'DoubleEject' in change or 'EjectSeq' in change or 'DoubleEjectSeq' in change:
+		double = np.full( count, bool( change['DoubleEject'] ) ) \
+			if 'DoubleEject' in change else rec['double']
+		single = ejectTimes( change['EjectSeq'] ) if 'EjectSeq' in change else rec['singleSeq']
+		dbl = ejectTimes( change['DoubleEjectSeq'] ) if 'DoubleEjectSeq' in change else rec['doubleSeq']
+		eject = np.where( double, dbl[1], single[1] )
+		blowOn = openTm + np.where( double, dbl[0], single[0] )
+	else:
+		eject = rec['eject']
+		blowOn = openTm + ( rec['blowOn'] - rec['open'] )
+
+	# A part that came down after the recorded blow off came on is late by
+	# as much as the blow off is.  No blow off at all, it never drops.
+	with np.errstate( invalid='ignore' ):
+		blown = rec['drop'] >= rec['blowOn']
+		drop = np.where( blown, rec['drop'] + np.maximum( blowOn - rec['blowOn'], 0. ), rec['drop'] )
+	missed = ~np.isfinite( drop )
+	ok = ~missed
+
+	window = openTm + eject
+	late = np.clip( np.where( ok, drop, 0. ) - window, 0., None )
+	# The engine sees the part on its first pass after it lands.  Allow for
+	# float32 noise in the log.
+	wait = np.where( late > 1e-5, ( np.floor( late / period + 1e-3 ) + 1. ) * period, 0. )
+	cycleTm = mold + window + wait
+	run = cycleTm[ok].sum()
+	total = run + rec['gap'][ok].sum()
+	made = int( ok.sum() )
+	return {
+		'shots': made,
+		'missed': int( missed.sum() ),
+		'meanCycleTm': run / made if made else 0.,
+		'partsPerHour': 3600. * made / run if run else 0.,
+		'shiftPartsPerHour': 3600. * made / total if total else 0.,
+		'late': float( ( wait[ok] > 0. ).mean() ) if made else 0.,
+		'overTimeout': int( ( wait[ok] > timeout ).sum() ),
+		'meanWait': float( wait[ok].mean() ) if made else 0.,
+		'maxWait': float( wait[ok].max() ) if made else 0.,
+		'cycleTm': cycleTm,
+	}
+
+
+# How well the model gives back the recorded cycle times, with nothing
+# changed.  Returns ( mean, max ) absolute error (s).
+# -------------------------------------------------------------------------
+def modelError( rec, result ):
+	ok = ~np.isnan( rec['drop'] )
+	if not ok.any():
+		return 0., 0.
+	err = np.abs( result['cycleTm'][ok] - rec['cycleTm'][ok] )
+	return float( err.mean() ), float( err.max() )
+
+
+# Parse "1,2.5" into a list of floats, None stays None.
+# -------------------------------------------------------------------------
+def floatList( text ):
+	if text is None:
+		return [ None ]
+	return [ float( v ) for v in text.split( ',' ) ]
+
+
+# Parse "0:blowOn,0.3:blowOff,0.5:end" into an eject sequence.
+# -------------------------------------------------------------------------
+def stepList( text ):
+	return [ [ float( tm ), action ] for tm, action in
+		( step.split( ':' ) for step in text.split( ',' ) ) ]
+
+
+# -------------------------------------------------------------------------
+def printRow( name, s ):
+	print( "{0:<28} {1:>6} {2:>8.3f} {3:>8.1f} {4:>8.1f} {5:>6.1f}% {6:>7.3f} {7:>7.3f} {8:>5} {9:>6}".format(
+		name, s['shots'], s['meanCycleTm'], s['partsPerHour'], s['shiftPartsPerHour'],
+		s['late'] * 100., s['meanWait'], s['maxWait'], s['overTimeout'], s['missed'] ) )
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser( description="Replay a shot log with other settings." )
+	parser.add_argument( 'path', help="Shot log file or directory" )
+	parser.add_argument( '--cyc', help="Mold close time(s) (s), eg. 18,19,20" )
+	parser.add_argument( '--inj', help="Injection time(s) (s)" )
+	parser.add_argument( '--open', help="Mold open delay(s) (s)" )
+	parser.add_argument( '--double', choices=[ "on", "off" ], help="Double eject" )
+	parser.add_argument( '--eject', help="Eject sequence, eg. 0:blowOn,0.3:blowOff,0.5:end" )
+	parser.add_argument( '--double-eject', help="Double eject sequence" )
+	parser.add_argument( '--profile', help="Shot profile, eg. inject:6,cool:2,inject:4,cool:8" )
+	parser.add_argument( '--timeout', type=float, default=1., help="Detect wait to count as a timeout (s)" )
+	args = parser.parse_args()
+
+	from simulate import savedSettings
+	settings = savedSettings()
+
+	start = time.time()
+	shots = readShots( args.path )
+	rec = recorded( shots, settings )
+	if rec['count'] == 0:
+		print( "No auto shots in {}".format( args.path ) )
+		raise SystemExit( 1 )
+
+	fixed = {}
+	if args.double is not None:
+		fixed['DoubleEject'] = args.double == "on"
+	if args.eject:
+		fixed['EjectSeq'] = stepList( args.eject )
+	if args.double_eject:
+		fixed['DoubleEjectSeq'] = stepList( args.double_eject )
+	if args.profile:
+		fixed['ShotProfile'] = [ [ kind, float( tm ) ]
+			for kind, tm in ( stage.split( ':' ) for stage in args.profile.split( ',' ) ) ]
+
+	print( "{0:<28} {1:>6} {2:>8} {3:>8} {4:>8} {5:>7} {6:>7} {7:>7} {8:>5} {9:>6}".format(
+		"Settings", "Shots", "Cycle s", "Run P/H", "Shift P/H", "Late", "Wait s", "Max s",
+		">{:g}s".format( args.timeout ), "Missed" ) )
+	recordedRun = evaluate( rec, {}, args.timeout )
+	printRow( "As recorded", recordedRun )
+	for cyc, inj, openTm in itertools.product( floatList( args.cyc ), floatList( args.inj ),
+			floatList( args.open ) ):
+		change = dict( fixed )
+		names = []
+		for key, val, name in [ ( 'CycTm', cyc, "cyc" ), ( 'InjTm', inj, "inj" ),
+				( 'MoldOpenDelay', openTm, "open" ) ]:
+			if val is not None:
+				change[key] = val
+				names.append( "{}={:g}".format( name, val ) )
+		if not change:
+			continue
+		printRow( " ".join( names + sorted( fixed ) ), evaluate( rec, change, args.timeout ) )
+
+	err = modelError( rec, recordedRun )
+	print( "Model check vs recorded cycle times: mean error {0:.3f}s  max {1:.3f}s".format( *err ) )
+	print( "{0} shots in {1:.2f}s".format( rec['count'], time.time() - start ) )